@@ -1,16 +1,14 @@
 
-from fastapi import FastAPI, UploadFile, Request
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, UploadFile, Request
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-import os, uuid, json
+import hashlib, os, shutil, uuid, json
 from typing import Optional
-from core.video import extract_keyframes
 from core.schemas import Config
-from core.prompt import build_prompt
-from core.llm import call_llm
-from core.eval import evaluate_run
-from core.reports import write_html_report
+from core.pipeline import cache, run_analysis
+from core.jobs import JobQueue
+from core import executors, http_client, llm, ratelimit, router
 import yaml
 
 app = FastAPI()
@@ -18,6 +16,12 @@ BASE_DIR = os.path.dirname(__file__)
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 DATA_DIR = os.path.join(BASE_DIR, "data")
 RUNS_DIR = os.path.join(STATIC_DIR, "runs")
+# Uploads are streamed to disk in chunks of this size, up to MAX_UPLOAD_BYTES
+UPLOAD_CHUNK_BYTES = 1 << 20
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(2 << 30)))
+# Analyses run concurrently by the background job queue
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+CONFIG_FILE = "config.txt"
 
 os.makedirs(RUNS_DIR, exist_ok=True)
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
@@ -49,57 +53,166 @@ def parse_config_text(bytes_buf: bytes) -> Config:
         "file_size_bucket": kv.get("file_size_bucket","medium"),
         "protection_level": kv.get("protection_level","none"),
         "file_type": kv.get("file_type","xlsx"),
-        "notes": kv.get("notes","")
+        "notes": kv.get("notes",""),
+        "detector": kv.get("detector","hist"),
+        "min_scene_delta": kv.get("min_scene_delta") or None,
+        "dedupe": kv.get("dedupe","false").lower() in ("true","yes","1"),
+        "max_frames": kv.get("max_frames") or None,
+        "token_budget": kv.get("token_budget") or None,
+        "byte_budget": kv.get("byte_budget") or None,
+        "delta_regions": kv.get("delta_regions","false").lower() in ("true","yes","1"),
+        "window_size": kv.get("window_size") or None,
+        "window_overlap": kv.get("window_overlap") or 2,
+        "consolidate": kv.get("consolidate","false").lower() in ("true","yes","1"),
+        "llm_cache": kv.get("llm_cache","use"),
+        "stream": kv.get("stream","false").lower() in ("true","yes","1")
     }
     return Config(**obj)
 
-@app.get("/", response_class=HTMLResponse)
-def index(request: Request):
-    # list runs
-    runs = []
-    if os.path.exists(RUNS_DIR):
-        runs = sorted(os.listdir(RUNS_DIR), reverse=True)[:20]
-    return templates.TemplateResponse("index.html", {"request": request, "runs": runs})
+async def save_upload(upload: UploadFile, path: str, max_bytes: int = MAX_UPLOAD_BYTES) -> str:
+    """
+    Stream an upload to `path` one chunk at a time and return its sha256.
 
-@app.post("/analyze")
-async def analyze(request: Request, video: UploadFile, config_text: UploadFile):
+    Memory per request stays at one chunk whatever the video size. Uploads
+    over `max_bytes` are deleted and rejected with 413.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                await executors.run_io(f.write, chunk)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return digest.hexdigest()
+
+def _write_bytes(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+async def save_inputs(video: UploadFile, config_text: UploadFile):
+    """Create a run dir holding the uploaded video and config; returns (run_id, run_dir, vid_path, video_hash, cfg)."""
     run_id = str(uuid.uuid4())
     run_dir = os.path.join(RUNS_DIR, run_id)
     frames_dir = os.path.join(run_dir, "frames")
     os.makedirs(frames_dir, exist_ok=True)
 
-    # Save inputs
-    vid_path = os.path.join(run_dir, video.filename)
-    with open(vid_path, "wb") as f:
-        f.write(await video.read())
+    try:
+        vid_path = os.path.join(run_dir, os.path.basename(video.filename or "video.mp4"))
+        video_hash = await save_upload(video, vid_path)
 
-    cfg_bytes = await config_text.read()
-    cfg = parse_config_text(cfg_bytes)
+        cfg_bytes = await config_text.read()
+        cfg = parse_config_text(cfg_bytes)
+        await executors.run_io(_write_bytes, os.path.join(run_dir, CONFIG_FILE), cfg_bytes)
+    except Exception:
+        shutil.rmtree(run_dir, ignore_errors=True)
+        raise
+    return run_id, run_dir, vid_path, video_hash, cfg
 
-    # Extract frames
-    frames = extract_keyframes(vid_path, frames_dir)
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
 
-    # Build prompt and call LLM
-    prompt = build_prompt(cfg, frames)
-    llm_json = await call_llm(prompt)  # returns dict
+async def run_job(job: dict, progress) -> dict:
+    run_dir = os.path.join(RUNS_DIR, job["id"])
+    cfg = parse_config_text(await executors.run_io(_read_bytes, os.path.join(run_dir, CONFIG_FILE)))
+    return await run_analysis(
+        run_dir, job["video_path"], cfg, video_hash=job["video_hash"], progress=progress,
+        priority=job.get("priority", "interactive")
+    )
 
-    # Persist outputs
-    with open(os.path.join(run_dir, "llm_output.json"), "w", encoding="utf-8") as f:
-        json.dump(llm_json, f, indent=2, ensure_ascii=False)
+jobs = JobQueue(RUNS_DIR, run_job, workers=JOB_WORKERS)
 
-    # Eval vs built-in golden list
-    eval_payload = evaluate_run(cfg.scenario_id, llm_json)
-    with open(os.path.join(run_dir, "eval.json"), "w", encoding="utf-8") as f:
-        json.dump(eval_payload, f, indent=2, ensure_ascii=False)
+@app.on_event("startup")
+async def start_jobs():
+    await http_client.start()
+    await jobs.start()
 
-    # Write HTML report
-    report_path = write_html_report(run_dir, cfg, frames, llm_json, eval_payload)
+@app.on_event("shutdown")
+async def stop_jobs():
+    await jobs.stop()
+    await http_client.close()
+    executors.shutdown()
+
+@app.get("/", response_class=HTMLResponse)
+def index(request: Request):
+    # list runs
+    runs = []
+    if os.path.exists(RUNS_DIR):
+        runs = sorted(os.listdir(RUNS_DIR), reverse=True)[:20]
+    return templates.TemplateResponse(request, "index.html", {"runs": runs})
+
+@app.post("/analyze")
+async def analyze(request: Request, video: UploadFile, config_text: UploadFile):
+    run_id, run_dir, vid_path, video_hash, cfg = await save_inputs(video, config_text)
+
+    # Keyframes -> prompt -> LLM -> eval -> report, reusing cached stages
+    run_meta = await run_analysis(run_dir, vid_path, cfg, video_hash=video_hash)
 
     return {
         "run_id": run_id,
         "report_url": f"/report/{run_id}",
         "llm_output": f"/static/runs/{run_id}/llm_output.json",
         "eval": f"/static/runs/{run_id}/eval.json",
+        "cache": run_meta["cache"],
+    }
+
+@app.post("/jobs", status_code=202)
+async def submit_job(video: UploadFile, config_text: UploadFile, priority: str = "interactive"):
+    """
+    Queue an analysis and return at once; follow it via /jobs/{id} or
+    /jobs/{id}/events. Regression runs pass priority=batch so their LLM
+    calls yield to interactive uploads.
+    """
+    if priority not in ratelimit.LANES:
+        raise HTTPException(status_code=422, detail=f"priority must be one of {', '.join(ratelimit.LANES)}")
+    run_id, run_dir, vid_path, video_hash, cfg = await save_inputs(video, config_text)
+    jobs.submit(run_id, video_path=vid_path, video_hash=video_hash, scenario_id=cfg.scenario_id, priority=priority)
+    return {
+        "job_id": run_id,
+        "status_url": f"/jobs/{run_id}",
+        "events_url": f"/jobs/{run_id}/events",
+        "report_url": f"/report/{run_id}",
+    }
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events with the job state after every progress update."""
+    if jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+
+    async def stream():
+        async for state in jobs.events(job_id):
+            yield f"data: {json.dumps(state)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+@app.get("/stats")
+async def stats():
+    """LLM connection pool, rate limiter and deployments, job queue, artifact and LLM response cache counters."""
+    return {
+        "llm_http": http_client.stats(),
+        "llm_rate": ratelimit.limiter.stats(),
+        "llm_deployments": router.stats(),
+        "jobs": {"queued": jobs.queued()},
+        "cache": await executors.run_io(cache.stats),
+        "llm_cache": await executors.run_io(llm.response_cache.stats),
     }
 
 @app.get("/report/{run_id}", response_class=FileResponse)
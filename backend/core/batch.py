@@ -0,0 +1,294 @@
+
+import asyncio, json, logging, os, time, uuid
+from typing import Callable, Dict, List, Optional, Tuple
+import yaml
+from core import http_client
+from core.executors import run_io
+from core.llm import RequestBody, batch_body, cache_response, cached_response, response_key
+from core.pipeline import build_prompts, run_analysis
+from core.schemas import Config
+
+logger = logging.getLogger(__name__)
+
+# Batch API jobs are answered within this window, at a discount and on a
+# quota of their own, so they never compete with interactive calls
+COMPLETION_WINDOW = "24h"
+POLL_SECONDS = float(os.getenv("LLM_BATCH_POLL_SECONDS", "60"))
+# Per-file limits of the Batch API; larger corpora are split over several batches
+MAX_REQUESTS = int(os.getenv("LLM_BATCH_MAX_REQUESTS", "50000"))
+MAX_BYTES = int(os.getenv("LLM_BATCH_MAX_BYTES", str(190 << 20)))
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".m4v")
+CONFIG_FILE = "config.txt"
+MANIFEST = "manifest.json"
+
+def load_config(path: str) -> Optional[Config]:
+    """A run config from a YAML/JSON file, or None if the file is not one."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return Config(**yaml.safe_load(f))
+    except Exception:
+        return None
+
+def discover_corpus(corpus_dir: str) -> List[Dict]:
+    """
+    One entry per directory under `corpus_dir` (itself included) holding a
+    video and a run config, such as Video 1/ with video1_system_config.json.
+    The first *config* file that is a valid config is used, and a
+    *golden_bugs.csv beside it replaces the built-in golden list.
+    Directories without a video are listed with video None.
+    """
+    entries = []
+    for root, dirs, files in sorted(os.walk(corpus_dir)):
+        dirs.sort()
+        configs = sorted(
+            (f for f in files if "config" in f.lower() and f.lower().endswith((".json", ".yaml", ".yml"))),
+            key=lambda f: ("system_config" not in f.lower(), f)
+        )
+        cfg_path = next((os.path.join(root, f) for f in configs if load_config(os.path.join(root, f))), None)
+        if cfg_path is None:
+            continue
+        videos = sorted(f for f in files if f.lower().endswith(VIDEO_EXTENSIONS))
+        goldens = sorted(f for f in files if f.lower().endswith("golden_bugs.csv"))
+        entries.append({
+            "name": os.path.relpath(root, corpus_dir),
+            "video": os.path.join(root, videos[0]) if videos else None,
+            "config": cfg_path,
+            "golden": os.path.join(root, goldens[0]) if goldens else None,
+        })
+    return entries
+
+def batch_api() -> Tuple[str, Dict[str, str], Dict[str, str], str, str]:
+    """Base URL, auth headers, query params, request endpoint and model for the Batch API on Azure OpenAI or OpenAI."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("Batch mode needs OPENAI_API_KEY")
+    azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+    azure_deployment = os.getenv("AZURE_OPENAI_BATCH_DEPLOYMENT") or os.getenv("AZURE_OPENAI_DEPLOYMENT")
+    if azure_endpoint and azure_deployment:
+        # Azure runs batches on a Global Batch deployment and its own API version
+        api_version = os.getenv("AZURE_OPENAI_BATCH_API_VERSION", "2024-10-21")
+        return f"{azure_endpoint.rstrip('/')}/openai", {"api-key": api_key}, {"api-version": api_version}, "/chat/completions", azure_deployment
+    base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+    return base_url, {"Authorization": f"Bearer {api_key}"}, {}, "/v1/chat/completions", os.getenv("OPENAI_MODEL", "gpt-4o")
+
+class RequestFiles:
+    """
+    Batch input files written one request line at a time, each body's
+    image chunks copied straight from the prompt; a new file is started
+    before one would pass MAX_REQUESTS or MAX_BYTES.
+    """
+    def __init__(self, batch_dir: str, endpoint: str, model: str):
+        self.batch_dir = batch_dir
+        self.endpoint = endpoint
+        self.model = model
+        self.paths: List[str] = []
+        self._file = None
+        self._requests = 0
+        self._bytes = 0
+
+    def add(self, custom_id: str, body: RequestBody):
+        head = json.dumps({"custom_id": custom_id, "method": "POST", "url": self.endpoint})[:-1].encode("utf-8") + b', "body": '
+        size = len(head) + body.length + 2
+        if self._file is None or self._requests >= MAX_REQUESTS or self._bytes + size > MAX_BYTES:
+            self._next_file()
+        self._file.write(head)
+        for chunk in body.chunks:
+            self._file.write(chunk)
+        self._file.write(b"}\n")
+        self._requests += 1
+        self._bytes += size
+
+    def _next_file(self):
+        self.close()
+        path = os.path.join(self.batch_dir, f"requests-{len(self.paths)}.jsonl")
+        self._file = open(path, "wb")
+        self.paths.append(path)
+        self._requests = self._bytes = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+async def _api(method: str, path: str, **kwargs) -> Dict:
+    base_url, headers, params, _, _ = batch_api()
+    response = await http_client.request(method, base_url + path, headers=headers, params=params, **kwargs)
+    response.raise_for_status()
+    return response.json()
+
+async def submit(path: str, endpoint: str) -> Dict:
+    """Upload a batch input file and start a batch on it."""
+    with open(path, "rb") as f:
+        uploaded = await _api("POST", "/files", files={"file": (os.path.basename(path), f, "application/jsonl")}, data={"purpose": "batch"})
+    return await _api("POST", "/batches", json={
+        "input_file_id": uploaded["id"],
+        "endpoint": endpoint,
+        "completion_window": COMPLETION_WINDOW,
+    })
+
+async def retrieve(batch_id: str) -> Dict:
+    return await _api("GET", f"/batches/{batch_id}")
+
+async def download(file_id: str, path: str):
+    """Stream a batch output file to `path`."""
+    base_url, headers, params, _, _ = batch_api()
+    response = await http_client.request("GET", f"{base_url}/files/{file_id}/content", headers=headers, params=params, stream=True)
+    try:
+        response.raise_for_status()
+        with open(path, "wb") as f:
+            async for chunk in response.aiter_bytes():
+                await run_io(f.write, chunk)
+    finally:
+        await response.aclose()
+
+def _read_results(path: str, keys: Dict[str, str]) -> Tuple[int, int]:
+    """Cache every usable answer in a batch output file under its request's key; returns (usable, unusable)."""
+    ok = failed = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            key = keys.get(result.get("custom_id"))
+            response = result.get("response") or {}
+            if key is None or result.get("error") or response.get("status_code") != 200:
+                failed += 1
+                continue
+            content = response["body"]["choices"][0]["message"]["content"]
+            if cache_response(key, content) is None:
+                failed += 1
+            else:
+                ok += 1
+    return ok, failed
+
+def _save(batch_dir: str, manifest: Dict):
+    path = os.path.join(batch_dir, MANIFEST)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def _write_bytes(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+async def _prepare(entries: List[Dict], runs_dir: str, batch_dir: str, report: Callable[[str], None]) -> Dict:
+    """Build every entry's prompts and write those not already answered as batch input files."""
+    _, _, _, endpoint, model = batch_api()
+    files = RequestFiles(batch_dir, endpoint, model)
+    runs, keys, seen = [], {}, {}
+    try:
+        for entry in entries:
+            run_id = str(uuid.uuid4())
+            run_dir = os.path.join(runs_dir, run_id)
+            os.makedirs(os.path.join(run_dir, "frames"), exist_ok=True)
+            cfg_bytes = await run_io(_read_bytes, entry["config"])
+            await run_io(_write_bytes, os.path.join(run_dir, CONFIG_FILE), cfg_bytes)
+            cfg = load_config(entry["config"])
+            prompts = await build_prompts(run_dir, entry["video"], cfg)
+            sent = cached = 0
+            for prompt in prompts:
+                key = await run_io(response_key, prompt)
+                if key in seen or (cfg.llm_cache == "use" and await run_io(cached_response, key) is not None):
+                    cached += 1
+                    continue
+                custom_id = seen[key] = f"{run_id}-{len(keys)}"
+                keys[custom_id] = key
+                await run_io(files.add, custom_id, batch_body(prompt, model))
+                sent += 1
+            runs.append({**entry, "run_id": run_id, "run_dir": run_dir, "done": False})
+            report(f"{entry['name']}: {sent} requests batched, {cached} already answered")
+    finally:
+        files.close()
+    return {
+        "created": time.time(),
+        "endpoint": endpoint,
+        "model": model,
+        "runs": runs,
+        "requests": keys,
+        "batches": [{"input": os.path.basename(path)} for path in files.paths],
+    }
+
+async def run_batch(
+    entries: List[Dict],
+    runs_dir: str,
+    batch_dir: str,
+    poll_seconds: float = POLL_SECONDS,
+    report: Callable[[str], None] = logger.info
+) -> List[Dict]:
+    """
+    Analyze a corpus through the Batch API: build every entry's prompts
+    (via the artifact cache, like an upload), write them as JSONL batch
+    input, submit and poll until every batch is done, cache the answers in
+    the LLM response cache under the keys call_llm() uses, then run each
+    entry through run_analysis() to write its llm_output.json, eval.json
+    and report.html. Requests a batch could not answer are sent live in
+    the rate limiter's "batch" lane.
+
+    Progress is kept in `batch_dir`/manifest.json after every step, so
+    calling this again with the same `batch_dir` resumes where it stopped.
+    Returns each entry's run with its run.json contents.
+    """
+    os.makedirs(batch_dir, exist_ok=True)
+    manifest_path = os.path.join(batch_dir, MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        report(f"Resuming {batch_dir}")
+    else:
+        manifest = await _prepare(entries, runs_dir, batch_dir, report)
+        await run_io(_save, batch_dir, manifest)
+
+    # Submit, then poll every batch until it is done
+    for batch in manifest["batches"]:
+        if "id" not in batch:
+            created = await submit(os.path.join(batch_dir, batch["input"]), manifest["endpoint"])
+            batch.update(id=created["id"], status=created["status"])
+            await run_io(_save, batch_dir, manifest)
+            report(f"Submitted {batch['input']} as batch {batch['id']}")
+    while True:
+        pending = [batch for batch in manifest["batches"] if batch["status"] not in TERMINAL_STATUSES]
+        for batch in pending:
+            state = await retrieve(batch["id"])
+            batch.update(
+                status=state["status"],
+                output_file_id=state.get("output_file_id"),
+                error_file_id=state.get("error_file_id"),
+                request_counts=state.get("request_counts")
+            )
+        await run_io(_save, batch_dir, manifest)
+        if not pending:
+            break
+        report("Batches: " + ", ".join(f"{b['id']} {b['status']} {b.get('request_counts') or ''}" for b in manifest["batches"]))
+        await asyncio.sleep(poll_seconds)
+
+    # Fan the answers out into the response cache
+    for n, batch in enumerate(manifest["batches"]):
+        if batch.get("output_file_id") and "answered" not in batch:
+            path = os.path.join(batch_dir, f"results-{n}.jsonl")
+            await download(batch["output_file_id"], path)
+            batch["answered"], batch["unusable"] = await run_io(_read_results, path, manifest["requests"])
+            await run_io(_save, batch_dir, manifest)
+        report(f"Batch {batch['id']} {batch['status']}: {batch.get('answered', 0)} answers, {batch.get('unusable', 0)} unusable")
+
+    # ...and through the rest of the pipeline, one run at a time
+    results = []
+    for run in manifest["runs"]:
+        run_json = os.path.join(run["run_dir"], "run.json")
+        if not run["done"]:
+            cfg = load_config(run["config"])
+            # Answers are only in the response cache
+            cfg.llm_cache = "use"
+            run_meta = await run_analysis(run["run_dir"], run["video"], cfg, priority="batch", golden_csv=run["golden"])
+            run_meta["llm_batch"] = [batch["id"] for batch in manifest["batches"]]
+            await run_io(_write_bytes, run_json, json.dumps(run_meta, indent=2, ensure_ascii=False).encode("utf-8"))
+            run["done"] = True
+            await run_io(_save, batch_dir, manifest)
+        with open(run_json, "r", encoding="utf-8") as f:
+            results.append({**run, "run": json.load(f)})
+    return results
@@ -0,0 +1,148 @@
+
+import hashlib, json, os, shutil, tempfile, threading, time
+from typing import Any, Iterable, Optional
+
+def content_key(*parts: Any) -> str:
+    """Stable hash of JSON-serialisable stage inputs."""
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _dir_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(dirpath, name))
+        for dirpath, _, names in os.walk(path) for name in names
+    )
+
+class ArtifactCache:
+    """
+    Content-addressed store for pipeline stage outputs.
+
+    Entries live under <root>/<stage>/<key[:2]>/<key>/ and are written to a
+    temp dir first, then renamed into place, so readers never see half an
+    entry. An entry's mtime is bumped on every hit; once the cache grows
+    past max_bytes the least recently used entries are deleted.
+    """
+    def __init__(self, root: str, max_bytes: int = 2 << 30):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Running size estimate so puts only walk the tree when over budget
+        self._bytes = None
+        os.makedirs(root, exist_ok=True)
+
+    def _entry(self, stage: str, key: str) -> str:
+        return os.path.join(self.root, stage, key[:2], key)
+
+    def get_dir(self, stage: str, key: str) -> Optional[str]:
+        """Path of a cached entry, or None on a miss."""
+        path = self._entry(stage, key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted between the check and the touch
+            return None
+        return path
+
+    def put_dir(
+        self, stage: str, key: str, files: Iterable[str] = (), payload: Any = None, replace: bool = False
+    ) -> str:
+        """
+        Store copies of `files` (and `payload` as payload.json) under the
+        key. An existing entry is kept unless `replace` is set.
+        """
+        path = self._entry(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(path), prefix=".tmp-")
+        size = 0
+        try:
+            for src in files:
+                shutil.copy2(src, os.path.join(tmp, os.path.basename(src)))
+            if payload is not None:
+                with open(os.path.join(tmp, "payload.json"), "w", encoding="utf-8") as f:
+                    json.dump(payload, f, ensure_ascii=False)
+            size = _dir_size(tmp)
+            if os.path.isdir(path) and replace:
+                # Move the old entry aside so the new one can be renamed in
+                old = tempfile.mkdtemp(dir=os.path.dirname(path), prefix=".tmp-")
+                try:
+                    os.replace(path, os.path.join(old, "entry"))
+                except FileNotFoundError:
+                    pass
+                size -= _dir_size(old)
+                shutil.rmtree(old, ignore_errors=True)
+                os.replace(tmp, path)
+            elif os.path.isdir(path):
+                shutil.rmtree(tmp)
+                size = 0
+            else:
+                os.replace(tmp, path)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += size
+        if self._bytes is None or self._bytes > self.max_bytes:
+            self.evict()
+        return path
+
+    def get_json(self, stage: str, key: str, max_age: Optional[float] = None) -> Optional[Any]:
+        """The entry's payload, or None on a miss or when it was stored more than `max_age` seconds ago."""
+        path = self.get_dir(stage, key)
+        if path is None:
+            return None
+        payload_path = os.path.join(path, "payload.json")
+        try:
+            if max_age is not None and time.time() - os.path.getmtime(payload_path) > max_age:
+                return None
+            with open(payload_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put_json(self, stage: str, key: str, payload: Any, replace: bool = False) -> str:
+        return self.put_dir(stage, key, payload=payload, replace=replace)
+
+    def _entries(self):
+        for dirpath, dirnames, _ in os.walk(self.root):
+            # <root>/<stage>/<prefix>/<key>: entries sit three levels down
+            if os.path.relpath(dirpath, self.root).count(os.sep) != 1:
+                continue
+            for key in dirnames:
+                if key.startswith(".tmp-"):
+                    continue
+                path = os.path.join(dirpath, key)
+                try:
+                    yield os.path.getmtime(path), _dir_size(path), path
+                except FileNotFoundError:
+                    continue
+            dirnames[:] = []
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+            self._bytes = total
+
+    def stats(self) -> dict:
+        entries = list(self._entries())
+        return {
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
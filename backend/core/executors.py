@@ -0,0 +1,39 @@
+
+import asyncio, os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+
+# Blocking pipeline work runs on threads: decoding and image encoding
+# release the GIL in OpenCV and Pillow, and the rest is file I/O.
+IO_WORKERS = int(os.getenv("IO_WORKERS", "8"))
+# Videos decoded at once; each holds a thread for its whole decode
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", "4"))
+
+_io_pool: Optional[ThreadPoolExecutor] = None
+_decode_pool: Optional[ThreadPoolExecutor] = None
+
+def io_pool() -> ThreadPoolExecutor:
+    global _io_pool
+    if _io_pool is None:
+        _io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+    return _io_pool
+
+def decode_pool() -> ThreadPoolExecutor:
+    global _decode_pool
+    if _decode_pool is None:
+        _decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+    return _decode_pool
+
+async def run_io(fn: Callable, *args, **kwargs) -> Any:
+    """Run a blocking file-I/O function on the I/O thread pool."""
+    return await asyncio.get_running_loop().run_in_executor(io_pool(), partial(fn, *args, **kwargs))
+
+def shutdown():
+    global _io_pool, _decode_pool
+    if _io_pool is not None:
+        _io_pool.shutdown(wait=False)
+        _io_pool = None
+    if _decode_pool is not None:
+        _decode_pool.shutdown(wait=False)
+        _decode_pool = None
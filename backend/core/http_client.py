@@ -0,0 +1,122 @@
+
+import asyncio, logging, os, time
+from typing import Dict, Optional
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# One connection pool is shared by every LLM call for the app's lifetime, so
+# requests reuse warm TCP/TLS (and, with HTTP/2, multiplexed) connections
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+WRITE_TIMEOUT = float(os.getenv("LLM_WRITE_TIMEOUT", "60"))
+POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", "30"))
+HTTP2 = os.getenv("LLM_HTTP2", "true").lower() not in ("false", "no", "0")
+
+_client: Optional[httpx.AsyncClient] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_started: Optional[float] = None
+_stats = {
+    "requests": 0,
+    "in_flight": 0,
+    "errors": 0,
+    "connections_opened": 0,
+    "tls_handshakes": 0,
+    "http2_requests": 0,
+}
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def _new_client() -> httpx.AsyncClient:
+    http2 = HTTP2 and _http2_available()
+    if HTTP2 and not http2:
+        logger.warning("LLM_HTTP2 is on but the h2 package is missing; using HTTP/1.1")
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT, write=WRITE_TIMEOUT, pool=POOL_TIMEOUT)
+    )
+
+async def start():
+    """Create the shared client; called on app startup."""
+    global _client, _loop, _started
+    if _client is None:
+        _client, _loop, _started = _new_client(), asyncio.get_running_loop(), time.time()
+
+async def close():
+    """Close the shared client and its connections; called on app shutdown."""
+    global _client, _loop
+    if _client is not None:
+        await _client.aclose()
+        _client, _loop = None, None
+
+def client() -> httpx.AsyncClient:
+    """
+    The shared client. Outside the app (scripts, tools) it is created on
+    first use; a client left over from an event loop that has since been
+    closed is replaced, since its connections belong to that loop.
+    """
+    global _client, _loop, _started
+    loop = asyncio.get_running_loop()
+    if _client is None or _loop is not loop:
+        _client, _loop, _started = _new_client(), loop, time.time()
+    return _client
+
+async def _trace(event: str, info: Dict):
+    # httpcore reports connection setup through the request's trace hook
+    if event == "connection.connect_tcp.complete":
+        _stats["connections_opened"] += 1
+    elif event == "connection.start_tls.complete":
+        _stats["tls_handshakes"] += 1
+    elif event == "http2.send_request_headers.started":
+        _stats["http2_requests"] += 1
+
+async def request(method: str, url: str, stream: bool = False, **kwargs) -> httpx.Response:
+    """
+    Send a request on the shared client, counting it in stats(). kwargs
+    go to build_request(); with `stream` the body is left unread.
+    """
+    shared = client()
+    req = shared.build_request(method, url, extensions={"trace": _trace}, **kwargs)
+    _stats["requests"] += 1
+    _stats["in_flight"] += 1
+    try:
+        return await shared.send(req, stream=stream)
+    except Exception:
+        _stats["errors"] += 1
+        raise
+    finally:
+        _stats["in_flight"] -= 1
+
+def stats() -> Dict:
+    """Pool settings and counters; requests - connections_opened were served on reused connections."""
+    return {
+        **_stats,
+        "reused": max(0, _stats["requests"] - _stats["connections_opened"]),
+        "active": _client is not None,
+        "uptime_s": round(time.time() - _started, 1) if _client is not None and _started else None,
+        "http2": bool(_client is not None and HTTP2 and _http2_available()),
+        "limits": {
+            "max_connections": MAX_CONNECTIONS,
+            "max_keepalive_connections": MAX_KEEPALIVE_CONNECTIONS,
+            "keepalive_expiry": KEEPALIVE_EXPIRY,
+        },
+        "timeouts": {
+            "connect": CONNECT_TIMEOUT,
+            "read": READ_TIMEOUT,
+            "write": WRITE_TIMEOUT,
+            "pool": POOL_TIMEOUT,
+        },
+    }
@@ -0,0 +1,183 @@
+
+import asyncio, json, logging, os, time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from core.executors import run_io
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages in the order a job goes through them
+STAGES = ["queued", "frames", "images", "llm", "eval", "report", "done"]
+ACTIVE = ("queued", "running")
+
+JOURNAL_FILE = "job.json"
+
+def _write_file(path: str, data: str):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+class JobQueue:
+    """
+    Runs analyses in the background on a bounded pool of asyncio workers.
+
+    Each job's state is journaled to <runs_dir>/<job_id>/job.json (written
+    to a temp file and renamed, on the I/O pool and in order), so jobs that
+    were queued or running when the process stopped are picked up again by
+    start(). Listeners get every progress update through events().
+    """
+    def __init__(
+        self,
+        runs_dir: str,
+        runner: Callable[[Dict, Callable[..., None]], Awaitable[Dict]],
+        workers: int = 2
+    ):
+        self.runs_dir = runs_dir
+        self.runner = runner
+        self.workers = workers
+        self._jobs: Dict[str, Dict] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._listeners: Dict[str, List[asyncio.Queue]] = {}
+        # Each job's latest journal write, which later ones wait for
+        self._writes: Dict[str, asyncio.Task] = {}
+
+    def _journal(self, job: Dict):
+        """Write the job's state as it is now, off the event loop, after any earlier write of it."""
+        path = os.path.join(self.runs_dir, job["id"], JOURNAL_FILE)
+        data = json.dumps(job, indent=2, ensure_ascii=False)
+        previous = self._writes.get(job["id"])
+        task = asyncio.create_task(self._write(path, data, previous))
+        self._writes[job["id"]] = task
+
+        def forget(done: asyncio.Task):
+            if self._writes.get(job["id"]) is done:
+                del self._writes[job["id"]]
+
+        task.add_done_callback(forget)
+
+    async def _write(self, path: str, data: str, previous: Optional[asyncio.Task]):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await run_io(_write_file, path, data)
+        except OSError as e:
+            logger.warning(f"Could not journal job to {path}: {e}")
+
+    async def flush(self):
+        """Wait for every pending journal write."""
+        while self._writes:
+            await asyncio.wait(list(self._writes.values()))
+
+    def _recover(self) -> List[Dict]:
+        """Jobs left queued or running by a previous process, oldest first."""
+        recovered = []
+        if not os.path.isdir(self.runs_dir):
+            return recovered
+        for run_id in os.listdir(self.runs_dir):
+            path = os.path.join(self.runs_dir, run_id, JOURNAL_FILE)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                continue
+            self._jobs[job["id"]] = job
+            if job["status"] in ACTIVE:
+                job.update(status="queued", stage="queued", restarts=job.get("restarts", 0) + 1)
+                recovered.append(job)
+        return sorted(recovered, key=lambda j: j["created"])
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        for job in await run_io(self._recover):
+            logger.info(f"Re-queueing job {job['id']} after restart")
+            self._journal(job)
+            self._queue.put_nowait(job["id"])
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # Running jobs stay "running" in the journal and restart on next start()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+
+    def submit(self, job_id: str, **fields) -> Dict:
+        """Register a job whose inputs are already in its run dir and queue it."""
+        now = time.time()
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "stage": "queued",
+            "progress": {},
+            "created": now,
+            "updated": now,
+            "error": None,
+            **fields
+        }
+        self._jobs[job_id] = job
+        self._journal(job)
+        self._queue.put_nowait(job_id)
+        self._notify(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self._jobs.get(job_id)
+
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def _notify(self, job: Dict):
+        for listener in self._listeners.get(job["id"], []):
+            listener.put_nowait(dict(job, progress=dict(job["progress"])))
+
+    def _update(self, job: Dict, journal: bool = True, **fields):
+        job.update(fields, updated=time.time())
+        if journal:
+            self._journal(job)
+        self._notify(job)
+
+    def _progress_callback(self, job: Dict) -> Callable[..., None]:
+        def progress(stage: str, **counts):
+            # Counters (frames, images, LLM attempt) tick often; only stage
+            # changes are worth a journal write
+            new_stage = stage != job["stage"]
+            job["progress"].update(counts)
+            self._update(job, journal=new_stage, stage=stage)
+        return progress
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self._jobs[job_id]
+            self._update(job, status="running")
+            try:
+                result = await self.runner(job, self._progress_callback(job))
+                self._update(job, status="done", stage="done", result=result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Job {job_id} failed")
+                self._update(job, status="failed", error=str(e))
+            finally:
+                self._queue.task_done()
+
+    async def events(self, job_id: str) -> AsyncIterator[Dict]:
+        """Yield the job's state now and after every update until it finishes."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        listener: asyncio.Queue = asyncio.Queue()
+        self._listeners.setdefault(job_id, []).append(listener)
+        try:
+            snapshot = dict(job, progress=dict(job["progress"]))
+            while True:
+                yield snapshot
+                if snapshot["status"] not in ACTIVE:
+                    return
+                snapshot = await listener.get()
+        finally:
+            self._listeners[job_id].remove(listener)
+            if not self._listeners[job_id]:
+                del self._listeners[job_id]
@@ -0,0 +1,120 @@
+
+import json, re
+from typing import Dict, List, Optional, Tuple
+
+# Top-level arrays whose elements are emitted as soon as they close
+ITEM_KEYS = ("bugs", "bugs_strong", "bugs_minor", "steps")
+STEP_FIELDS = ("step_no", "summary", "frames")
+
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+class JsonStream:
+    """
+    Incremental parser for a streamed analysis response.
+
+    feed() takes the completion text as it arrives and returns the
+    (key, element) pairs of bugs/steps elements that closed in it, each
+    already parsed and checked. This is best effort: text before the
+    opening brace is skipped and an element that is not a well-formed
+    bug/step is left out, its problem added to `errors`, since the full
+    response may still validate or be repaired once it is in. Only a
+    closer that does not match raises ValueError.
+    """
+    def __init__(self):
+        self.text: List[str] = []
+        self._buf = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        self._last_string = None
+        self._key = None
+        self._array_key = None
+        self._item_start = None
+        self._started = False
+        self._done = False
+        self.counts: Dict[str, int] = {}
+        self.errors: List[str] = []
+
+    def feed(self, chunk: str) -> List[Tuple[str, Dict]]:
+        self.text.append(chunk)
+        self._buf += chunk
+        items = []
+        buf = self._buf
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = buf[self._string_start:i + 1]
+                i += 1
+                continue
+            if not self._started:
+                # A code fence or prose preamble is left to the final parse
+                if ch == "{":
+                    self._started = True
+                    self._stack.append("}")
+                i += 1
+                continue
+            if self._done:
+                # Whatever follows the object is left to the final parse
+                i = len(buf)
+                break
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch == ":" and len(self._stack) == 1:
+                self._key = json.loads(self._last_string) if self._last_string else None
+            elif ch in "{[":
+                if len(self._stack) == 1 and ch == "[" and self._key in ITEM_KEYS:
+                    self._array_key = self._key
+                elif len(self._stack) == 2 and self._array_key:
+                    self._item_start = i
+                self._stack.append("}" if ch == "{" else "]")
+            elif ch in "}]":
+                if not self._stack or self._stack[-1] != ch:
+                    raise ValueError(f"Invalid JSON format: unexpected {ch!r} at char {i}")
+                self._stack.pop()
+                if len(self._stack) == 2 and self._item_start is not None:
+                    item = self._item(buf[self._item_start:i + 1])
+                    if item is not None:
+                        items.append((self._array_key, item))
+                    self._item_start = None
+                elif len(self._stack) == 1:
+                    self._array_key = None
+                elif not self._stack:
+                    self._done = True
+            i += 1
+        self._pos = i
+        return items
+
+    def _item(self, text: str) -> Optional[Dict]:
+        key = self._array_key
+        n = self.counts.get(key, 0)
+        self.counts[key] = n + 1
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError:
+            try:
+                # The one slip that is safe to fix inside a single element
+                item = json.loads(_TRAILING_COMMA.sub(r"\1", text))
+            except json.JSONDecodeError as e:
+                self.errors.append(f"{key} item {n}: {e}")
+                return None
+        if not isinstance(item, dict):
+            self.errors.append(f"{key} item {n} must be a dictionary")
+            return None
+        if key == "steps" and any(field not in item for field in STEP_FIELDS):
+            self.errors.append(f"Step {n} missing required fields: step_no, summary, frames")
+            return None
+        return item
+
+    def getvalue(self) -> str:
+        """The full text fed so far."""
+        return "".join(self.text)
@@ -1,15 +1,57 @@
 
-import os, json
+import asyncio, hashlib, os, json, re, uuid
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import httpx
 from openai import AsyncOpenAI
 import logging
+from core import http_client, ratelimit
+from core.router import get_router
+from core.cache import ArtifactCache, content_key
+from core.executors import run_io
+from core.jsonstream import ITEM_KEYS, JsonStream
+from core.prompt import RETURN_FORMAT, Prompt
 
 logger = logging.getLogger(__name__)
 
+# Completion tokens counted against the tokens-per-minute quota on top of the prompt
+COMPLETION_TOKENS = int(os.getenv("LLM_COMPLETION_TOKENS", "1500"))
+# Statuses whose Retry-After pauses all LLM calls, and how many such
+# responses a call may wait out on top of its normal attempts
+RETRY_AFTER_STATUSES = (429, 503)
+MAX_THROTTLED_RETRIES = int(os.getenv("LLM_MAX_THROTTLED_RETRIES", "5"))
+
+# Responses are cached on disk by the exact request sent (see
+# RequestBody.fingerprint), up to LLM_CACHE_MAX_BYTES in LRU order, and
+# served for LLM_CACHE_TTL seconds (0 keeps them until evicted)
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join(os.path.dirname(__file__), "..", "llm_cache"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 << 20)))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# Per-call cache use: read and write, skip the read but store the fresh
+# response, or leave the cache alone
+CACHE_MODES = ("use", "refresh", "bypass")
+response_cache = ArtifactCache(LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES)
+
+# Broken responses longer than this are not sent back for repair
+REPAIR_MAX_CHARS = int(os.getenv("LLM_REPAIR_MAX_CHARS", "30000"))
+REPAIR_SYSTEM = f"""You repair malformed JSON produced by a QA analysis model.
+
+CRITICAL: Respond with ONLY valid JSON matching this schema: {json.dumps(RETURN_FORMAT)}
+
+Keep every bug, step and value that is in the input, fix only the syntax and structure, and do not add findings."""
+
+def _shared_http_client() -> Optional[httpx.AsyncClient]:
+    try:
+        return http_client.client()
+    except RuntimeError:
+        # No running event loop: let the SDK make its own
+        return None
+
 def _get_openai_client():
-    """Initialize OpenAI client with support for both OpenAI and Azure OpenAI."""
+    """Initialize OpenAI client with support for both OpenAI and Azure OpenAI, on the shared connection pool."""
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         return None
+    shared = _shared_http_client()
     
     # Check if using Azure OpenAI
     azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
@@ -24,11 +66,12 @@ def _get_openai_client():
         return AsyncOpenAI(
             api_key=api_key,
             base_url=base_url,
-            default_headers={"api-key": api_key}
+            default_headers={"api-key": api_key},
+            http_client=shared
         )
     else:
         # Standard OpenAI configuration
-        return AsyncOpenAI(api_key=api_key)
+        return AsyncOpenAI(api_key=api_key, http_client=shared)
 
 def _validate_json_response(response_text: str) -> dict:
     """Validate and parse JSON response from LLM."""
@@ -63,12 +106,371 @@ def _validate_json_response(response_text: str) -> dict:
     except Exception as e:
         raise ValueError(f"Response validation failed: {e}")
 
-async def call_llm(prompt_dict: dict) -> dict:
+_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*\n?|\n?\s*```\s*$")
+_CLOSERS = {"{": "}", "[": "]"}
+
+def _strip_fences(text: str) -> str:
+    """Drop markdown code fences and any prose around the outermost JSON object."""
+    text = _FENCE.sub("", text.strip())
+    start = text.find("{")
+    return text[start:] if start >= 0 else text
+
+def _close_json(text: str) -> Tuple[str, bool]:
+    """
+    Remove trailing commas and close whatever a truncated response left
+    open: an unterminated string, then a dangling key or comma, then the
+    open arrays and objects innermost first. Returns the text and whether
+    anything had to be closed, i.e. whether the response was cut off.
+    """
+    out = []
+    stack = []
+    in_string = escaped = False
+    for ch in text:
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in _CLOSERS:
+            stack.append(_CLOSERS[ch])
+        elif ch in "}]":
+            # Trailing comma before a closer
+            while out and out[-1] in " \t\r\n,":
+                if out.pop() == ",":
+                    break
+            if not stack or stack[-1] != ch:
+                # Stray closer past the end of the object: stop here
+                break
+            stack.pop()
+            out.append(ch)
+            if not stack:
+                return "".join(out), False
+            continue
+        out.append(ch)
+    truncated = in_string or bool(stack)
+    if in_string:
+        if escaped:
+            out.pop()
+        out.append('"')
+    tail = "".join(out).rstrip()
+    # A key without its value, a dangling colon or comma
+    tail = re.sub(r'(,\s*"(?:[^"\\]|\\.)*"\s*:?\s*|:\s*|,\s*)$', "", tail)
+    return tail + "".join(reversed(stack)), truncated
+
+def _coerce_output(parsed: Dict) -> Dict:
+    """Fill in what the output format requires where the model left it out or mistyped it."""
+    for key in ("bugs", "steps"):
+        value = parsed.get(key)
+        if value is None:
+            parsed[key] = []
+        elif isinstance(value, dict):
+            parsed[key] = [value]
+    if isinstance(parsed["steps"], list):
+        steps = [step for step in parsed["steps"] if isinstance(step, dict)]
+        for n, step in enumerate(steps, 1):
+            step.setdefault("step_no", n)
+            step.setdefault("summary", "")
+            step.setdefault("frames", [])
+        parsed["steps"] = steps
+    if isinstance(parsed["bugs"], list):
+        parsed["bugs"] = [bug for bug in parsed["bugs"] if isinstance(bug, dict)]
+    parsed.setdefault("assumptions", "")
+    if not isinstance(parsed.get("metadata"), dict):
+        parsed["metadata"] = {}
+    return parsed
+
+def repair_json_response(response_text: str) -> Optional[dict]:
+    """
+    Recover an LLM response that failed _validate_json_response() without
+    another request: strip code fences and stray text, drop trailing
+    commas and coerce the required keys. None if it is still not an
+    output object, or if it was cut off: closing it would pass off a
+    partial answer as a complete one.
+    """
+    text = _strip_fences(response_text or "")
+    closed, truncated = _close_json(text)
+    if truncated:
+        return None
+    for candidate in (text, closed):
+        try:
+            parsed = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(parsed, dict):
+            return _coerce_output(parsed)
+    return None
+
+class RequestBody:
+    """
+    A JSON request body held as a list of chunks.
+
+    The payload is serialized once with a placeholder for every image and
+    split around them, so each image chunk is the prompt's own data-URL
+    buffer. Sending it (any number of times) never joins the images into
+    one string.
+    """
+    def __init__(self, payload: Dict, images: List[bytes], marker: str):
+        parts = re.split(re.escape(marker) + r"(\d+)@", json.dumps(payload, ensure_ascii=False))
+        self.chunks = [images[int(part)] if i % 2 else part.encode("utf-8") for i, part in enumerate(parts)]
+        self.length = sum(len(chunk) for chunk in self.chunks)
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    def fingerprint(self) -> str:
+        """Hash of the exact bytes sent: model, messages, image contents, temperature and response_format."""
+        h = hashlib.sha256()
+        for chunk in self.chunks:
+            h.update(hashlib.sha256(chunk).digest())
+        return h.hexdigest()
+
+def _chat_endpoint() -> Tuple[str, Dict[str, str], Dict]:
+    """URL, auth headers and extra body fields for chat completions on Azure OpenAI or OpenAI."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+    azure_deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+    if azure_endpoint and azure_deployment:
+        azure_api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview")
+        url = f"{azure_endpoint.rstrip('/')}/openai/deployments/{azure_deployment}/chat/completions?api-version={azure_api_version}"
+        return url, {"api-key": api_key}, {}
+    base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+    return f"{base_url}/chat/completions", {"Authorization": f"Bearer {api_key}"}, {"model": os.getenv("OPENAI_MODEL", "gpt-4o")}
+
+def _request_body(prompt: Prompt, extra: Dict, stream: bool = False) -> RequestBody:
+    """Chat-completions body for the prompt, with its images passed by reference."""
+    marker = f"@image-{uuid.uuid4().hex}-"
+    images = []
+
+    def image_ref(image: bytes) -> str:
+        images.append(image)
+        return f"{marker}{len(images) - 1}@"
+
+    if prompt.scenario is None:
+        user_content = prompt.text
+    else:
+        scenario = prompt.scenario
+        # Add text content first
+        user_content = [{
+            "type": "text",
+            "text": f"Please analyze these mobile app screenshots for QA issues. Here's the scenario context:\n\nScenario: {scenario['id']}\nSource apps: {', '.join(scenario['source_apps'])}\nFile size: {scenario['file_size_bucket']}\nProtection: {scenario['protection_level']}\nFile type: {scenario['file_type']}\n\nPlease examine each screenshot and identify any bugs, issues, or violations. Each screenshot is labelled with its frame number; use those numbers in evidence_frames and frames. Return your analysis in the specified JSON format."
+        }]
+        
+        # Keyframes that repeat an earlier screen are sent as a note, not an image
+        repeats = [
+            f"frame {frame['index']} (t={frame['ts_ms']}ms) shows the same screen as frame {frame['duplicate_of']}"
+            for frame in prompt.frames if "duplicate_of" in frame
+        ]
+        if repeats:
+            user_content.append({"type": "text", "text": "Repeated screens: " + "; ".join(repeats) + "."})
+        
+        # Add images from frames
+        for frame in prompt.frames:
+            if "crop" in frame:
+                # Delta-region frames show only the part of the screen that changed
+                crop = frame["crop"]
+                user_content.append({
+                    "type": "text",
+                    "text": f"Frame {frame['index']} (t={frame['ts_ms']}ms): only the region x={crop['x']} y={crop['y']} w={crop['w']} h={crop['h']} changed since frame {frame['ref_frame']}; the rest of the screen is unchanged."
+                })
+            elif "image_base64" in frame:
+                # A window's images start mid-video, so the model can't number them by position
+                user_content.append({"type": "text", "text": f"Frame {frame['index']} (t={frame['ts_ms']}ms):"})
+            if "image_base64" in frame:
+                image_content = {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image_ref(frame["image_base64"])
+                    }
+                }
+                if frame.get("detail"):
+                    # Resolution hint chosen by the image planner
+                    image_content["image_url"]["detail"] = frame["detail"]
+                user_content.append(image_content)
+
+    payload = {
+        **extra,
+        "messages": [
+            {"role": "system", "content": prompt.system},
+            {"role": "user", "content": user_content}
+        ],
+        "temperature": 0.1,  # Low temperature for consistent JSON output
+        "response_format": {"type": "json_object"}  # Force JSON response
+    }
+    if stream:
+        payload["stream"] = True
+        if "model" in extra:
+            # OpenAI reports a streamed call's usage in a last chunk only when asked
+            payload["stream_options"] = {"include_usage": True}
+    return RequestBody(payload, images, marker)
+
+async def _read_stream(response: httpx.Response, on_item: Optional[Callable[[str, Dict], None]]) -> Tuple[str, Optional[int]]:
+    """
+    Collect a streamed completion's text from its server-sent events,
+    passing each well-formed bugs/steps element to `on_item` as soon as it
+    closes. Returns the text and the total tokens used, if the service
+    reported them. Malformed text is returned all the same, for
+    _parse_response() to validate or repair.
+    """
+    parser = JsonStream()
+    text = []
+    used = None
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        event = json.loads(data)
+        if event.get("usage"):
+            used = event["usage"].get("total_tokens")
+        # Azure opens with an event carrying only prompt filter results
+        for choice in event.get("choices") or []:
+            delta = (choice.get("delta") or {}).get("content")
+            if not delta:
+                continue
+            text.append(delta)
+            if parser is None:
+                continue
+            try:
+                items = parser.feed(delta)
+            except ValueError as e:
+                logger.info(f"Streamed response is malformed, reading the rest without passing items on ({e})")
+                parser = None
+                continue
+            for key, item in items:
+                if on_item:
+                    on_item(key, item)
+    return "".join(text), used
+
+def _emit_items(parsed: Dict, on_item: Callable[[str, Dict], None], sent: Tuple = ()):
+    """Pass every bugs/steps element of `parsed` to `on_item`, except those in `sent` (once each)."""
+    sent = list(sent)
+    for key in ITEM_KEYS:
+        for item in parsed.get(key) or []:
+            if (key, item) in sent:
+                sent.remove((key, item))
+                continue
+            on_item(key, item)
+
+async def _repair_request(response_text: str, error: str, url: str, headers: Dict, extra: Dict, priority: str) -> str:
+    """One small text-only request asking the model to fix its own malformed output."""
+    prompt = Prompt(REPAIR_SYSTEM, None, [], text=f"Error: {error}\n\nMalformed output:\n{response_text}")
+    body = _request_body(prompt, extra)
+    headers = {**headers, "Content-Length": str(body.length)}
+    estimated_tokens = prompt.estimated_tokens() + COMPLETION_TOKENS
+    await ratelimit.limiter.acquire(estimated_tokens, priority)
+    response = await http_client.request("POST", url, headers=headers, content=body)
+    ratelimit.limiter.observe(response.headers)
+    response.raise_for_status()
+    data = response.json()
+    ratelimit.limiter.settle(estimated_tokens, (data.get("usage") or {}).get("total_tokens"))
+    return data["choices"][0]["message"]["content"]
+
+def _parse_locally(response_text: str) -> Tuple[Optional[dict], Optional[str]]:
+    """Validated output for a response, repaired locally if need be; or None and the validation error."""
+    try:
+        return _validate_json_response(response_text), None
+    except ValueError as e:
+        error = str(e)
+    repaired = repair_json_response(response_text)
+    if repaired is not None:
+        try:
+            parsed = _validate_json_response(json.dumps(repaired))
+            logger.info(f"Repaired malformed LLM response locally ({error})")
+            parsed["metadata"]["repaired"] = "local"
+            return parsed, None
+        except ValueError:
+            pass
+    return None, error
+
+async def _parse_response(response_text: str, url: str, headers: Dict, extra: Dict, priority: str) -> dict:
+    """
+    Validated output for a response. A malformed one is repaired locally
+    first and, failing that, by a targeted repair request; only when both
+    fail does the caller pay for a full retry. metadata.repaired records
+    which fix was used.
+    """
+    parsed, error = _parse_locally(response_text)
+    if parsed is not None:
+        return parsed
+    if not response_text or len(response_text) > REPAIR_MAX_CHARS:
+        raise ValueError(error)
+    logger.info(f"Asking the model to repair its malformed response ({error})")
+    try:
+        fixed = await _repair_request(response_text, error, url, headers, extra, priority)
+    except Exception as e:
+        logger.warning(f"Repair request failed: {e}")
+        raise ValueError(error)
+    try:
+        parsed = _validate_json_response(fixed)
+    except ValueError:
+        parsed = repair_json_response(fixed)
+        if parsed is None:
+            raise ValueError(error)
+        parsed = _validate_json_response(json.dumps(parsed))
+    if isinstance(parsed.get("metadata"), dict):
+        parsed["metadata"]["repaired"] = "llm"
+    return parsed
+
+def response_key(prompt: Prompt) -> str:
+    """The key call_llm() caches `prompt`'s response under on the configured endpoint."""
+    url, _, extra = _chat_endpoint()
+    return content_key(url, _request_body(prompt, extra).fingerprint())
+
+def batch_body(prompt: Prompt, model: str) -> RequestBody:
+    """`prompt`'s chat-completions body for a Batch API request line, naming the model (or Azure deployment)."""
+    return _request_body(prompt, {"model": model})
+
+def cached_response(key: str) -> Optional[dict]:
+    return response_cache.get_json("llm", key, LLM_CACHE_TTL or None)
+
+def _cacheable(parsed: Dict) -> bool:
+    """Whether a validated response may be cached: a repaired one is used once and asked for again next time."""
+    metadata = parsed.get("metadata")
+    return not (isinstance(metadata, dict) and metadata.get("repaired"))
+
+def cache_response(key: str, response_text: str) -> Optional[dict]:
+    """
+    Validate a response obtained outside call_llm(), such as a Batch API
+    result, and cache it under `key` so call_llm() serves it. None if it
+    is unusable or needed repair, in which case call_llm() asks again.
+    """
+    parsed, error = _parse_locally(response_text)
+    if parsed is None:
+        logger.warning(f"Discarding malformed response for {key[:12]}: {error}")
+        return None
+    if not _cacheable(parsed):
+        logger.warning(f"Not caching repaired response for {key[:12]}")
+        return None
+    response_cache.put_json("llm", key, parsed, replace=True)
+    return parsed
+
+async def call_llm(
+    prompt: Union[Prompt, dict],
+    on_attempt: Optional[Callable[[int], None]] = None,
+    priority: str = "interactive",
+    cache: str = "use",
+    stream: bool = False,
+    on_item: Optional[Callable[[str, Dict], None]] = None
+) -> dict:
     """
     Call LLM with system and user prompts, return validated JSON response.
     
     Args:
-        prompt_dict: Dictionary with 'system' and 'user' keys containing prompt content
+        prompt: A Prompt from build_prompt(), or a dictionary with 'system' and 'user' keys containing prompt content
+        on_attempt: Optional callback invoked with the 1-based attempt number before each try
+        priority: Rate-limiter lane ("interactive" or "batch") the call waits in
+        cache: Response cache mode, one of CACHE_MODES; metadata.cache in the result says hit, miss, refresh or bypass
+        stream: Stream the completion, passing its elements to on_item as they arrive
+        on_item: Optional callback invoked with ("bugs"/"steps", element) for every element as soon as it is complete;
+            elements are sent again after on_attempt if an attempt is retried
         
     Returns:
         Parsed and validated JSON response
@@ -77,15 +479,16 @@ async def call_llm(prompt_dict: dict) -> dict:
         ValueError: If API key not configured or response validation fails
     """
     # Validate input
-    if not isinstance(prompt_dict, dict):
-        raise ValueError("prompt_dict must be a dictionary")
+    if isinstance(prompt, dict):
+        if "system" not in prompt or "user" not in prompt:
+            raise ValueError("prompt_dict must contain 'system' and 'user' keys")
+        prompt = Prompt.from_dict(prompt)
+    elif not isinstance(prompt, Prompt):
+        raise ValueError("prompt must be a Prompt or a dictionary")
+    if cache not in CACHE_MODES:
+        raise ValueError(f"cache must be one of {CACHE_MODES}")
     
-    if "system" not in prompt_dict or "user" not in prompt_dict:
-        raise ValueError("prompt_dict must contain 'system' and 'user' keys")
-    
-    # Get OpenAI client
-    client = _get_openai_client()
-    if not client:
+    if not os.getenv("OPENAI_API_KEY"):
         # Return a stub so the pipeline runs end-to-end for dev
         logger.warning("No OpenAI API key configured, returning stub response")
         return {
@@ -95,122 +498,111 @@ async def call_llm(prompt_dict: dict) -> dict:
             "metadata": {"model_hint": "stub", "version": "v0"}
         }
     
-    # Determine model
-    model = os.getenv("OPENAI_MODEL", "gpt-4o")
-    if os.getenv("AZURE_OPENAI_DEPLOYMENT"):
-        # For Azure, use the deployment name as model
-        model = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+    # The body is built once and re-sent as is by every attempt; streamed
+    # or not, the same request is cached under the same key
+    url, headers, extra = _chat_endpoint()
+    router = get_router(url)
+    body = _request_body(prompt, extra)
+    send_body = _request_body(prompt, extra, stream=True) if stream else body
+    headers = {**headers, "Content-Type": "application/json", "Content-Length": str(send_body.length)}
+    
+    key = None
+    if cache != "bypass":
+        # Hashing the images is a few ms per megabyte, so keep it off the event loop
+        key = content_key(url, await run_io(body.fingerprint))
+    if cache == "use":
+        cached = await run_io(response_cache.get_json, "llm", key, LLM_CACHE_TTL or None)
+        if cached is not None:
+            logger.info("LLM response served from cache")
+            if isinstance(cached.get("metadata"), dict):
+                cached["metadata"]["cache"] = "hit"
+            if on_item:
+                _emit_items(cached, on_item)
+            return cached
     
+    # Each attempt is admitted by the process-wide rate limiter
+    estimated_tokens = prompt.estimated_tokens() + COMPLETION_TOKENS
+    
+    # Elements the current attempt's stream has passed to on_item
+    sent = []
+
+    def stream_item(key: str, item: Dict):
+        sent.append((key, item))
+        on_item(key, item)
+
     max_retries = 3
-    for attempt in range(max_retries):
+    attempt = throttled = 0
+    while True:
+        delay = None
+        sent.clear()
         try:
+            await ratelimit.limiter.acquire(estimated_tokens, priority)
             logger.info(f"Calling LLM (attempt {attempt + 1}/{max_retries})")
+            if on_attempt:
+                on_attempt(attempt + throttled + 1)
             
-            # Make the API call
-            # For Azure OpenAI, we need to add the API version as a query parameter
-            azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-            azure_deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT")
-            azure_api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview")
-            api_key = os.getenv("OPENAI_API_KEY")
-            
-            # Parse the user prompt to extract images and text content
-            import json
-            user_data = json.loads(prompt_dict["user"])
-            
-            # Build messages with images
-            messages = [{"role": "system", "content": prompt_dict["system"]}]
+            # Sent on the app-wide pool, reusing warm connections, to the
+            # deployment the router picks (hedged onto a second one if slow)
+            response, deployment = await router.send(
+                lambda d: http_client.request("POST", d.url, headers={**headers, **d.headers}, content=send_body, stream=stream),
+                stream=stream,
+                admit=lambda: ratelimit.limiter.acquire(estimated_tokens, priority)
+            )
+            try:
+                ratelimit.limiter.observe(response.headers)
+                if response.status_code in RETRY_AFTER_STATUSES:
+                    delay = ratelimit.retry_after(response.headers)
+                    if delay is not None and router.available(deployment):
+                        # Another deployment can take the retry right away
+                        router.throttle(deployment, delay)
+                    elif delay is not None:
+                        # Everyone waits, so the burst that hit the limit doesn't retry at once
+                        ratelimit.limiter.pause(delay)
+                response.raise_for_status()
+                streamed = response.headers.get("content-type", "").startswith("text/event-stream")
+                if streamed:
+                    response_text, used = await _read_stream(response, stream_item if on_item else None)
+                    # Without reported usage, count the completion at about 4 characters a token
+                    ratelimit.limiter.settle(estimated_tokens, used or prompt.estimated_tokens() + len(response_text) // 4)
+                else:
+                    # Not streamed (or the server answered in one piece)
+                    await response.aread()
+                    data = response.json()
+                    ratelimit.limiter.settle(estimated_tokens, (data.get("usage") or {}).get("total_tokens"))
+                    response_text = data["choices"][0]["message"]["content"]
+            finally:
+                await response.aclose()
             
-            # Create user message content
-            user_content = []
-            
-            # Add text content first
-            text_content = {
-                "type": "text",
-                "text": f"Please analyze these mobile app screenshots for QA issues. Here's the scenario context:\n\nScenario: {user_data['scenario']['id']}\nSource apps: {', '.join(user_data['scenario']['source_apps'])}\nFile size: {user_data['scenario']['file_size_bucket']}\nProtection: {user_data['scenario']['protection_level']}\nFile type: {user_data['scenario']['file_type']}\n\nPlease examine each screenshot and identify any bugs, issues, or violations. Return your analysis in the specified JSON format."
-            }
-            user_content.append(text_content)
-            
-            # Add images from frames
-            for frame in user_data.get("frames", []):
-                if "image_base64" in frame:
-                    image_content = {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": frame["image_base64"]
-                        }
-                    }
-                    user_content.append(image_content)
-            
-            messages.append({"role": "user", "content": user_content})
-            
-            if azure_endpoint and azure_deployment:
-                # Use the full URL with API version for Azure
-                import httpx
-                url = f"{azure_endpoint.rstrip('/')}/openai/deployments/{azure_deployment}/chat/completions?api-version={azure_api_version}"
-                headers = {
-                    "Content-Type": "application/json",
-                    "api-key": api_key
-                }
-                data = {
-                    "messages": messages,
-                    "temperature": 0.1,
-                    "response_format": {"type": "json_object"}
-                }
-                
-                async with httpx.AsyncClient(timeout=120.0) as http_client:
-                    response = await http_client.post(url, headers=headers, json=data)
-                    response.raise_for_status()
-                    response_data = response.json()
-                    # Convert to OpenAI format
-                    class MockResponse:
-                        def __init__(self, data):
-                            self.choices = [type('Choice', (), {
-                                'message': type('Message', (), {
-                                    'content': data['choices'][0]['message']['content']
-                                })()
-                            })()]
-                    response = MockResponse(response_data)
-            else:
-                # Standard OpenAI call
-                response = await client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=0.1,  # Low temperature for consistent JSON output
-                    response_format={"type": "json_object"}  # Force JSON response
-                )
-            
-            response_text = response.choices[0].message.content
-            
-            # Validate and parse the response
-            parsed_response = _validate_json_response(response_text)
+            # Validate and parse the response, repairing it if it is malformed
+            parsed_response = await _parse_response(response_text, url, headers, extra, priority)
             logger.info("LLM response validated successfully")
+            if key is not None and _cacheable(parsed_response):
+                try:
+                    await run_io(response_cache.put_json, "llm", key, parsed_response, replace=True)
+                except OSError as e:
+                    logger.warning(f"Could not cache LLM response: {e}")
+            if isinstance(parsed_response.get("metadata"), dict):
+                parsed_response["metadata"]["cache"] = "miss" if cache == "use" else cache
+            if on_item:
+                # Whatever the stream did not pass on: all of an unstreamed
+                # answer, or the elements that needed repair
+                _emit_items(parsed_response, on_item, sent)
             return parsed_response
             
         except Exception as e:
             logger.warning(f"LLM call attempt {attempt + 1} failed: {e}")
             
-            if attempt == max_retries - 1:
+            if delay is not None and throttled < MAX_THROTTLED_RETRIES:
+                # Told when to come back: wait that out in the limiter
+                # without using up an attempt
+                throttled += 1
+                continue
+            
+            attempt += 1
+            if attempt == max_retries:
                 # Last attempt failed, raise the error
                 raise ValueError(f"LLM call failed after {max_retries} attempts: {e}")
             
-            # For JSON validation errors, try to fix by asking the model
-            if "Invalid JSON format" in str(e) or "Response validation failed" in str(e):
-                logger.info("Attempting to fix JSON response")
-                fix_prompt = f"""
-The previous response had JSON validation errors: {e}
-
-Please provide a corrected JSON response that follows this exact structure:
-{{
-    "bugs": [{{"bug_id": "string", "description": "string", "severity": "string", "step_no": number}}],
-    "steps": [{{"step_no": number, "summary": "string", "frames": [number]}}],
-    "assumptions": "string",
-    "metadata": {{"model_hint": "string", "version": "string"}}
-}}
-
-Original response: {response_text}
-"""
-                prompt_dict["user"] = fix_prompt
-            else:
-                # For other errors, wait before retry
-                import asyncio
-                await asyncio.sleep(2 ** attempt)  # Exponential backoff
+            # Malformed JSON is retried at once; other errors back off with jitter first
+            if "Invalid JSON format" not in str(e) and "Response validation failed" not in str(e):
+                await asyncio.sleep(ratelimit.backoff(attempt - 1))
@@ -0,0 +1,442 @@
+
+import asyncio, hashlib, json, logging, os, shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from core.cache import ArtifactCache, content_key, file_hash
+from core.eval import DATA_DIR as EVAL_DATA_DIR, evaluate_run
+from core.executors import run_io
+from core.llm import call_llm
+from core.prompt import (
+    ENCODE_WORKERS, IMAGE_LEVELS, DeltaRegions, Prompt, build_prompt, encode_image,
+    frame_entry, frame_size, plan_images
+)
+from core.reports import write_html_report
+from core.schemas import Config
+from core.video import FrameWriter, aiter_keyframes
+from core.windowed import WindowedAnalysis, consolidate
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.join(os.path.dirname(__file__), "..")
+# Processes used to decode long videos in parallel time ranges
+KEYFRAME_WORKERS = int(os.getenv("KEYFRAME_WORKERS", "1"))
+# Threads that JPEG-encode keyframes while the video is still being decoded
+encode_pool = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="encode")
+
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(BASE_DIR, "cache"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(2 << 30)))
+cache = ArtifactCache(CACHE_DIR, CACHE_MAX_BYTES)
+
+# Bump when keyframe selection changes in a way the parameters don't capture
+KEYFRAMES_VERSION = 2
+FPS_CAP = 1.0
+IMAGE_FORMAT = "jpg"
+
+def keyframe_params(cfg: Config) -> Dict:
+    """Everything besides the video bytes that decides which keyframes come out."""
+    return {
+        "version": KEYFRAMES_VERSION,
+        "detector": cfg.detector,
+        "min_scene_delta": cfg.min_scene_delta,
+        "fps_cap": FPS_CAP,
+        "dedupe": cfg.dedupe,
+        "max_frames": cfg.max_frames,
+        "image_format": IMAGE_FORMAT,
+        # Crops are stored with the keyframes they were computed for
+        "delta_regions": cfg.delta_regions,
+    }
+
+def _frame_hash(meta: Dict) -> str:
+    image = meta.get("image")
+    if image is None:
+        return meta.get("frame_hash") or file_hash(meta["path"])
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(image.shape).encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+def _encode_cached(meta: Dict, level: Optional[Dict] = None) -> Dict:
+    """
+    encode_frame() behind the image cache, keyed by frame content and encode
+    settings. `level` is the frame's image plan entry, default full size.
+    """
+    if meta.get("duplicate_of") is not None:
+        return frame_entry(meta)
+    # Keyed by the level itself, not the plan's width clamped to the frame,
+    # so a frame encoded while decoding and one restored from the keyframe
+    # cache share a cached image, and with it the exact LLM request
+    level = IMAGE_LEVELS[level["level"]] if level else IMAGE_LEVELS[-1]
+    try:
+        meta["frame_hash"] = _frame_hash(meta)
+        key = content_key(meta["frame_hash"], level["width"], level["quality"], *([meta["crop"]] if meta.get("crop") else []))
+        cached = cache.get_json("images", key)
+        if cached is not None:
+            return frame_entry(meta, cached["url"], level["detail"])
+        url = encode_image(meta, level["width"], level["quality"])
+        cache.put_json("images", key, {"url": url.decode("ascii")})
+        return frame_entry(meta, url, level["detail"])
+    except Exception as e:
+        logger.warning(f"Could not encode image {meta['path']}: {e}")
+        return frame_entry(meta)
+    finally:
+        # The decoded frame is only needed for the prompt; drop it once encoded
+        meta.pop("image", None)
+
+def _restore_keyframes(entry_dir: str, frames_dir: str) -> List[Dict]:
+    """Copy cached keyframes into this run's frames dir and return their metadata."""
+    os.makedirs(frames_dir, exist_ok=True)
+    with open(os.path.join(entry_dir, "payload.json"), "r", encoding="utf-8") as f:
+        frames = json.load(f)
+    for meta in frames:
+        dst = os.path.join(frames_dir, meta.pop("file"))
+        if not os.path.exists(dst):
+            try:
+                os.link(os.path.join(entry_dir, os.path.basename(dst)), dst)
+            except OSError:
+                shutil.copy2(os.path.join(entry_dir, os.path.basename(dst)), dst)
+        meta["path"] = dst
+    return frames
+
+def _store_keyframes(key: str, frames: List[Dict]):
+    payload, files = [], []
+    for meta in frames:
+        # Crops are kept as computed from the decoded frames: recomputed from
+        # the saved JPEGs they come out a few pixels different, and so would
+        # the request and its LLM cache key
+        item = {k: v for k, v in meta.items() if k not in ("path", "image")}
+        item["file"] = os.path.basename(meta["path"])
+        payload.append(item)
+        if meta.get("duplicate_of") is None:
+            files.append(meta["path"])
+    cache.put_dir("keyframes", key, files=files, payload=payload)
+
+def _write_json(path: str, payload):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+
+def _no_progress(stage: str, **counts):
+    pass
+
+def _iter_keyframes(vid_path: str, frames_dir: str, cfg: Config, writer: Optional[FrameWriter]):
+    return aiter_keyframes(
+        vid_path, frames_dir,
+        min_scene_delta=cfg.min_scene_delta,
+        fps_cap=FPS_CAP,
+        workers=KEYFRAME_WORKERS,
+        detector=cfg.detector,
+        image_format=IMAGE_FORMAT,
+        writer=writer,
+        dedupe=cfg.dedupe,
+        max_frames=cfg.max_frames
+    )
+
+async def stream_encoded_frames(
+    vid_path: str,
+    frames_dir: str,
+    cfg: Config,
+    writer: Optional[FrameWriter] = None,
+    progress: Callable[..., None] = _no_progress
+) -> AsyncIterator[Tuple[Dict, Dict]]:
+    """
+    Decode, select and encode keyframes as a pipeline.
+
+    Each keyframe is handed to the encode pool the moment it is selected,
+    straight from the decoded frame, so JPEG encoding overlaps decoding of
+    the rest of the video. Report images are persisted by `writer` in the
+    background. Yields (frame_meta, encoded_frame) in frame order as soon
+    as a frame and all frames before it are encoded, so callers can start
+    on early frames before decoding has finished. Frames are encoded at
+    full size, or cropped to their changed region with cfg.delta_regions;
+    budgeted runs go through _collect_keyframes instead.
+    """
+    loop = asyncio.get_running_loop()
+    pending = deque()
+    extracted = encoded = 0
+    regions = DeltaRegions() if cfg.delta_regions else None
+    async for meta in _iter_keyframes(vid_path, frames_dir, cfg, writer):
+        if meta.get("duplicate_of") is None:
+            meta["size"] = frame_size(meta)
+        if regions is not None:
+            await run_io(regions.assign, meta)
+        pending.append((meta, loop.run_in_executor(encode_pool, _encode_cached, meta)))
+        extracted += 1
+        progress("frames", frames=extracted, images=encoded)
+        while pending and pending[0][1].done():
+            meta_done, fut = pending.popleft()
+            encoded += 1
+            yield meta_done, fut.result()
+    while pending:
+        meta_done, fut = pending.popleft()
+        result = await fut
+        encoded += 1
+        progress("images", frames=extracted, images=encoded)
+        yield meta_done, result
+
+async def _collect_keyframes(
+    vid_path: str,
+    frames_dir: str,
+    cfg: Config,
+    writer: FrameWriter,
+    progress: Callable[..., None] = _no_progress
+) -> List[Dict]:
+    """
+    Extract keyframes without encoding them. Used when the image plan
+    needs every frame's score first; decoded frames are dropped as they
+    come, and are encoded from the files `writer` saves.
+    """
+    frames = []
+    regions = DeltaRegions() if cfg.delta_regions else None
+    async for meta in _iter_keyframes(vid_path, frames_dir, cfg, writer):
+        if meta.get("duplicate_of") is None:
+            meta["size"] = frame_size(meta)
+        if regions is not None:
+            await run_io(regions.assign, meta)
+        meta.pop("image", None)
+        frames.append(meta)
+        progress("frames", frames=len(frames), images=0)
+    await run_io(writer.wait)
+    return frames
+
+async def _call_llm(
+    prompt: Prompt,
+    cfg: Config,
+    stats: Dict[str, int],
+    found: Dict[int, List],
+    progress: Callable[..., None] = _no_progress,
+    priority: str = "interactive"
+) -> Dict:
+    """
+    call_llm() with the run's cache and streaming settings, counting
+    response-cache hits/misses in `stats`. Bugs and steps are reported
+    through progress() as they stream in; `found` holds them per call so
+    that concurrent windows add up and a retried call starts over.
+    """
+    call = len(found)
+    found[call] = []
+
+    def report():
+        items = [entry for entries in found.values() for entry in entries]
+        progress(
+            "llm",
+            bugs_found=[item for key, item in items if key != "steps"],
+            steps_found=[item for key, item in items if key == "steps"]
+        )
+
+    def on_attempt(n: int):
+        found[call] = []
+        progress("llm", llm_attempt=n)
+
+    def on_item(key: str, item: Dict):
+        found[call].append((key, item))
+        report()
+
+    llm_json = await call_llm(
+        prompt, on_attempt=on_attempt, priority=priority, cache=cfg.llm_cache, stream=cfg.stream, on_item=on_item
+    )
+    stats["hit" if (llm_json.get("metadata") or {}).get("cache") == "hit" else "miss"] += 1
+    return llm_json
+
+def _golden_hash(golden_csv: Optional[str] = None) -> Optional[str]:
+    path = golden_csv or os.path.join(EVAL_DATA_DIR, "golden_bugs.csv")
+    return file_hash(path) if os.path.exists(path) else None
+
+async def _prepare_frames(
+    run_dir: str,
+    vid_path: str,
+    cfg: Config,
+    video_hash: str,
+    progress: Callable[..., None],
+    windows: Optional[WindowedAnalysis],
+    stages: Dict[str, str]
+) -> Tuple[List[Dict], List[Dict], Dict, Optional[FrameWriter], str]:
+    """
+    Keyframes, their image plan and encoded prompt entries for a run, via
+    the artifact cache. Entries are added to `windows` as they are
+    encoded. Returns (frames, encoded, plan, writer, keyframes key); on a
+    keyframe-cache miss `writer` may still be saving report images.
+    """
+    loop = asyncio.get_running_loop()
+    frames_dir = os.path.join(run_dir, "frames")
+
+    # Keyframes + encoded images
+    kf_key = content_key(video_hash, keyframe_params(cfg))
+    budgeted = cfg.token_budget is not None or cfg.byte_budget is not None
+    writer = None
+    encoded = None
+    entry_dir = cache.get_dir("keyframes", kf_key)
+    if entry_dir is not None:
+        stages["keyframes"] = "hit"
+        frames = await run_io(_restore_keyframes, entry_dir, frames_dir)
+        progress("frames", frames=len(frames), images=0)
+    else:
+        stages["keyframes"] = "miss"
+        # Report images are written in the background
+        writer = FrameWriter()
+        if budgeted:
+            frames = await _collect_keyframes(vid_path, frames_dir, cfg, writer, progress)
+        else:
+            frames, encoded = [], []
+            try:
+                async for meta, enc in stream_encoded_frames(vid_path, frames_dir, cfg, writer, progress):
+                    frames.append(meta)
+                    encoded.append(enc)
+                    if windows is not None:
+                        windows.add(enc)
+            except BaseException:
+                # Windows already sent must not outlive a failed run
+                if windows is not None:
+                    windows.cancel()
+                raise
+
+    # Per-frame resolution/quality/detail within the request budget
+    plan = await run_io(plan_images, frames, cfg.token_budget, cfg.byte_budget)
+    await run_io(_write_json, os.path.join(run_dir, "image_plan.json"), plan)
+    if encoded is None:
+        encoded = await asyncio.gather(*(
+            loop.run_in_executor(encode_pool, _encode_cached, meta, level)
+            for meta, level in zip(frames, plan["frames"])
+        ))
+        progress("images", frames=len(frames), images=len(encoded))
+    if windows is not None and len(windows.entries) < len(encoded):
+        for enc in encoded:
+            windows.add(enc)
+    return frames, encoded, plan, writer, kf_key
+
+async def build_prompts(
+    run_dir: str,
+    vid_path: str,
+    cfg: Config,
+    video_hash: Optional[str] = None,
+    progress: Callable[..., None] = _no_progress
+) -> List[Prompt]:
+    """
+    The prompts run_analysis() would send for this upload, one or (with
+    cfg.window_size) one per window, without sending them. Keyframes and
+    images go into the artifact cache on the way, so a run_analysis() of
+    the same upload afterwards rebuilds the same requests cheaply.
+    """
+    if video_hash is None:
+        video_hash = await run_io(file_hash, vid_path)
+    prompts = []
+    windows = None
+    if cfg.window_size:
+        async def collect(prompt: Prompt) -> Dict:
+            prompts.append(prompt)
+            return {}
+
+        base = await run_io(build_prompt, cfg, [], encoded_frames=[])
+        windows = WindowedAnalysis(base, cfg.window_size, min(cfg.window_overlap, cfg.window_size - 1), collect)
+    frames, encoded, _, writer, kf_key = await _prepare_frames(run_dir, vid_path, cfg, video_hash, progress, windows, {})
+    if writer is not None:
+        await run_io(writer.wait)
+        await run_io(_store_keyframes, kf_key, frames)
+    if windows is None:
+        return [await run_io(build_prompt, cfg, frames, encoded_frames=encoded)]
+    await windows.finish()
+    return prompts
+
+async def run_analysis(
+    run_dir: str,
+    vid_path: str,
+    cfg: Config,
+    video_hash: Optional[str] = None,
+    progress: Callable[..., None] = _no_progress,
+    priority: str = "interactive",
+    golden_csv: Optional[str] = None
+) -> Dict:
+    """
+    Run keyframes -> prompt -> LLM -> eval -> report for one upload.
+
+    Every stage is looked up in the artifact cache by the hash of its
+    inputs, so a re-upload only recomputes from the first stage whose
+    inputs changed: keyframes by video hash + extraction params, images by
+    frame hash + encode settings, the LLM response (in call_llm's response
+    cache, per cfg.llm_cache) by the exact request, and the eval by LLM
+    output + golden list. Image settings come from
+    plan_images() for the budgets in `cfg` and are saved as
+    image_plan.json. Cache hits/misses, the prompt-asset versions and the
+    rules put in the prompt are recorded in run.json.
+
+    With cfg.window_size the LLM stage is a WindowedAnalysis: windows of
+    frames are sent (and cached) one by one as soon as their frames are
+    encoded, then merged.
+
+    `progress(stage, **counts)` is called as the run moves through the
+    frames, images, llm, eval and report stages; during llm it carries
+    the bugs and steps found so far. LLM calls wait in the
+    rate limiter's `priority` lane. The eval is against `golden_csv`,
+    by default the built-in data/golden_bugs.csv.
+
+    Nothing here blocks the event loop: decoding and image encoding run on
+    threads (OpenCV and Pillow release the GIL); prompt assembly, the
+    eval (a small CSV-bound comparison), file and cache I/O run on the I/O
+    pool.
+    """
+    stages = {}
+    if video_hash is None:
+        video_hash = await run_io(file_hash, vid_path)
+
+    llm_stats = {"hit": 0, "miss": 0}
+    found = {}
+    windows = None
+    if cfg.window_size:
+        base = await run_io(build_prompt, cfg, [], encoded_frames=[])
+        windows = WindowedAnalysis(
+            base, cfg.window_size, min(cfg.window_overlap, cfg.window_size - 1),
+            lambda prompt: _call_llm(prompt, cfg, llm_stats, found, progress, priority),
+            on_window=lambda done, total: progress("llm", windows_done=done, windows=total)
+        )
+    frames, encoded, plan, writer, kf_key = await _prepare_frames(
+        run_dir, vid_path, cfg, video_hash, progress, windows, stages
+    )
+    if writer is not None:
+        # Cached before the LLM call, so a failed call or eval doesn't cost
+        # the next run the extraction
+        await run_io(writer.wait)
+        await run_io(_store_keyframes, kf_key, frames)
+
+    # Build prompt and call LLM
+    if windows is None:
+        # The images are only referenced, so this is cheap and needs no process
+        prompt = await run_io(build_prompt, cfg, frames, encoded_frames=encoded)
+        llm_json = await _call_llm(prompt, cfg, llm_stats, found, progress, priority)
+    else:
+        prompt = windows.base
+        llm_json = await windows.finish()
+        if cfg.consolidate:
+            llm_json = await consolidate(llm_json, lambda p: _call_llm(p, cfg, llm_stats, found, progress, priority))
+    stages["llm"] = "hit" if not llm_stats["miss"] else "miss" if not llm_stats["hit"] else "partial"
+    if isinstance(llm_json.get("metadata"), dict):
+        llm_json["metadata"]["cache"] = stages["llm"]
+
+    # Persist outputs
+    await run_io(_write_json, os.path.join(run_dir, "llm_output.json"), llm_json)
+
+    # Eval vs the golden list
+    progress("eval")
+    # Whether the response came from the cache doesn't change its eval
+    findings = dict(llm_json, metadata={k: v for k, v in (llm_json.get("metadata") or {}).items() if k != "cache"})
+    eval_key = content_key(cfg.scenario_id, findings, await run_io(_golden_hash, golden_csv))
+    eval_payload = await run_io(cache.get_json, "eval", eval_key)
+    stages["eval"] = "hit" if eval_payload is not None else "miss"
+    if eval_payload is None:
+        eval_payload = await run_io(evaluate_run, cfg.scenario_id, llm_json, golden_csv)
+        await run_io(cache.put_json, "eval", eval_key, eval_payload)
+    await run_io(_write_json, os.path.join(run_dir, "eval.json"), eval_payload)
+
+    # Write HTML report
+    progress("report")
+    await run_io(write_html_report, run_dir, cfg, frames, llm_json, eval_payload)
+
+    run_meta = {
+        "video_hash": video_hash,
+        "frames": len(frames),
+        "prompt_assets": prompt.assets,
+        "prompt_rules": prompt.rules,
+        "estimated_tokens": plan["estimated_tokens"],
+        "llm_windows": windows.windows if windows is not None else None,
+        "cache": stages
+    }
+    await run_io(_write_json, os.path.join(run_dir, "run.json"), run_meta)
+    return run_meta
@@ -1,134 +1,44 @@
 
-import json, os, textwrap, base64
+import json, os, textwrap, base64, hashlib, heapq, logging, math, threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import cv2
+import numpy as np
 from PIL import Image
 import io
 
+logger = logging.getLogger(__name__)
+
 DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
 
-def load_blueprint():
-    bp_path = os.path.join(DATA_DIR, "mobile_prompt_blueprint.md")
-    try:
-        with open(bp_path, "r", encoding="utf-8") as f:
-            return f.read()
-    except Exception:
-        return ""
-
-def load_critical_rules(max_rules=10):
-    """Load and select the most critical rules from rulebook.json."""
-    rulebook_path = os.path.join(DATA_DIR, "rulebook.json")
-    try:
-        with open(rulebook_path, "r", encoding="utf-8") as f:
-            rulebook = json.load(f)
-    except Exception:
-        return ""
-    
-    # Define priority order for critical rules (most important first)
-    priority_rules = [
-        "R25_password_prompt_presence",      # Password protection critical
-        "R32_error_actionable_copy",         # Error handling critical
-        "R29_error_over_spinner",            # UI state critical
-        "R31_error_primacy",                 # UI layering critical
-        "R30_state_regression_after_error",  # State management critical
-        "R26_redundant_desktop_cta_under_100mb",  # File size handling
-        "R34_password_label_flow",           # Complex protection scenarios
-        "R35_account_mismatch_primary_secondary",  # Account handling
-        "R36_account_mismatch_secondary_primary",  # Account handling
-        "R37_app_precedence_when_multiple",  # App selection logic
-        "R38_no_app_installed_requires_store_cta",  # Installation guidance
-        "R39_xl_threshold_desktop_redirect", # Large file handling
-        "R27_loader_duplication"             # UI consistency
-    ]
-    
-    # Select top rules that exist in the rulebook
-    selected_rules = []
-    for rule_id in priority_rules:
-        if rule_id in rulebook and len(selected_rules) < max_rules:
-            selected_rules.append((rule_id, rulebook[rule_id]))
-    
-    # Format rules for prompt
-    if not selected_rules:
-        return ""
-    
-    rules_text = "\n\n## Critical Rules for Analysis:\n"
-    for rule_id, rule_data in selected_rules:
-        rules_text += f"\n**{rule_id}**: {rule_data.get('violation', 'No description')}\n"
-        
-        # Add key conditions if present
-        if 'if' in rule_data:
-            rules_text += f"  - Conditions: {json.dumps(rule_data['if'], separators=(',', ':'))}\n"
-        if 'detect' in rule_data:
-            rules_text += f"  - Detect: {rule_data['detect']}\n"
-        if 'expect_cta_contains' in rule_data:
-            rules_text += f"  - Expected CTA: {', '.join(rule_data['expect_cta_contains'])}\n"
-        if 'forbid_errors' in rule_data:
-            rules_text += f"  - Forbidden errors: {', '.join(rule_data['forbid_errors'])}\n"
-    
-    return rules_text
+# Prompt images are at most this wide, JPEG at this quality
+MAX_IMAGE_WIDTH = 1024
+JPEG_QUALITY = 85
+# Encode settings the image planner chooses from, cheapest first. "bpp" is
+# a conservative estimate of base64 bytes per pixel for UI screenshots.
+IMAGE_LEVELS = [
+    {"width": 512, "quality": 70, "detail": "low", "bpp": 0.15},
+    {"width": 512, "quality": 75, "detail": "high", "bpp": 0.17},
+    {"width": 768, "quality": 80, "detail": "high", "bpp": 0.2},
+    {"width": MAX_IMAGE_WIDTH, "quality": JPEG_QUALITY, "detail": "high", "bpp": 0.25},
+]
+# Tokens kept aside from a request budget for the system prompt and scenario text
+TEXT_TOKEN_RESERVE = 2500
+# Delta-region mode: a keyframe whose changes against its reference frame
+# cover more than this share of the screen is sent in full instead of cropped
+DELTA_MAX_AREA = 0.4
+# Per-channel difference (of 4x4 block averages) that counts as a change,
+# and the padding kept around the changed region
+DELTA_PIXEL_THRESHOLD = 10
+DELTA_MARGIN = 16
+# Threads that encode prompt images in parallel (Pillow releases the GIL
+# while resizing and compressing)
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", "4"))
 
-def build_prompt(cfg, frames):
-    blueprint = load_blueprint()
-    critical_rules = load_critical_rules(max_rules=10)
-    
-    # Convert frames to base64 and include both metadata and image content
-    frames_with_images = []
-    for f in frames:
-        try:
-            # Read and compress the image to reduce size
-            with Image.open(f["path"]) as img:
-                # Resize if too large (max 1024px width)
-                if img.width > 1024:
-                    ratio = 1024 / img.width
-                    new_height = int(img.height * ratio)
-                    img = img.resize((1024, new_height), Image.Resampling.LANCZOS)
-                
-                # Convert to RGB if needed and compress
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    img = img.convert('RGB')
-                
-                # Save to bytes with compression
-                img_buffer = io.BytesIO()
-                img.save(img_buffer, format='JPEG', quality=85, optimize=True)
-                img_data = base64.b64encode(img_buffer.getvalue()).decode('utf-8')
-            
-            frame_data = {
-                "index": f["index"], 
-                "ts_ms": f["ts_ms"], 
-                "rel_path": f["path"].split("static/")[-1],
-                "image_base64": f"data:image/jpeg;base64,{img_data}"
-            }
-            frames_with_images.append(frame_data)
-        except Exception as e:
-            print(f"Warning: Could not encode image {f['path']}: {e}")
-            # Fallback to metadata only
-            frame_data = {
-                "index": f["index"], 
-                "ts_ms": f["ts_ms"], 
-                "rel_path": f["path"].split("static/")[-1]
-            }
-            frames_with_images.append(frame_data)
-    
-    user_payload = {
-        "scenario": {
-            "id": cfg.scenario_id,
-            "source_apps": cfg.source_apps,
-            "file_size_bucket": cfg.file_size_bucket,
-            "protection_level": cfg.protection_level,
-            "file_type": cfg.file_type,
-            "notes": cfg.notes or ""
-        },
-        "frames": frames_with_images,
-        "instructions": {
-            "return_format": {
-                "bugs":[{"id":"","title":"","description":"","severity":"","category":"","evidence_frames":[],"suggestions":""}],
-                "steps":[{"step_no":0,"summary":"","frames":[]}],
-                "assumptions":"",
-                "metadata":{"version":"v0"}
-            }
-        }
-    }
-    
-    # Build system prompt with character limit management
-    system = """You are a meticulous QA triage assistant for Outlook→Excel Previewer→Excel Desktop flows. 
+# Upper bound on the assembled system prompt
+MAX_SYSTEM_CHARS = 8000
+
+BASE_SYSTEM = """You are a meticulous QA triage assistant for Outlook→Excel Previewer→Excel Desktop flows. 
 
 CRITICAL: You must respond with ONLY valid JSON. No additional text, explanations, or formatting outside the JSON structure.
 
@@ -144,14 +54,217 @@ Return your analysis in this EXACT JSON format:
   "assumptions": "Your assumptions about the scenario",
   "metadata": {"version": "v1.0"}
 }"""
+
+class PromptAsset:
+    """
+    A prompt data file that is parsed once and reloaded only when it changes.
+
+    Every load() stats the file; it is re-read when mtime or size moved and
+    re-parsed only when the content hash differs. `version` is a short
+    content hash ("missing" when the file is absent), stable across
+    processes and restarts.
+    """
+    def __init__(self, name: str, parse: Callable[[bytes], Any], default: Any):
+        self.path = os.path.join(DATA_DIR, name)
+        self.parse = parse
+        self.default = default
+        self.value = default
+        self.version = "missing"
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def load(self) -> Tuple[Any, str]:
+        try:
+            st = os.stat(self.path)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        with self._lock:
+            if stamp != self._stamp:
+                self._reload(stamp)
+            return self.value, self.version
+
+    def _reload(self, stamp):
+        self._stamp = stamp
+        if stamp is None:
+            self.value, self.version = self.default, "missing"
+            return
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except OSError:
+            self.value, self.version = self.default, "missing"
+            return
+        version = hashlib.sha256(data).hexdigest()[:12]
+        if version == self.version:
+            # Touched but unchanged
+            return
+        try:
+            self.value = self.parse(data)
+        except Exception as e:
+            logger.warning(f"Could not parse {self.path}: {e}")
+            self.value = self.default
+        self.version = version
+
+# Rulebook condition values implied by the Config fields
+SIZE_TIERS = {"small": "S", "medium": "M", "large": "L"}
+PROTECTION_LABELS = {"confidential": "Confidential", "highly_confidential": "Highly Confidential"}
+
+# Order in which applicable rules are offered (most important first); rules
+# not listed follow in rulebook order
+PRIORITY_RULES = [
+    "R25_password_prompt_presence",      # Password protection critical
+    "R32_error_actionable_copy",         # Error handling critical
+    "R29_error_over_spinner",            # UI state critical
+    "R31_error_primacy",                 # UI layering critical
+    "R30_state_regression_after_error",  # State management critical
+    "R26_redundant_desktop_cta_under_100mb",  # File size handling
+    "R34_password_label_flow",           # Complex protection scenarios
+    "R35_account_mismatch_primary_secondary",  # Account handling
+    "R36_account_mismatch_secondary_primary",  # Account handling
+    "R37_app_precedence_when_multiple",  # App selection logic
+    "R38_no_app_installed_requires_store_cta",  # Installation guidance
+    "R39_xl_threshold_desktop_redirect", # Large file handling
+    "R27_loader_duplication"             # UI consistency
+]
+
+# Character budget for the rules section of the system prompt
+RULES_MAX_CHARS = 2500
+RULES_HEADER = "\n\n## Critical Rules for Analysis:\n"
+
+def scenario_facts(cfg) -> Dict[str, Any]:
+    """The rulebook condition values a scenario config pins down."""
+    return {
+        "conditions.file.size_tier": SIZE_TIERS.get(cfg.file_size_bucket),
+        "conditions.file.protection.password": cfg.protection_level == "password",
+        "conditions.file.protection.label": PROTECTION_LABELS.get(cfg.protection_level),
+        "conditions.file.type": cfg.file_type,
+        "conditions.source_apps": list(cfg.source_apps),
+    }
+
+def format_rule(rule_id, rule_data):
+    """One rule as it appears in the system prompt."""
+    text = f"\n**{rule_id}**: {rule_data.get('violation', 'No description')}\n"
     
-    # Add blueprint with dynamic sizing based on available space
-    max_system_chars = 8000
-    base_system_len = len(system)
-    rules_len = len(critical_rules) if critical_rules else 0
+    # Add key conditions if present
+    if 'if' in rule_data:
+        text += f"  - Conditions: {json.dumps(rule_data['if'], separators=(',', ':'))}\n"
+    if 'detect' in rule_data:
+        text += f"  - Detect: {rule_data['detect']}\n"
+    if 'expect_cta_contains' in rule_data:
+        text += f"  - Expected CTA: {', '.join(rule_data['expect_cta_contains'])}\n"
+    if 'forbid_errors' in rule_data:
+        text += f"  - Forbidden errors: {', '.join(rule_data['forbid_errors'])}\n"
+    return text
+
+def _condition_values(expected) -> List[Any]:
+    """Values a rule condition accepts: {"in": [...]} or a single value."""
+    values = expected["in"] if isinstance(expected, dict) and "in" in expected else [expected]
+    return [v if isinstance(v, (str, int, float, bool, type(None))) else json.dumps(v, sort_keys=True) for v in values]
+
+class RuleIndex:
+    """
+    rulebook.json indexed by the rules' `if` conditions.
+
+    by_condition[key][value] holds the rules that accept `value` for
+    condition `key`. select() looks a scenario's facts up there: a rule is
+    dropped as soon as a known fact fails one of its conditions. Rules
+    whose conditions are all met (or that have none) apply; rules that
+    also depend on facts the config does not pin down (accounts, installed
+    apps) are only possible, and a scenario's rules section leaves them
+    out. Built once per rulebook version, with the rules section memoized
+    per scenario.
+    """
+    def __init__(self, rulebook):
+        self.rules = rulebook if isinstance(rulebook, dict) else {}
+        rank = {rule_id: i for i, rule_id in enumerate(PRIORITY_RULES)}
+        self.order = sorted(self.rules, key=lambda rule_id: rank.get(rule_id, len(rank)))
+        self.conditions: Dict[str, List[str]] = {}
+        self.by_condition: Dict[str, Dict[Any, set]] = {}
+        for rule_id in self.order:
+            conditions = self.rules[rule_id].get("if") or {}
+            self.conditions[rule_id] = list(conditions)
+            for key, expected in conditions.items():
+                for value in _condition_values(expected):
+                    self.by_condition.setdefault(key, {}).setdefault(value, set()).add(rule_id)
+        self.formatted = {rule_id: format_rule(rule_id, self.rules[rule_id]) for rule_id in self.order}
+        self._sections: Dict[Tuple, Tuple[str, List[str]]] = {}
+
+    def select(self, facts: Optional[Dict[str, Any]] = None) -> Tuple[List[str], List[str]]:
+        """(rules that apply, rules that may apply) for the facts, in priority order."""
+        facts = facts or {}
+        matched = {}
+        for key, fact in facts.items():
+            values = self.by_condition.get(key)
+            if values is None:
+                continue
+            matched[key] = set()
+            for value in (fact if isinstance(fact, (list, tuple)) else [fact]):
+                matched[key] |= values.get(value, set())
+        applies, possible = [], []
+        for rule_id in self.order:
+            known = [key for key in self.conditions[rule_id] if key in facts]
+            if any(rule_id not in matched.get(key, ()) for key in known):
+                continue
+            (applies if len(known) == len(self.conditions[rule_id]) else possible).append(rule_id)
+        return applies, possible
+
+    def section(
+        self,
+        facts: Optional[Dict[str, Any]] = None,
+        max_rules: int = 10,
+        max_chars: int = RULES_MAX_CHARS
+    ) -> Tuple[str, List[str]]:
+        """
+        The rules section for a scenario and the rule ids in it, within
+        `max_chars`: the rules that apply. Without facts nothing is known to
+        apply, so it is every rule in priority order.
+        """
+        key = (json.dumps(facts, sort_keys=True), max_rules, max_chars)
+        cached = self._sections.get(key)
+        if cached is not None:
+            return cached
+        applies, possible = self.select(facts)
+        text, chosen = RULES_HEADER, []
+        for rule_id in (applies if facts is not None else applies + possible):
+            if len(chosen) >= max_rules:
+                break
+            if len(text) + len(self.formatted[rule_id]) > max_chars:
+                # A shorter rule further down may still fit
+                continue
+            text += self.formatted[rule_id]
+            chosen.append(rule_id)
+        result = (text if chosen else "", chosen)
+        self._sections[key] = result
+        return result
+
+ASSETS = {
+    "blueprint": PromptAsset("mobile_prompt_blueprint.md", lambda data: data.decode("utf-8"), ""),
+    "rulebook": PromptAsset("rulebook.json", lambda data: RuleIndex(json.loads(data)), RuleIndex({})),
+}
+
+# Assembled system prompts by (blueprint version, rulebook version, max_rules, scenario facts)
+_system_prompts: Dict[Tuple, Tuple[str, List[str]]] = {}
+_system_lock = threading.Lock()
+
+def asset_versions() -> Dict[str, str]:
+    """Current version id of every prompt asset."""
+    return {name: asset.load()[1] for name, asset in ASSETS.items()}
+
+def load_blueprint():
+    return ASSETS["blueprint"].load()[0]
+
+def load_critical_rules(max_rules=10, facts=None):
+    """The rulebook.json rules that apply to the scenario `facts` (see scenario_facts), formatted for the prompt."""
+    return ASSETS["rulebook"].load()[0].section(facts, max_rules)[0]
+
+def assemble_system(blueprint, critical_rules):
+    """Base instructions + as much blueprint as fits + critical rules, capped at MAX_SYSTEM_CHARS."""
+    system = BASE_SYSTEM
     
     # Calculate available space for blueprint
-    available_for_blueprint = max_system_chars - base_system_len - rules_len - 100  # 100 char buffer
+    rules_len = len(critical_rules) if critical_rules else 0
+    available_for_blueprint = MAX_SYSTEM_CHARS - len(system) - rules_len - 100  # 100 char buffer
     
     if blueprint and available_for_blueprint > 500:  # Only add if we have reasonable space
         system += "\n\n" + blueprint[:available_for_blueprint]
@@ -161,10 +274,404 @@ Return your analysis in this EXACT JSON format:
         system += critical_rules
     
     # Final safety check - truncate if still over limit
-    if len(system) > max_system_chars:
-        system = system[:max_system_chars-100] + "\n\n[Content truncated to fit limits]"
-    
+    if len(system) > MAX_SYSTEM_CHARS:
+        system = system[:MAX_SYSTEM_CHARS-100] + "\n\n[Content truncated to fit limits]"
+    return system
+
+def system_prompt(max_rules=10, facts=None) -> Tuple[str, Dict[str, str], List[str]]:
+    """
+    The assembled system prompt, the asset versions it was built from and
+    the ids of the rules it includes.
+
+    Built once per (blueprint version, rulebook version, max_rules,
+    scenario facts); later calls only stat the asset files.
+    """
+    blueprint, bp_version = ASSETS["blueprint"].load()
+    rules, rb_version = ASSETS["rulebook"].load()
+    key = (bp_version, rb_version, max_rules, json.dumps(facts, sort_keys=True))
+    with _system_lock:
+        cached = _system_prompts.get(key)
+        if cached is None:
+            section, rule_ids = rules.section(facts, max_rules)
+            cached = (assemble_system(blueprint, section), rule_ids)
+            _system_prompts[key] = cached
+    system, rule_ids = cached
+    return system, {"blueprint": bp_version, "rulebook": rb_version}, rule_ids
+
+def _open_frame(f):
+    """Use the decoded frame when extraction handed it over, else read the file."""
+    if f.get("image") is not None:
+        return Image.fromarray(cv2.cvtColor(f["image"], cv2.COLOR_BGR2RGB))
+    return Image.open(f["path"])
+
+def encode_image(f, max_width=None, quality=None):
+    """
+    Resize and JPEG-compress one keyframe, returning it as data-URL bytes.
+    Only the frame's "crop" region is encoded when it has one.
+    """
+    max_width = max_width or MAX_IMAGE_WIDTH
+    quality = quality or JPEG_QUALITY
+    # Read and compress the image to reduce size
+    with _open_frame(f) as img:
+        if f.get("crop"):
+            x, y, w, h = f["crop"]
+            img = img.crop((x, y, x + w, y + h))
+
+        # Resize if too large
+        if img.width > max_width:
+            ratio = max_width / img.width
+            new_height = int(img.height * ratio)
+            img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
+        
+        # Convert to RGB if needed and compress
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGB')
+        
+        # Save to bytes with compression
+        img_buffer = io.BytesIO()
+        img.save(img_buffer, format='JPEG', quality=quality, optimize=True)
+        return b"data:image/jpeg;base64," + base64.b64encode(img_buffer.getbuffer())
+
+def data_url_size(image_url):
+    """(width, height) of a data-URL JPEG, read from its header only."""
+    header = image_url[image_url.index(b",") + 1:][:8192]
+    with Image.open(io.BytesIO(base64.b64decode(header[:len(header) // 4 * 4]))) as img:
+        return img.size
+
+def frame_entry(f, image_url=None, detail=None):
+    """
+    Prompt entry for a keyframe, with its encoded image when there is one.
+    The image is kept as data-URL bytes and only referenced from here on.
+    """
+    entry = {
+        "index": f["index"], 
+        "ts_ms": f["ts_ms"], 
+        "rel_path": f["path"].split("static/")[-1]
+    }
+    if f.get("duplicate_of") is not None:
+        # Repeat of an earlier keyframe: reference it instead of resending the image
+        entry["duplicate_of"] = f["duplicate_of"]
+    elif image_url:
+        entry["image_base64"] = image_url.encode("ascii") if isinstance(image_url, str) else image_url
+        if detail:
+            entry["detail"] = detail
+        if f.get("crop"):
+            # Only the region that changed since the reference frame was sent
+            entry["crop"] = dict(zip(("x", "y", "w", "h"), f["crop"]))
+            entry["ref_frame"] = f["ref_frame"]
+    return entry
+
+def encode_frame(f, level=None):
+    """Compress one keyframe to JPEG at `level` (a plan entry, default full size) and return its prompt entry."""
+    if f.get("duplicate_of") is not None:
+        return frame_entry(f)
+    try:
+        if level is None:
+            return frame_entry(f, encode_image(f))
+        return frame_entry(f, encode_image(f, level["width"], level["quality"]), level["detail"])
+    except Exception as e:
+        logger.warning(f"Could not encode image {f['path']}: {e}")
+        # Fallback to metadata only
+        return frame_entry(f)
+
+def _load_frame(f):
+    """The keyframe as a BGR array, decoded frame or file."""
+    if f.get("image") is not None:
+        return f["image"]
+    image = cv2.imread(f["path"])
+    if image is None:
+        raise ValueError(f"Could not read {f['path']}")
+    return image
+
+def changed_region(ref, image, step=4, threshold=DELTA_PIXEL_THRESHOLD, margin=DELTA_MARGIN):
+    """
+    Bounding box (x, y, w, h) of what differs between two same-size BGR
+    frames, or None when they are identical or differ in size.
+
+    Compared on `step`x`step` block averages, which smooths out the
+    codec and JPEG noise around text edges.
+    """
+    if ref.shape != image.shape:
+        return None
+    height, width = image.shape[:2]
+    size = (max(1, width // step), max(1, height // step))
+    a = cv2.resize(ref, size, interpolation=cv2.INTER_AREA).astype(np.int16)
+    b = cv2.resize(image, size, interpolation=cv2.INTER_AREA).astype(np.int16)
+    ys, xs = np.nonzero(np.abs(a - b).max(axis=2) > threshold)
+    if not len(ys):
+        return None
+    x0 = max(0, int(xs.min()) * step - margin)
+    y0 = max(0, int(ys.min()) * step - margin)
+    x1 = min(width, (int(xs.max()) + 1) * step + margin)
+    y1 = min(height, (int(ys.max()) + 1) * step + margin)
+    return x0, y0, x1 - x0, y1 - y0
+
+class DeltaRegions:
+    """
+    Assigns delta-region crops to keyframes in order.
+
+    The first keyframe, and any keyframe whose changes cover more than
+    `max_area` of the screen, is sent in full and becomes the reference.
+    Every other keyframe gets "crop" (x, y, w, h) of its changed region
+    against the reference and "ref_frame", the reference's index. Only the
+    reference frame is kept in memory.
+    """
+    def __init__(self, max_area: float = DELTA_MAX_AREA):
+        self.max_area = max_area
+        self._ref = None
+        self._ref_index = None
+
+    def assign(self, f: Dict) -> Dict:
+        f.pop("crop", None)
+        f.pop("ref_frame", None)
+        if f.get("duplicate_of") is not None:
+            return f
+        image = _load_frame(f)
+        region = changed_region(self._ref, image) if self._ref is not None else None
+        height, width = image.shape[:2]
+        if region is not None and region[2] * region[3] <= self.max_area * width * height:
+            f["crop"] = list(region)
+            f["ref_frame"] = self._ref_index
+        else:
+            self._ref, self._ref_index = image, f["index"]
+        return f
+
+def assign_delta_regions(frames, max_area: float = DELTA_MAX_AREA):
+    """DeltaRegions.assign() over a list of keyframes in order."""
+    regions = DeltaRegions(max_area)
+    for f in frames:
+        regions.assign(f)
+    return frames
+
+def vision_tokens(width, height, detail="high"):
+    """
+    GPT-4o image token cost: 85 for detail=low; for high, the image is fit
+    in 2048x2048, its short side scaled down to 768, then 170 per 512px tile
+    plus 85.
+    """
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+def frame_size(f):
+    """(width, height) of a keyframe, from its metadata, the decoded frame or the file header."""
+    if f.get("size"):
+        return tuple(f["size"])
+    if f.get("image") is not None:
+        height, width = f["image"].shape[:2]
+        return width, height
+    with Image.open(f["path"]) as img:
+        return img.size
+
+def _level_cost(level, width, height):
+    """Encoded size, estimated tokens and bytes of a width x height frame at `level`."""
+    if width > level["width"]:
+        width, height = level["width"], int(height * level["width"] / width)
+    return {
+        "width": width,
+        "height": height,
+        "quality": level["quality"],
+        "detail": level["detail"],
+        "tokens": vision_tokens(width, height, level["detail"]),
+        "bytes": int(width * height * level["bpp"]),
+    }
+
+def plan_images(frames, token_budget=None, byte_budget=None, reserve_tokens=TEXT_TOKEN_RESERVE):
+    """
+    Choose resolution, JPEG quality and detail for every keyframe so the
+    request fits `token_budget` (including `reserve_tokens` for text) and
+    `byte_budget` (base64 image bytes).
+
+    Every frame starts at the cheapest of IMAGE_LEVELS. Upgrades are then
+    handed out one level at a time to the frame with the highest
+    score / (level + 1), as long as they fit, so frames with bigger scene
+    changes climb first without starving the rest. The first keyframe
+    counts as the biggest change. With no budget every frame gets the top
+    level. Duplicates cost nothing: they are sent as references, and
+    delta-region frames are costed at their crop size.
+
+    Returns the plan with per-frame settings and the estimated totals.
+    """
+    frames = list(frames)
+    distinct = [i for i, f in enumerate(frames) if f.get("duplicate_of") is None]
+    costs = {}
+    for i in distinct:
+        width, height = frames[i]["crop"][2:] if frames[i].get("crop") else frame_size(frames[i])
+        costs[i] = [_level_cost(level, width, height) for level in IMAGE_LEVELS]
+
+    scores = [frames[i].get("score") for i in distinct]
+    top = max([s for s in scores if s is not None] or [1.0]) or 1.0
+    weights = {
+        i: 1.0 if s is None else max(0.1, s / top)
+        for i, s in zip(distinct, scores)
+    }
+
+    levels = {i: 0 for i in distinct}
+    tokens_left = math.inf if token_budget is None else token_budget - reserve_tokens - sum(costs[i][0]["tokens"] for i in distinct)
+    bytes_left = math.inf if byte_budget is None else byte_budget - sum(costs[i][0]["bytes"] for i in distinct)
+    heap = [(-weights[i], i) for i in distinct]
+    heapq.heapify(heap)
+    while heap:
+        _, i = heapq.heappop(heap)
+        level = levels[i]
+        if level + 1 >= len(IMAGE_LEVELS):
+            continue
+        extra_tokens = costs[i][level + 1]["tokens"] - costs[i][level]["tokens"]
+        extra_bytes = costs[i][level + 1]["bytes"] - costs[i][level]["bytes"]
+        if extra_tokens > tokens_left or extra_bytes > bytes_left:
+            continue
+        tokens_left -= extra_tokens
+        bytes_left -= extra_bytes
+        levels[i] = level + 1
+        heapq.heappush(heap, (-weights[i] / (level + 2), i))
+
+    entries = []
+    for i, f in enumerate(frames):
+        if f.get("duplicate_of") is not None:
+            entries.append({"index": f["index"], "duplicate_of": f["duplicate_of"], "tokens": 0, "bytes": 0})
+        else:
+            entries.append({"index": f["index"], "level": levels[i], **costs[i][levels[i]]})
+    image_tokens = sum(e["tokens"] for e in entries)
     return {
-        "system": system,
-        "user": json.dumps(user_payload, ensure_ascii=False)
+        "token_budget": token_budget,
+        "byte_budget": byte_budget,
+        "reserve_tokens": reserve_tokens,
+        "estimated_tokens": image_tokens + reserve_tokens,
+        "estimated_image_tokens": image_tokens,
+        "estimated_image_bytes": sum(e["bytes"] for e in entries),
+        "over_budget": (token_budget is not None and tokens_left < 0) or (byte_budget is not None and bytes_left < 0),
+        "frames": entries,
+    }
+
+def encode_frames(frames, executor: Optional[Executor] = None, plan=None) -> List[Dict]:
+    """encode_frame() for every frame on a thread pool, results in frame order."""
+    frames = list(frames)
+    levels = plan["frames"] if plan is not None else [None] * len(frames)
+    if executor is not None:
+        return list(executor.map(encode_frame, frames, levels))
+    if ENCODE_WORKERS <= 1 or len(frames) <= 1:
+        return [encode_frame(f, level) for f, level in zip(frames, levels)]
+    with ThreadPoolExecutor(max_workers=min(ENCODE_WORKERS, len(frames)), thread_name_prefix="encode") as pool:
+        return list(pool.map(encode_frame, frames, levels))
+
+RETURN_FORMAT = {
+    "bugs":[{"id":"","title":"","description":"","severity":"","category":"","evidence_frames":[],"suggestions":""}],
+    "steps":[{"step_no":0,"summary":"","frames":[]}],
+    "assumptions":"",
+    "metadata":{"version":"v0"}
+}
+
+class Prompt:
+    """
+    A built prompt: system text, scenario and frame entries.
+
+    Frame images stay the data-URL bytes the encoder produced; the request
+    body and the legacy dict view both reference those buffers rather than
+    copying them into a JSON string. Indexing
+    with "system", "user" or "assets" gives the old build_prompt() dict
+    values, the "user" JSON being serialized only when asked for.
+    """
+    def __init__(
+        self,
+        system: str,
+        scenario: Optional[Dict],
+        frames: List[Dict],
+        assets: Optional[Dict] = None,
+        instructions: Optional[Dict] = None,
+        text: Optional[str] = None,
+        rules: Optional[List[str]] = None
+    ):
+        self.system = system
+        self.scenario = scenario
+        self.frames = frames
+        self.assets = assets or {}
+        self.instructions = instructions if instructions is not None else {"return_format": RETURN_FORMAT}
+        # Free-form user message, for prompts that are not a scenario analysis
+        self.text = text
+        # Ids of the rulebook rules included in the system prompt
+        self.rules = rules or []
+
+    @classmethod
+    def from_dict(cls, prompt_dict: Dict) -> "Prompt":
+        """Wrap a {"system", "user"} dict, "user" being a build_prompt() JSON payload or plain text."""
+        try:
+            user = json.loads(prompt_dict["user"])
+        except (TypeError, ValueError):
+            user = None
+        if not isinstance(user, dict) or "scenario" not in user:
+            return cls(prompt_dict["system"], None, [], prompt_dict.get("assets"), text=str(prompt_dict["user"]))
+        frames = [
+            dict(f, image_base64=f["image_base64"].encode("ascii")) if "image_base64" in f else f
+            for f in user.get("frames", [])
+        ]
+        return cls(prompt_dict["system"], user["scenario"], frames, prompt_dict.get("assets"), user.get("instructions"))
+
+    @property
+    def user(self) -> str:
+        if self.scenario is None:
+            return self.text
+        frames = [
+            dict(f, image_base64=f["image_base64"].decode("ascii")) if "image_base64" in f else f
+            for f in self.frames
+        ]
+        payload = {"scenario": self.scenario, "frames": frames, "instructions": self.instructions}
+        return json.dumps(payload, ensure_ascii=False)
+
+    def __getitem__(self, key: str):
+        if key not in ("system", "user", "assets"):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in ("system", "user", "assets")
+
+    def images(self) -> List[bytes]:
+        return [f["image_base64"] for f in self.frames if "image_base64" in f]
+
+    def estimated_tokens(self) -> int:
+        """Rough input tokens: about 4 characters per text token plus each image's vision_tokens()."""
+        chars = len(self.system) + len(json.dumps([self.scenario, self.instructions, self.text], ensure_ascii=False))
+        tokens = chars // 4 + 100 * len(self.frames)
+        for f in self.frames:
+            if "image_base64" not in f:
+                continue
+            try:
+                width, height = data_url_size(f["image_base64"])
+            except (ValueError, OSError):
+                width, height = MAX_IMAGE_WIDTH, MAX_IMAGE_WIDTH * 2
+            tokens += vision_tokens(width, height, f.get("detail", "high"))
+        return tokens
+
+def build_prompt(cfg, frames, encoded_frames=None):
+    """
+    Assemble the Prompt for a run.
+
+    `encoded_frames` are the encode_frame() results for `frames` when the
+    caller has already encoded them (e.g. while decoding was still going);
+    otherwise they are encoded here as planned by plan_images() for the
+    budgets in `cfg`, cropped to their changed regions when
+    `cfg.delta_regions` is set. The system prompt carries only the rules
+    that apply to the scenario; the prompt's assets and rules record the
+    asset versions and rule ids it was built from.
+    """
+    system, versions, rule_ids = system_prompt(max_rules=10, facts=scenario_facts(cfg))
+    
+    if encoded_frames is None:
+        if cfg.delta_regions:
+            assign_delta_regions(frames)
+        plan = plan_images(frames, cfg.token_budget, cfg.byte_budget)
+        encoded_frames = encode_frames(frames, plan=plan)
+    
+    scenario = {
+        "id": cfg.scenario_id,
+        "source_apps": cfg.source_apps,
+        "file_size_bucket": cfg.file_size_bucket,
+        "protection_level": cfg.protection_level,
+        "file_type": cfg.file_type,
+        "notes": cfg.notes or ""
     }
+    return Prompt(system, scenario, list(encoded_frames), versions, rules=rule_ids)
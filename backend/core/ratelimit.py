@@ -0,0 +1,198 @@
+
+import asyncio, heapq, itertools, logging, os, random, re, time
+from typing import Dict, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Deployment quota; 0 leaves that limit off
+REQUESTS_PER_MINUTE = int(os.getenv("LLM_RPM", "0"))
+TOKENS_PER_MINUTE = int(os.getenv("LLM_TPM", "0"))
+# Azure enforces per-minute quotas over short (1-10s) windows, so at most
+# this many seconds' worth of quota may go out in one burst
+BURST_SECONDS = float(os.getenv("LLM_RATE_BURST_SECONDS", "1"))
+# Backoff for failed calls without a Retry-After: full jitter over
+# BASE * 2**attempt seconds, capped at MAX
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+
+# Waiting calls are served lane by lane, lowest first, then in arrival order
+LANES = {"interactive": 0, "batch": 1}
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds in a Retry-After or x-ratelimit-reset-* value: "7", "1.5", "20ms", "6m0s"."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _UNIT_SECONDS[unit] for n, unit in parts)
+
+def retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Server-requested wait from retry-after-ms or Retry-After, in seconds."""
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return max(0.0, float(ms) / 1000)
+        except ValueError:
+            pass
+    return parse_duration(headers.get("retry-after"))
+
+def backoff(attempt: int) -> float:
+    """Jittered delay before retry `attempt` (0-based), so failed calls don't retry in lockstep."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+class TokenBucket:
+    """
+    `rate` units per minute, refilled continuously, holding at most
+    `burst_seconds` worth. A take larger than the bucket is charged in
+    full: the level goes negative and later takes wait out the debt.
+    """
+    def __init__(self, rate: int, burst_seconds: float = BURST_SECONDS):
+        self.rate = rate
+        self.capacity = max(1.0, rate * min(burst_seconds, 60) / 60)
+        self.level = self.capacity
+        self._stamp = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._stamp) * self.rate / 60)
+        self._stamp = now
+
+    def wait_for(self, amount: float) -> float:
+        """Seconds until `amount` is available, or the bucket is full if `amount` is more than it holds."""
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60 / self.rate)
+
+    def take(self, amount: float):
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+    def cap(self, remaining: float):
+        """Follow the server's count when it has less left than we think."""
+        self._refill()
+        self.level = min(self.level, remaining)
+
+class RateLimiter:
+    """
+    Process-wide admission control for LLM calls.
+
+    Every attempt acquire()s one request and its estimated tokens from the
+    per-minute buckets before it is sent; only the first waiter (by lane,
+    then arrival) may take from them, so interactive calls overtake queued
+    batch work and nobody starves within a lane. Response headers feed
+    back in: x-ratelimit-remaining-* lower the buckets to what the service
+    reports and a Retry-After pauses every caller, not just the one that
+    got the 429, so a burst backs off once instead of retrying together.
+    """
+    def __init__(self, rpm: int = REQUESTS_PER_MINUTE, tpm: int = TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self._paused_until = 0.0
+        self._waiters: List[Tuple[int, int, asyncio.Event]] = []
+        self._seq = itertools.count()
+        self._stats = {"admitted": 0, "waited_s": 0.0, "throttled": 0, "pauses": 0}
+        self._lanes = {lane: 0 for lane in LANES}
+
+    def _delay(self, tokens: float) -> float:
+        delay = max(0.0, self._paused_until - time.monotonic())
+        if self.requests:
+            delay = max(delay, self.requests.wait_for(1))
+        if self.tokens:
+            delay = max(delay, self.tokens.wait_for(tokens))
+        return delay
+
+    def _wake_head(self):
+        if self._waiters:
+            self._waiters[0][2].set()
+
+    async def acquire(self, tokens: float, lane: str = "interactive"):
+        """Wait until one request of about `tokens` tokens fits the quota, in `lane` priority."""
+        if lane not in LANES:
+            raise ValueError(f"Unknown priority lane: {lane}")
+        waiter = (LANES[lane], next(self._seq), asyncio.Event())
+        heapq.heappush(self._waiters, waiter)
+        self._lanes[lane] += 1
+        started = time.monotonic()
+        try:
+            while True:
+                if self._waiters[0] is waiter:
+                    delay = self._delay(tokens)
+                    if delay <= 0:
+                        break
+                    waiter[2].clear()
+                    try:
+                        # A pause or a higher-priority arrival may change the wait
+                        await asyncio.wait_for(waiter[2].wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    waiter[2].clear()
+                    await waiter[2].wait()
+        finally:
+            self._lanes[lane] -= 1
+            head = self._waiters[0] is waiter
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+            if head:
+                self._wake_head()
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(tokens)
+        waited = time.monotonic() - started
+        self._stats["admitted"] += 1
+        self._stats["waited_s"] += waited
+        if waited > 0.05:
+            self._stats["throttled"] += 1
+        self._wake_head()
+
+    def settle(self, estimated: float, used: float):
+        """Charge the tokens a call actually used instead of its estimate."""
+        if self.tokens and used:
+            self.tokens.take(used - estimated)
+
+    def observe(self, headers: Mapping[str, str]):
+        """Sync the buckets with the service's x-ratelimit-* headers."""
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            try:
+                remaining = float(headers[f"x-ratelimit-remaining-{kind}"])
+            except (KeyError, ValueError):
+                continue
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            if remaining <= 0 and reset:
+                # Exhausted on the server's side whatever our estimate says
+                self.pause(reset)
+            elif bucket is not None:
+                bucket.cap(remaining)
+
+    def pause(self, seconds: float):
+        """Hold every caller for `seconds`, e.g. for a 429's Retry-After."""
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            self._stats["pauses"] += 1
+            logger.warning(f"LLM rate limited, pausing all calls for {seconds:.1f}s")
+        self._wake_head()
+
+    def stats(self) -> Dict:
+        return {
+            **self._stats,
+            "waited_s": round(self._stats["waited_s"], 2),
+            "waiting": dict(self._lanes),
+            "paused_s": round(max(0.0, self._paused_until - time.monotonic()), 2),
+            "rpm": self.requests.rate if self.requests else None,
+            "tpm": self.tokens.rate if self.tokens else None,
+            "requests_left": int(self.requests.level) if self.requests else None,
+            "tokens_left": int(self.tokens.level) if self.tokens else None,
+        }
+
+limiter = RateLimiter()
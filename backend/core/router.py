@@ -0,0 +1,256 @@
+
+import asyncio, collections, logging, math, os, time
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Extra deployments to spread LLM calls over, comma separated: a deployment
+# name on AZURE_OPENAI_ENDPOINT, or on another resource
+# name@https://other-resource.openai.azure.com#KEY_VAR, KEY_VAR naming the
+# environment variable that holds that resource's api-key
+DEPLOYMENTS = os.getenv("AZURE_OPENAI_DEPLOYMENTS", "")
+# Send a duplicate to a second deployment once a request has taken longer
+# than this percentile of its deployment's recent latencies (0 turns
+# hedging off), given at least HEDGE_MIN_SAMPLES of them
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "10"))
+# Latencies kept per deployment for picking and hedging
+LATENCY_WINDOW = 100
+# A deployment that failed this many times in a row sits out COOLDOWN seconds
+MAX_CONSECUTIVE_ERRORS = 3
+COOLDOWN = float(os.getenv("LLM_DEPLOYMENT_COOLDOWN", "30"))
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+class Deployment:
+    """One chat-completions endpoint, the auth headers it needs if not the primary's, and its recent health."""
+    def __init__(self, name: str, url: str, headers: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.url = url
+        self.headers = headers or {}
+        self.outstanding = 0
+        # Kept apart: a streamed call is raced up to its headers, a plain one to its full body
+        self.latencies: Dict[bool, Deque[float]] = {
+            False: collections.deque(maxlen=LATENCY_WINDOW),
+            True: collections.deque(maxlen=LATENCY_WINDOW),
+        }
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.down_until = 0.0
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def p95(self, stream: bool) -> float:
+        return percentile(list(self.latencies[stream]), 95) or 0.0
+
+    def stats(self) -> Dict:
+        return {
+            "name": self.name,
+            "healthy": self.healthy(),
+            "down_s": round(max(0.0, self.down_until - time.monotonic()), 1),
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "p50_s": {
+                "response": percentile(list(self.latencies[False]), 50),
+                "first_byte": percentile(list(self.latencies[True]), 50),
+            },
+            "p95_s": {
+                "response": percentile(list(self.latencies[False]), 95),
+                "first_byte": percentile(list(self.latencies[True]), 95),
+            },
+        }
+
+class Router:
+    """
+    Spreads LLM requests over a pool of deployments of the same model.
+
+    pick() prefers healthy deployments with the fewest requests in flight,
+    then the lowest recent p95 latency. send() runs a request on the pick
+    and, when it has taken longer than HEDGE_PERCENTILE of that
+    deployment's recent latencies, sends the same request to the next
+    pick once `admit` (the rate limiter) lets it; the first successful
+    response wins and the other is cancelled.
+    Streamed requests are raced only up to their response headers, so
+    just one stream is ever read.
+    """
+    def __init__(self, deployments: List[Deployment]):
+        self.deployments = deployments
+
+    def pick(self, exclude: Tuple[Deployment, ...] = ()) -> Optional[Deployment]:
+        candidates = [d for d in self.deployments if d not in exclude]
+        healthy = [d for d in candidates if d.healthy()]
+        if not candidates:
+            return None
+        pool = healthy or [min(candidates, key=lambda d: d.down_until)]
+        return min(pool, key=lambda d: (d.outstanding, d.consecutive_errors, d.p95(False) + d.p95(True)))
+
+    def available(self, exclude: Deployment) -> bool:
+        """Whether another deployment could take a request `exclude` was throttled on."""
+        return any(d.healthy() for d in self.deployments if d is not exclude)
+
+    def throttle(self, deployment: Deployment, seconds: float):
+        deployment.down_until = max(deployment.down_until, time.monotonic() + seconds)
+        logger.warning(f"Deployment {deployment.name} throttled for {seconds:.1f}s")
+
+    def _record(self, deployment: Deployment, elapsed: float, ok: bool, stream: bool):
+        deployment.requests += 1
+        if ok:
+            deployment.consecutive_errors = 0
+            deployment.latencies[stream].append(elapsed)
+            return
+        deployment.errors += 1
+        deployment.consecutive_errors += 1
+        if deployment.consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+            self.throttle(deployment, COOLDOWN)
+
+    def _hedge_delay(self, deployment: Deployment, stream: bool) -> Optional[float]:
+        if HEDGE_PERCENTILE <= 0 or len(self.deployments) < 2:
+            return None
+        samples = list(deployment.latencies[stream])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return percentile(samples, HEDGE_PERCENTILE)
+
+    async def send(
+        self,
+        request: Callable[[Deployment], Awaitable[httpx.Response]],
+        stream: bool = False,
+        admit: Optional[Callable[[], Awaitable[None]]] = None
+    ) -> Tuple[httpx.Response, Deployment]:
+        """
+        The first successful response to `request` from the pool, and the
+        deployment that gave it. A hedge is sent only after `admit`
+        returns, if given, while the first request keeps running. Errors and
+        non-2xx responses are recorded against their deployment; when
+        every racer fails, the last error is raised or the last response is
+        returned for the caller to handle.
+        """
+        tasks: Dict[asyncio.Task, Tuple[Deployment, float]] = {}
+        admission: Optional[asyncio.Task] = None
+        second: Optional[Deployment] = None
+
+        def launch(deployment: Deployment):
+            deployment.outstanding += 1
+            task = asyncio.create_task(request(deployment))
+            tasks[task] = (deployment, time.monotonic())
+
+        def settle(task: asyncio.Task) -> Tuple[Deployment, Optional[httpx.Response], Optional[BaseException]]:
+            deployment, started = tasks.pop(task)
+            deployment.outstanding -= 1
+            error = task.exception()
+            response = None if error else task.result()
+            ok = error is None and response.status_code < 400
+            self._record(deployment, time.monotonic() - started, ok, stream)
+            return deployment, response, error
+
+        primary = self.pick()
+        launch(primary)
+        hedge_after = self._hedge_delay(primary, stream)
+        failed: Optional[Tuple[Deployment, Optional[httpx.Response], Optional[BaseException]]] = None
+        try:
+            while tasks:
+                timeout = None
+                if hedge_after is not None and len(tasks) == 1 and failed is None:
+                    timeout = max(0.0, hedge_after - (time.monotonic() - tasks[next(iter(tasks))][1]))
+                waiting = list(tasks) + ([admission] if admission is not None else [])
+                done, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Slower than usual: race a duplicate on another deployment
+                    hedge_after = None
+                    second = self.pick(exclude=tuple(d for d, _ in tasks.values()))
+                    if second is not None and second.healthy():
+                        # The duplicate costs quota like any other request
+                        admission = asyncio.create_task(admit() if admit is not None else asyncio.sleep(0))
+                    continue
+                admitted = admission if admission in done else None
+                if admitted is not None:
+                    done.discard(admitted)
+                    admission = None
+                for task in done:
+                    deployment, response, error = settle(task)
+                    if error is None and response.status_code < 400:
+                        if deployment is not primary:
+                            deployment.hedge_wins += 1
+                        if failed is not None and failed[1] is not None:
+                            await failed[1].aclose()
+                        return response, deployment
+                    if failed is not None and failed[1] is not None:
+                        await failed[1].aclose()
+                    failed = (deployment, response, error)
+                if admitted is not None and admitted.exception() is None and failed is None:
+                    primary.hedged += 1
+                    logger.info(f"Hedging slow request on {primary.name} with {second.name}")
+                    launch(second)
+            deployment, response, error = failed
+            if error is not None:
+                raise error
+            return response, deployment
+        finally:
+            if admission is not None:
+                admission.cancel()
+            for task in tasks:
+                task.cancel()
+            for task, (deployment, _) in list(tasks.items()):
+                deployment.outstanding -= 1
+                try:
+                    response = await task
+                except BaseException:
+                    continue
+                # Finished just as it lost: drop the connection's stream
+                await response.aclose()
+
+    def stats(self) -> List[Dict]:
+        return [d.stats() for d in self.deployments]
+
+def _azure_url(endpoint: str, deployment: str) -> str:
+    api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview")
+    return f"{endpoint.rstrip('/')}/openai/deployments/{deployment}/chat/completions?api-version={api_version}"
+
+_router: Optional[Router] = None
+_router_env: Optional[Tuple] = None
+
+def get_router(url: str) -> Router:
+    """
+    The pool for the configured endpoint: `url` (the primary from
+    _chat_endpoint()) plus AZURE_OPENAI_DEPLOYMENTS. Rebuilt when the
+    configuration changes.
+    """
+    global _router, _router_env
+    env = (url, os.getenv("AZURE_OPENAI_DEPLOYMENTS", DEPLOYMENTS), os.getenv("AZURE_OPENAI_ENDPOINT"))
+    if _router is not None and env == _router_env:
+        return _router
+    deployments = [Deployment(os.getenv("AZURE_OPENAI_DEPLOYMENT") or "default", url)]
+    endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+    for entry in filter(None, (e.strip() for e in env[1].split(","))):
+        entry, _, key_var = entry.partition("#")
+        name, _, other_endpoint = entry.partition("@")
+        headers = None
+        if not (other_endpoint or endpoint):
+            logger.warning(f"Ignoring deployment {entry}: no Azure endpoint")
+            continue
+        if other_endpoint:
+            # Another resource has its own key; the primary's would only get 401s
+            if not key_var or not os.getenv(key_var):
+                logger.warning(f"Ignoring deployment {entry}: give its resource's api-key as {entry}#KEY_VAR")
+                continue
+            headers = {"api-key": os.getenv(key_var)}
+        entry_url = _azure_url(other_endpoint or endpoint, name)
+        if entry_url not in (d.url for d in deployments):
+            deployments.append(Deployment(name if not other_endpoint else entry, entry_url, headers))
+    _router, _router_env = Router(deployments), env
+    return _router
+
+def stats() -> List[Dict]:
+    return _router.stats() if _router is not None else []
@@ -0,0 +1,145 @@
+
+import cv2
+import numpy as np
+from typing import Dict, List, Optional, Tuple, Union
+
+# Thumbnail width every detector works on. Phone recordings are ~1170px wide;
+# a dialog or a spinner appearing is obvious far below that.
+THUMB_WIDTH = 96
+
+def _thumbnail(frame, width: int = THUMB_WIDTH, height: Optional[int] = None):
+    h, w = frame.shape[:2]
+    if height is None:
+        height = max(1, round(h * width / w))
+    # Drop pixels before area-averaging: INTER_AREA over a full-res frame
+    # costs more than the colour conversion the thumbnail saves
+    step = max(1, min(w // (width * 4), h // (height * 4)))
+    if step > 1:
+        frame = frame[::step, ::step]
+    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+def _hamming(ref: np.ndarray, feats: np.ndarray) -> np.ndarray:
+    """Hamming distance between packed bit vectors, as % of bits that differ."""
+    bits = np.unpackbits(np.bitwise_xor(feats, ref), axis=-1)
+    return bits.sum(axis=-1) * 100.0 / bits.shape[-1]
+
+class SceneDetector:
+    """
+    Turns frames into small feature vectors and scores how different they are.
+
+    Scores are on a 0-100 scale; a frame is a new scene when its score
+    against the last keyframe exceeds the threshold. `distances` compares
+    one reference against a whole batch of features at once.
+    """
+    name = ""
+    default_threshold = 25.0
+
+    def features(self, frame) -> np.ndarray:
+        raise NotImplementedError
+
+    def distances(self, ref: np.ndarray, feats: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def distance(self, ref: np.ndarray, feat: np.ndarray) -> float:
+        return float(self.distances(ref, feat[None])[0])
+
+class HistogramDetector(SceneDetector):
+    """50x60 hue/saturation histogram compared with the Bhattacharyya distance."""
+    name = "hist"
+    default_threshold = 25.0
+
+    def features(self, frame) -> np.ndarray:
+        hsv = cv2.cvtColor(_thumbnail(frame), cv2.COLOR_BGR2HSV)
+        hist = cv2.calcHist([hsv],[0,1],None,[50,60],[0,180,0,256])
+        cv2.normalize(hist, hist)
+        return hist.ravel()
+
+    def distances(self, ref, feats):
+        # Same formula as cv2.compareHist(HISTCMP_BHATTACHARYYA)
+        num = np.sqrt(feats * ref).sum(axis=-1)
+        denom = np.sqrt(feats.sum(axis=-1) * ref.sum())
+        with np.errstate(divide="ignore", invalid="ignore"):
+            coeff = np.where(denom > 0, num / denom, 0.0)
+        return np.sqrt(np.clip(1.0 - coeff, 0.0, 1.0)) * 100
+
+class DHashDetector(SceneDetector):
+    """64-bit difference hash: sign of horizontal gradients on a 9x8 thumbnail."""
+    name = "dhash"
+    default_threshold = 15.0
+
+    def features(self, frame) -> np.ndarray:
+        gray = cv2.cvtColor(_thumbnail(frame, 9, 8), cv2.COLOR_BGR2GRAY)
+        return np.packbits(gray[:, 1:] > gray[:, :-1])
+
+    def distances(self, ref, feats):
+        return _hamming(ref, feats)
+
+class PHashDetector(SceneDetector):
+    """64-bit perceptual hash: low DCT frequencies of a 32x32 thumbnail vs their median."""
+    name = "phash"
+    default_threshold = 20.0
+
+    def features(self, frame) -> np.ndarray:
+        gray = cv2.cvtColor(_thumbnail(frame, 32, 32), cv2.COLOR_BGR2GRAY)
+        low = cv2.dct(np.float32(gray))[:8, :8].ravel()[1:]
+        return np.packbits(np.append(low > np.median(low), False))
+
+    def distances(self, ref, feats):
+        return _hamming(ref, feats)
+
+class MeanAbsDiffDetector(SceneDetector):
+    """Mean absolute grayscale difference on a fixed-size thumbnail, as % of full range."""
+    name = "mad"
+    default_threshold = 4.0
+
+    def features(self, frame) -> np.ndarray:
+        gray = cv2.cvtColor(_thumbnail(frame, 48, 96), cv2.COLOR_BGR2GRAY)
+        return gray.astype(np.float32).ravel()
+
+    def distances(self, ref, feats):
+        return np.abs(feats - ref).mean(axis=-1) * 100.0 / 255.0
+
+DETECTORS: Dict[str, type] = {
+    cls.name: cls for cls in (HistogramDetector, DHashDetector, PHashDetector, MeanAbsDiffDetector)
+}
+
+def get_detector(detector: Union[str, SceneDetector, None] = None) -> SceneDetector:
+    """Resolve a detector name (or pass an instance through)."""
+    if isinstance(detector, SceneDetector):
+        return detector
+    name = detector or "hist"
+    if name not in DETECTORS:
+        raise ValueError(f"Unknown scene detector: {name} (choose from {', '.join(DETECTORS)})")
+    return DETECTORS[name]()
+
+def select_scene_changes(
+    detector: SceneDetector,
+    feats: np.ndarray,
+    threshold: float,
+    ref: Optional[np.ndarray] = None
+) -> Tuple[List[int], List[Optional[float]], Optional[np.ndarray]]:
+    """
+    Run the keyframe chain over a batch of features.
+
+    Each keyframe becomes the reference for the next, so instead of one
+    comparison per frame we score everything after the current reference
+    in one call and jump to the first score over the threshold.
+    Returns the selected positions, their scores (None when there was no
+    reference yet) and the final reference.
+    """
+    selected, scores = [], []
+    i = 0
+    while i < len(feats):
+        score = None
+        if ref is not None:
+            dist = detector.distances(ref, feats[i:])
+            hits = np.flatnonzero(dist > threshold)
+            if not hits.size:
+                break
+            score = float(dist[hits[0]])
+            i += int(hits[0])
+        selected.append(i)
+        scores.append(score)
+        ref = feats[i]
+        i += 1
+    return selected, scores, ref
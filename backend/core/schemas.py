@@ -12,6 +12,28 @@ class Config(BaseModel):
     protection_level: Protection
     file_type: Literal["xlsx","xls","csv","other"] = "xlsx"
     notes: Optional[str] = None
+    # Keyframe extraction: scene detector (see core.scene.DETECTORS) and its threshold
+    detector: Literal["hist","dhash","phash","mad"] = "hist"
+    min_scene_delta: Optional[float] = None
+    # Send a repeated screen as a reference to its first occurrence
+    dedupe: bool = False
+    # Keep at most this many distinct keyframes, ranked by change score
+    max_frames: Optional[int] = None
+    # Request budgets for the prompt images (see core.prompt.plan_images)
+    token_budget: Optional[int] = None
+    byte_budget: Optional[int] = None
+    # Send later frames of a scene as crops of the region that changed
+    delta_regions: bool = False
+    # Analyze frames in overlapping windows of this many frames, merged
+    # afterwards, instead of one request; optionally consolidated by a final
+    # text-only call
+    window_size: Optional[int] = None
+    window_overlap: int = 2
+    consolidate: bool = False
+    # LLM response cache: "use" it, "refresh" the cached response, or "bypass" it
+    llm_cache: Literal["use","refresh","bypass"] = "use"
+    # Stream the LLM response, reporting bugs and steps as they arrive
+    stream: bool = False
 
 class FrameMeta(BaseModel):
     index: int
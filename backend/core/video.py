@@ -1,50 +1,428 @@
 
+import asyncio, multiprocessing, threading
 import cv2, os
-from typing import List, Dict
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
+from core.executors import decode_pool
+from core.scene import PHashDetector, SceneDetector, get_detector, select_scene_changes
 
-def extract_keyframes(
+# "read" decodes every frame (the original loop), "grab" only demuxes the
+# frames that fall between samples, "seek" jumps straight to each sample by
+# timestamp when the container supports it.
+SAMPLING_MODES = ("read", "grab", "seek")
+
+# Shards shorter than this are not worth a worker process
+MIN_SHARD_SECONDS = 60.0
+# Decoded keyframes aiter_keyframes() holds for a slow consumer before
+# decoding waits; each is a full-resolution frame
+KEYFRAME_QUEUE_SIZE = int(os.getenv("KEYFRAME_QUEUE_SIZE", "8"))
+
+# pHash distance (% of bits) under which a keyframe may be a repeat of
+# one already kept, e.g. the same spinner or dialog coming back. Only a
+# prefilter: a 64-bit hash of the whole screen can't see a line of text
+# change, so a repeat must also be under the scene detector's threshold
+# and differ by more than DUPLICATE_PIXEL_DELTA grey levels in at most
+# DUPLICATE_MAX_PIXELS pixels of a DUPLICATE_WIDTH-wide thumbnail
+DUPLICATE_DISTANCE = 10.0
+DUPLICATE_WIDTH = 240
+DUPLICATE_PIXEL_DELTA = 32
+DUPLICATE_MAX_PIXELS = 8
+
+# Keyframes on disk are only for the report; the prompt is built from the
+# decoded frame, so a lossy format is fine and far cheaper than PNG.
+IMAGE_FORMATS = {
+    "jpg": [cv2.IMWRITE_JPEG_QUALITY, 90],
+    "webp": [cv2.IMWRITE_WEBP_QUALITY, 90],
+    "png": [],
+}
+
+def write_frame(path: str, frame, image_format: str = "jpg") -> str:
+    if not cv2.imwrite(path, frame, IMAGE_FORMATS[image_format]):
+        raise IOError(f"Could not write frame {path}")
+    return path
+
+class FrameWriter:
+    """
+    Persists keyframe images on background threads so disk writes stay off
+    the decode -> encode -> LLM critical path. Call wait() before anything
+    reads the files (e.g. the report).
+    """
+    def __init__(self, max_workers: int = 2):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="frame-writer")
+        self._futures = []
+
+    def submit(self, path: str, frame, image_format: str = "jpg"):
+        self._futures.append(self._pool.submit(write_frame, path, frame, image_format))
+
+    def wait(self):
+        try:
+            for fut in self._futures:
+                fut.result()
+        finally:
+            self._pool.shutdown(wait=True)
+
+def _sample_frames(
+    cap,
+    stride: int,
+    ms_per_frame: float,
+    sampling: str = "grab",
+    start: int = 0,
+    end: Optional[int] = None
+):
+    """Yield (frame_idx, frame) for every `stride`-th frame of `cap` in [start, end)."""
+    if sampling not in SAMPLING_MODES:
+        raise ValueError(f"Unknown sampling mode: {sampling}")
+
+    frame_idx = start
+    if start and not cap.set(cv2.CAP_PROP_POS_FRAMES, start):
+        # No random access, decode our way up to the shard start
+        for _ in range(start):
+            if not cap.grab(): return
+
+    if sampling == "seek" and stride > 1:
+        while end is None or frame_idx < end:
+            if frame_idx != start and not cap.set(cv2.CAP_PROP_POS_MSEC, frame_idx * ms_per_frame):
+                # Container is not seekable, finish with grab() from here
+                break
+            ret, frame = cap.read()
+            if not ret: return
+            yield frame_idx, frame
+            frame_idx += stride
+        else:
+            return
+        # cap.set failed before moving, so the decoder is right after the
+        # last sample we yielded
+        frame_idx = frame_idx - stride + 1
+        sampling = "grab"
+
+    while end is None or frame_idx < end:
+        if frame_idx % stride != 0:
+            ret = cap.read()[0] if sampling == "read" else cap.grab()
+            if not ret: break
+            frame_idx += 1
+            continue
+
+        ret, frame = cap.read()
+        if not ret: break
+        yield frame_idx, frame
+        frame_idx += 1
+
+def _read_frame_at(cap, frame_idx: int):
+    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+    ret, frame = cap.read()
+    return frame if ret else None
+
+def _extract_shard(video_path, out_dir, shard_no, start, end, stride, ms_per_frame, min_scene_delta, sampling, detector):
+    """
+    Decode one time range of the video in a worker process.
+
+    The shard cannot know which frame the previous shard ended on, so it
+    runs the scene-change chain as if its first sample were a keyframe,
+    saves those candidates (losslessly, they are re-read by the parent),
+    and returns the features of every sample so the parent can replay the
+    real chain across shard boundaries.
+    """
+    cap = cv2.VideoCapture(video_path)
+    frame_idxs, feats, saved = [], [], {}
+    last_feat = None
+    for frame_idx, frame in _sample_frames(cap, stride, ms_per_frame, sampling, start, end):
+        feat = detector.features(frame)
+        frame_idxs.append(frame_idx)
+        feats.append(feat)
+        if last_feat is None or detector.distance(last_feat, feat) > min_scene_delta:
+            out_path = os.path.join(out_dir, f"shard{shard_no:03d}_{frame_idx:08d}.png")
+            write_frame(out_path, frame, "png")
+            saved[frame_idx] = out_path
+            last_feat = feat
+    cap.release()
+    return frame_idxs, np.array(feats), saved
+
+def _scan_sharded(video_path, out_dir, frame_count, workers, stride, ms_per_frame, min_scene_delta, sampling, detector):
+    """Yield (ts_ms, score, frame) for each scene change, decoding shards in parallel."""
+    # Shard boundaries sit on sample positions so every shard sees the same
+    # samples the sequential loop would
+    samples_total = (frame_count + stride - 1) // stride
+    per_shard = (samples_total + workers - 1) // workers
+    bounds = []
+    for n in range(workers):
+        start, end = n * per_shard * stride, min(frame_count, (n + 1) * per_shard * stride)
+        if start < end:
+            bounds.append((start, end))
+    # FRAME_COUNT is an estimate for some containers, let the last shard run to EOF
+    bounds[-1] = (bounds[-1][0], None)
+
+    # spawn, as in core.executors: the app's threads make forking unsafe
+    with ProcessPoolExecutor(max_workers=len(bounds), mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [
+            pool.submit(
+                _extract_shard, video_path, out_dir, n, start, end, stride, ms_per_frame,
+                min_scene_delta, sampling, detector
+            )
+            for n, (start, end) in enumerate(bounds)
+        ]
+        shards = [f.result() for f in futures]
+
+    # Replay the sequential chain over all samples. Inside a shard the local
+    # chain agrees with the real one from the first frame both select, so
+    # only the first few decisions after each boundary can differ.
+    saved = {}
+    selected = []
+    ref = None
+    for frame_idxs, feats, shard_saved in shards:
+        saved.update(shard_saved)
+        positions, scores, ref = select_scene_changes(detector, feats, min_scene_delta, ref)
+        selected.extend((frame_idxs[i], score) for i, score in zip(positions, scores))
+
+    cap = None
+    try:
+        for frame_idx, score in selected:
+            if frame_idx in saved:
+                path = saved.pop(frame_idx)
+                frame = cv2.imread(path)
+                os.remove(path)
+            else:
+                # Selected only once the real reference frame was known
+                cap = cap or cv2.VideoCapture(video_path)
+                frame = _read_frame_at(cap, frame_idx)
+            yield int(frame_idx * ms_per_frame), score, frame
+    finally:
+        if cap is not None:
+            cap.release()
+        for path in saved.values():
+            os.remove(path)
+
+def _scan(cap, stride, ms_per_frame, min_scene_delta, sampling, detector):
+    """Yield (ts_ms, score, frame) for each scene change; score is None for the first frame."""
+    last_feat = None
+    for frame_idx, frame in _sample_frames(cap, stride, ms_per_frame, sampling):
+        feat = detector.features(frame)
+        score = None
+        if last_feat is not None:
+            score = detector.distance(last_feat, feat)
+            if score <= min_scene_delta:
+                continue
+        last_feat = feat
+        yield int(frame_idx * ms_per_frame), score, frame
+
+def _grey_thumbnail(frame) -> np.ndarray:
+    h, w = frame.shape[:2]
+    size = (DUPLICATE_WIDTH, max(1, round(h * DUPLICATE_WIDTH / w)))
+    return cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), size, interpolation=cv2.INTER_AREA)
+
+class _DuplicateIndex:
+    """
+    Every keyframe kept so far, for finding repeats: pHashes are searched in
+    one vectorized pass, and the close ones confirmed with the scene
+    detector and a pixel comparison.
+    """
+    def __init__(self, detector: SceneDetector, threshold: float, max_distance: float = DUPLICATE_DISTANCE):
+        self.detector = detector
+        self.threshold = threshold
+        self.max_distance = max_distance
+        self._hasher = PHashDetector()
+        self._metas, self._hashes, self._features = [], [], []
+
+    def features(self, frame) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return self._hasher.features(frame), self.detector.features(frame), _grey_thumbnail(frame)
+
+    def lookup(self, features: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> Optional[Dict]:
+        if not self._hashes:
+            return None
+        phash, scene, thumb = features
+        dist = self._hasher.distances(phash, np.stack(self._hashes))
+        for i in np.argsort(dist, kind="stable"):
+            if dist[i] > self.max_distance:
+                break
+            _, kept_scene, kept_thumb = self._features[i]
+            if self.detector.distance(kept_scene, scene) > self.threshold or kept_thumb.shape != thumb.shape:
+                continue
+            if int((cv2.absdiff(kept_thumb, thumb) > DUPLICATE_PIXEL_DELTA).sum()) <= DUPLICATE_MAX_PIXELS:
+                return self._metas[i]
+        return None
+
+    def add(self, meta: Dict, features: Tuple[np.ndarray, np.ndarray, np.ndarray]):
+        self._metas.append(meta)
+        self._hashes.append(features[0])
+        self._features.append(features)
+
+    def remove(self, meta: Dict):
+        for i, m in enumerate(self._metas):
+            if m is meta:
+                del self._metas[i], self._hashes[i], self._features[i]
+                return
+
+def _emit_keyframes(candidates, out_dir, image_format, writer, dedupe, max_frames, detector, min_scene_delta):
+    """
+    Number, save and yield scene-change candidates.
+
+    With `dedupe`, a candidate that repeats any keyframe already kept (not
+    just the previous one) is emitted as a reference to it: it gets
+    "duplicate_of" and the original's path, and no image of its own. A
+    repeat has nearly the same pHash, is no scene change for `detector`
+    at `min_scene_delta` and differs in no more than a few pixels (see
+    DUPLICATE_MAX_PIXELS).
+
+    With `max_frames`, only the max_frames distinct keyframes with the
+    largest change scores are kept (the first frame always is), along with
+    the duplicates that point at them. The lowest-scoring frame is evicted
+    as soon as the budget overflows, so memory stays bounded, but nothing
+    can be yielded until the whole video has been scanned.
+    """
+    dupes = _DuplicateIndex(detector, min_scene_delta) if dedupe else None
+    kept = []
+    next_index = 0
+
+    def finish(entry):
+        nonlocal next_index
+        meta = {"index": next_index, "ts_ms": entry["ts_ms"], "path": None, "score": entry["score"]}
+        next_index += 1
+        original = entry.get("duplicate_of")
+        if original is not None:
+            meta["path"] = original["path"]
+            meta["duplicate_of"] = original["index"]
+        else:
+            meta["path"] = os.path.join(out_dir, f"frame_{meta['index']:05d}.{image_format}")
+            if writer is not None:
+                writer.submit(meta["path"], entry["image"], image_format)
+            else:
+                write_frame(meta["path"], entry["image"], image_format)
+            meta["image"] = entry["image"]
+        # Later duplicates resolve their original through this entry
+        entry.update(index=meta["index"], path=meta["path"])
+        return meta
+
+    for ts_ms, score, frame in candidates:
+        entry = {"ts_ms": ts_ms, "score": None if score is None else round(score, 2), "image": frame}
+        if dupes is not None:
+            features = dupes.features(frame)
+            original = dupes.lookup(features)
+            if original is not None:
+                entry = {"ts_ms": ts_ms, "score": entry["score"], "duplicate_of": original}
+            else:
+                dupes.add(entry, features)
+
+        if not max_frames:
+            yield finish(entry)
+            continue
+
+        kept.append(entry)
+        distinct = [e for e in kept if "duplicate_of" not in e]
+        if len(distinct) > max_frames:
+            drop = min(distinct[1:], key=lambda e: e["score"])
+            kept = [e for e in kept if e is not drop and e.get("duplicate_of") is not drop]
+            if dupes is not None:
+                dupes.remove(drop)
+
+    for entry in kept:
+        yield finish(entry)
+
+def iter_keyframes(
     video_path: str,
     out_dir: str,
-    min_scene_delta: float = 25.0,
-    fps_cap: float = 1.0
-) -> List[Dict]:
+    min_scene_delta: Optional[float] = None,
+    fps_cap: float = 1.0,
+    sampling: str = "grab",
+    workers: int = 1,
+    detector: Union[str, SceneDetector, None] = None,
+    image_format: str = "jpg",
+    writer: Optional[FrameWriter] = None,
+    dedupe: bool = False,
+    max_frames: Optional[int] = None
+) -> Iterator[Dict]:
+    """
+    Save the frames where the scene changes, yielding each one's metadata
+    as soon as it is selected.
+
+    Each yielded dict carries the change score against the previous
+    keyframe and the decoded BGR frame under "image", so the prompt can be
+    encoded without reading the file back. With a `writer` the file itself
+    is written in the background.
+
+    `detector` picks how frames are compared (see core.scene.DETECTORS);
+    `min_scene_delta` defaults to that detector's threshold. See
+    _emit_keyframes for `dedupe` and `max_frames`.
+
+    With workers > 1, videos long enough to give every worker at least
+    MIN_SHARD_SECONDS are split into time ranges decoded in parallel
+    processes. The result is identical to the sequential scan, but it is
+    only yielded once every shard has finished.
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format: {image_format}")
     os.makedirs(out_dir, exist_ok=True)
+    detector = get_detector(detector)
+    if min_scene_delta is None:
+        min_scene_delta = detector.default_threshold
     cap = cv2.VideoCapture(video_path)
     fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
-    last_hist = None
-    frames_meta = []
-    frame_idx = 0
-    saved_idx = 0
     ms_per_frame = 1000.0 / fps
 
     stride = int(max(1, fps / fps_cap)) if fps_cap else 1
 
-    while True:
-        ret, frame = cap.read()
-        if not ret: break
-        ts_ms = int(frame_idx * ms_per_frame)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    if workers > 1 and frame_count > 0:
+        workers = min(workers, int(frame_count * ms_per_frame / 1000.0 / MIN_SHARD_SECONDS))
 
-        if frame_idx % stride != 0:
-            frame_idx += 1
-            continue
+    try:
+        if workers > 1:
+            cap.release()
+            candidates = _scan_sharded(
+                video_path, out_dir, frame_count, workers, stride, ms_per_frame,
+                min_scene_delta, sampling, detector
+            )
+        else:
+            candidates = _scan(cap, stride, ms_per_frame, min_scene_delta, sampling, detector)
+        yield from _emit_keyframes(candidates, out_dir, image_format, writer, dedupe, max_frames, detector, min_scene_delta)
+    finally:
+        cap.release()
 
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        hist = cv2.calcHist([hsv],[0,1],None,[50,60],[0,180,0,256])
-        cv2.normalize(hist, hist).flatten()
+def extract_keyframes(video_path: str, out_dir: str, **kwargs) -> List[Dict]:
+    """Run iter_keyframes to completion and return all frame metadata (without images)."""
+    frames = []
+    for meta in iter_keyframes(video_path, out_dir, **kwargs):
+        meta.pop("image", None)
+        frames.append(meta)
+    return frames
 
-        scene_change = False
-        if last_hist is not None:
-            diff = cv2.compareHist(last_hist, hist, cv2.HISTCMP_BHATTACHARYYA) * 100
-            scene_change = diff > min_scene_delta
+async def aiter_keyframes(video_path: str, out_dir: str, **kwargs) -> AsyncIterator[Dict]:
+    """
+    Async version of iter_keyframes. Decoding runs on the decode pool
+    (OpenCV releases the GIL) and frames are handed to the event loop
+    as they are selected, at most KEYFRAME_QUEUE_SIZE ahead of the
+    consumer.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    # Free places in the queue, taken by the decoder and given back as frames are consumed
+    slots = threading.Semaphore(KEYFRAME_QUEUE_SIZE)
+    stop = threading.Event()
+    done = object()
 
-        if scene_change or last_hist is None:
-            out_path = os.path.join(out_dir, f"frame_{saved_idx:05d}.png")
-            cv2.imwrite(out_path, frame)
-            frames_meta.append({"index": saved_idx, "ts_ms": ts_ms, "path": out_path})
-            saved_idx += 1
-            last_hist = hist
+    def produce():
+        try:
+            for meta in iter_keyframes(video_path, out_dir, **kwargs):
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, meta)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
 
-        frame_idx += 1
-
-    cap.release()
-    return frames_meta
+    producer = loop.run_in_executor(decode_pool(), produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            slots.release()
+            yield item
+    finally:
+        stop.set()
+        await producer
@@ -0,0 +1,204 @@
+
+import asyncio, json, logging, os
+from typing import Awaitable, Callable, Dict, List, Optional
+from core.eval import normalize, simple_similarity
+from core.prompt import Prompt
+
+logger = logging.getLogger(__name__)
+
+# Windows analyzed at once per run
+WINDOW_CONCURRENCY = int(os.getenv("LLM_WINDOW_CONCURRENCY", "4"))
+# Title similarity (0-100, see core.eval.simple_similarity) above which two
+# bugs with shared evidence frames from overlapping windows are one bug
+BUG_SIMILARITY = 60
+STEP_SIMILARITY = 60
+SEVERITY_RANK = {"low": 0, "medium": 1, "high": 2, "critical": 3}
+
+CONSOLIDATE_SYSTEM = """You merge QA findings that were produced separately for consecutive, overlapping windows of one screen recording.
+
+CRITICAL: You must respond with ONLY valid JSON in the same format as the input: {"bugs": [...], "steps": [...], "assumptions": "...", "metadata": {...}}.
+
+Merge bugs that describe the same problem, keeping the union of their evidence_frames and the highest severity. Merge steps that describe the same action and keep them in time order, numbered from 1. Do not invent findings that are not in the input."""
+
+def _frames(item: Dict, key: str) -> List[int]:
+    return [f for f in (item.get(key) or []) if isinstance(f, int)]
+
+def to_global(result: Dict, frames: List[Dict]) -> Dict:
+    """
+    Map frame references in a window's result that are not frames of the
+    window, but are positions among its images, to those frames' indices:
+    a model that ignored the frame labels counts the window's images from 0.
+    """
+    present = {f["index"] for f in frames}
+    shown = [f for f in frames if "image_base64" in f]
+    for key, field in (("bugs", "evidence_frames"), ("bugs_strong", "evidence_frames"), ("bugs_minor", "evidence_frames"), ("steps", "frames")):
+        for item in result.get(key) or []:
+            if not isinstance(item, dict):
+                continue
+            refs = _frames(item, field)
+            if refs and not set(refs) & present and all(0 <= f < len(shown) for f in refs):
+                item[field] = [shown[f]["index"] for f in refs]
+    return result
+
+def merge_steps(steps: List[Dict]) -> List[Dict]:
+    """Order steps by their first frame, fold repeats from window overlaps together and renumber them."""
+    ordered = sorted(
+        (s for s in steps if isinstance(s, dict)),
+        key=lambda s: (min(_frames(s, "frames"), default=1 << 30), s.get("step_no") or 0)
+    )
+    merged = []
+    for step in ordered:
+        frames = set(_frames(step, "frames"))
+        for kept in merged:
+            shared = frames & set(kept["frames"])
+            same = frames == set(kept["frames"]) or simple_similarity(normalize(step.get("summary", "")), normalize(kept.get("summary", ""))) >= STEP_SIMILARITY
+            if shared and same:
+                kept["frames"] = sorted(set(kept["frames"]) | frames)
+                break
+        else:
+            merged.append(dict(step, frames=sorted(frames)))
+    for n, step in enumerate(merged, 1):
+        step["step_no"] = n
+    return merged
+
+def merge_bugs(bugs: List[Dict]) -> List[Dict]:
+    """Fold together bugs that overlapping windows both reported, then renumber them."""
+    merged = []
+    for bug in (b for b in bugs if isinstance(b, dict)):
+        evidence = set(_frames(bug, "evidence_frames"))
+        title = normalize(bug.get("title", ""))
+        for kept in merged:
+            if not evidence & set(kept["evidence_frames"]):
+                continue
+            if simple_similarity(title, normalize(kept.get("title", ""))) < BUG_SIMILARITY:
+                continue
+            kept["evidence_frames"] = sorted(set(kept["evidence_frames"]) | evidence)
+            if SEVERITY_RANK.get(str(bug.get("severity", "")).lower(), -1) > SEVERITY_RANK.get(str(kept.get("severity", "")).lower(), -1):
+                kept["severity"] = bug["severity"]
+            if len(bug.get("description") or "") > len(kept.get("description") or ""):
+                kept["description"] = bug["description"]
+            break
+        else:
+            merged.append(dict(bug, evidence_frames=sorted(evidence)))
+    merged.sort(key=lambda b: min(b["evidence_frames"], default=1 << 30))
+    for n, bug in enumerate(merged, 1):
+        bug["id"] = f"BUG-{n:03d}"
+    return merged
+
+def merge_results(results: List[Dict]) -> Dict:
+    """Reduce per-window analyses into one in the usual output format."""
+    bugs, steps, assumptions = [], [], []
+    metadata = {}
+    for result in results:
+        for key in ("bugs", "bugs_strong", "bugs_minor"):
+            bugs.extend(result.get(key) or [])
+        steps.extend(result.get("steps") or [])
+        text = (result.get("assumptions") or "").strip()
+        if text and text not in assumptions:
+            assumptions.append(text)
+        for key, value in (result.get("metadata") or {}).items():
+            metadata.setdefault(key, value)
+    metadata["windows"] = str(len(results))
+    return {
+        "bugs": merge_bugs(bugs),
+        "steps": merge_steps(steps),
+        "assumptions": "\n".join(assumptions),
+        "metadata": metadata
+    }
+
+class WindowedAnalysis:
+    """
+    Map-reduce LLM analysis over overlapping windows of frames.
+
+    Frame entries are add()ed in order; every time `size` of them are in, a
+    window is sent through `call` right away (at most `concurrency` at
+    once), so early windows run while later frames are still being
+    decoded and encoded. Consecutive windows share `overlap` frames. A
+    window that holds a delta crop or a duplicate whose reference frame
+    fell in an earlier window gets that frame prepended. finish() sends
+    the last partial window and merges all results.
+    """
+    def __init__(
+        self,
+        base: Prompt,
+        size: int,
+        overlap: int,
+        call: Callable[[Prompt], Awaitable[Dict]],
+        concurrency: int = WINDOW_CONCURRENCY,
+        on_window: Optional[Callable[[int, int], None]] = None
+    ):
+        if size < 1 or not 0 <= overlap < size:
+            raise ValueError("window size must be >= 1 and overlap in [0, size)")
+        self.base = base
+        self.size = size
+        self.overlap = overlap
+        self.call = call
+        self.on_window = on_window
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.entries: List[Dict] = []
+        self._by_index: Dict[int, Dict] = {}
+        self._next_start = 0
+        self._tasks: List[asyncio.Task] = []
+        self._done = 0
+
+    def add(self, entry: Dict):
+        self.entries.append(entry)
+        self._by_index[entry["index"]] = entry
+        if len(self.entries) - self._next_start >= self.size:
+            self._launch(self.entries[self._next_start:self._next_start + self.size])
+            self._next_start += self.size - self.overlap
+
+    def _window_prompt(self, entries: List[Dict]) -> Prompt:
+        present = {e["index"] for e in entries}
+        refs = {
+            e.get("ref_frame", e.get("duplicate_of")) for e in entries
+        } - present - {None}
+        frames = [self._by_index[i] for i in sorted(refs) if i in self._by_index] + entries
+        return Prompt(self.base.system, self.base.scenario, frames, self.base.assets, self.base.instructions, rules=self.base.rules)
+
+    def _launch(self, entries: List[Dict]):
+        prompt = self._window_prompt(entries)
+
+        async def run():
+            async with self._semaphore:
+                result = to_global(await self.call(prompt), prompt.frames)
+            self._done += 1
+            if self.on_window:
+                self.on_window(self._done, len(self._tasks))
+            return result
+
+        self._tasks.append(asyncio.create_task(run()))
+
+    async def finish(self) -> Dict:
+        # The tail: frames not yet covered by a full window (or the only window)
+        covered = self._next_start + self.overlap if self._tasks else 0
+        if len(self.entries) > covered or not self._tasks:
+            self._launch(self.entries[self._next_start:])
+        try:
+            results = await asyncio.gather(*self._tasks)
+        except BaseException:
+            self.cancel()
+            raise
+        return merge_results(results)
+
+    def cancel(self):
+        for task in self._tasks:
+            task.cancel()
+
+    @property
+    def windows(self) -> int:
+        return len(self._tasks)
+
+async def consolidate(merged: Dict, call: Callable[[Prompt], Awaitable[Dict]]) -> Dict:
+    """One text-only pass asking the model to merge what the reduce step could not; keeps `merged` on failure."""
+    prompt = Prompt(CONSOLIDATE_SYSTEM, None, [], text=json.dumps(merged, ensure_ascii=False))
+    try:
+        result = await call(prompt)
+    except Exception as e:
+        logger.warning(f"Consolidation call failed, keeping the merged windows: {e}")
+        return merged
+    result.setdefault("metadata", {})
+    for key, value in merged.get("metadata", {}).items():
+        result["metadata"].setdefault(key, value)
+    result["metadata"]["consolidated"] = "true"
+    return result
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Add the backend directory to path to import core modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
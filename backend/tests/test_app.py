@@ -0,0 +1,41 @@
+import asyncio
+import hashlib
+import io
+
+import pytest
+from fastapi import HTTPException, UploadFile
+from fastapi.testclient import TestClient
+
+import app as app_module
+
+def upload(data: bytes) -> UploadFile:
+    return UploadFile(io.BytesIO(data), filename="video.mp4")
+
+def test_save_upload_streams_chunks_and_hashes(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, "UPLOAD_CHUNK_BYTES", 1000)
+    data = bytes(range(256)) * 50
+    path = tmp_path / "video.mp4"
+    digest = asyncio.run(app_module.save_upload(upload(data), str(path)))
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert path.read_bytes() == data
+
+def test_save_upload_rejects_oversize_uploads(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, "UPLOAD_CHUNK_BYTES", 1000)
+    path = tmp_path / "video.mp4"
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(app_module.save_upload(upload(b"x" * 5000), str(path), max_bytes=4096))
+    assert e.value.status_code == 413
+    assert not path.exists()
+    # Exactly at the limit is fine
+    asyncio.run(app_module.save_upload(upload(b"x" * 4096), str(path), max_bytes=4096))
+    assert path.stat().st_size == 4096
+
+def test_oversize_job_is_rejected_with_413(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, "RUNS_DIR", str(tmp_path))
+    monkeypatch.setattr(app_module.save_upload, "__defaults__", (1024,))
+    client = TestClient(app_module.app)
+    files = {"video": ("big.mp4", b"x" * 4096, "video/mp4"), "config_text": ("config.yaml", b"scenario_id: s\n")}
+    r = client.post("/jobs", files=files)
+    assert r.status_code == 413
+    # The half-written run dir is removed
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from core import batch, llm
+from core.cache import ArtifactCache
+
+def answer(text: str) -> dict:
+    return {"status_code": 200, "body": {"choices": [{"message": {"content": text}}]}}
+
+def output(bugs: list) -> str:
+    return json.dumps({"bugs": bugs, "steps": [], "assumptions": "", "metadata": {}})
+
+@pytest.fixture
+def response_cache(monkeypatch, tmp_path):
+    cache = ArtifactCache(str(tmp_path / "llm_cache"))
+    monkeypatch.setattr(llm, "response_cache", cache)
+    return cache
+
+def test_results_are_cached_under_their_requests_keys(tmp_path, response_cache):
+    keys = {f"run-{n}": f"{n}" * 64 for n in range(6)}
+    lines = [
+        # Output files are not in request order
+        {"custom_id": "run-1", "response": answer(output([{"id": "BUG-2"}]))},
+        {"custom_id": "run-0", "response": answer(output([{"id": "BUG-1"}]))},
+        {"custom_id": "run-2", "error": {"code": "server_error"}},
+        {"custom_id": "run-3", "response": {"status_code": 429, "body": {}}},
+        {"custom_id": "run-4", "response": answer("I cannot help with that.")},
+        {"custom_id": "run-5", "response": answer("```json\n" + output([]) + "\n```")},
+        {"custom_id": "unknown", "response": answer(output([]))},
+    ]
+    path = tmp_path / "results-0.jsonl"
+    path.write_text("\n".join(json.dumps(line) for line in lines) + "\n\n")
+
+    assert batch._read_results(str(path), keys) == (2, 5)
+    assert llm.cached_response(keys["run-0"])["bugs"] == [{"id": "BUG-1"}]
+    assert llm.cached_response(keys["run-1"])["bugs"] == [{"id": "BUG-2"}]
+    # Errors, throttled and malformed answers (repaired ones included) are asked for again live
+    assert all(llm.cached_response(keys[f"run-{n}"]) is None for n in (2, 3, 4, 5))
+    assert response_cache.stats()["entries"] == 2
+
+def test_request_files_split_at_the_request_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "MAX_REQUESTS", 2)
+    files = batch.RequestFiles(str(tmp_path), "/v1/chat/completions", "gpt-4o")
+    for n in range(5):
+        files.add(f"run-{n}", llm.RequestBody({"model": "gpt-4o", "messages": [{"role": "user", "content": f"prompt {n}"}]}, [], "@img-"))
+    files.close()
+    assert [p.rsplit("/", 1)[1] for p in files.paths] == ["requests-0.jsonl", "requests-1.jsonl", "requests-2.jsonl"]
+    lines = [json.loads(line) for p in files.paths for line in open(p, encoding="utf-8")]
+    assert [line["custom_id"] for line in lines] == [f"run-{n}" for n in range(5)]
+    assert lines[3] == {
+        "custom_id": "run-3", "method": "POST", "url": "/v1/chat/completions",
+        "body": {"model": "gpt-4o", "messages": [{"role": "user", "content": "prompt 3"}]},
+    }
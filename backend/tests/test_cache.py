@@ -0,0 +1,62 @@
+import os
+import time
+
+from core.cache import ArtifactCache, content_key, file_hash
+
+def test_content_key_is_stable():
+    assert content_key("a", {"x": 1, "y": [1, 2]}) == content_key("a", {"y": [1, 2], "x": 1})
+    assert content_key("a", 1) != content_key("a", "1")
+    assert len(content_key()) == 64
+
+def test_file_hash(tmp_path):
+    path = tmp_path / "f.bin"
+    path.write_bytes(b"x" * 3000)
+    assert file_hash(str(path), chunk_size=1024) == file_hash(str(path))
+
+def test_json_round_trip_and_miss(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    assert cache.get_json("llm", "k" * 64) is None
+    cache.put_json("llm", "k" * 64, {"bugs": [], "note": "ünïcode"})
+    assert cache.get_json("llm", "k" * 64) == {"bugs": [], "note": "ünïcode"}
+
+def test_existing_entry_is_kept_unless_replaced(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    cache.put_json("llm", "key1", {"v": 1})
+    cache.put_json("llm", "key1", {"v": 2})
+    assert cache.get_json("llm", "key1") == {"v": 1}
+    cache.put_json("llm", "key1", {"v": 3}, replace=True)
+    assert cache.get_json("llm", "key1") == {"v": 3}
+    assert not [name for name in os.listdir(tmp_path / "llm" / "ke") if name.startswith(".tmp-")]
+
+def test_max_age(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    path = cache.put_json("llm", "key1", {"v": 1})
+    old = time.time() - 3600
+    os.utime(os.path.join(path, "payload.json"), (old, old))
+    assert cache.get_json("llm", "key1", max_age=60) is None
+    assert cache.get_json("llm", "key1", max_age=7200) == {"v": 1}
+    assert cache.get_json("llm", "key1") == {"v": 1}
+
+def test_dir_entries_copy_files(tmp_path):
+    src = tmp_path / "frame_00000.jpg"
+    src.write_bytes(b"jpeg")
+    cache = ArtifactCache(str(tmp_path / "cache"))
+    cache.put_dir("keyframes", "key1", files=[str(src)], payload=[{"file": src.name}])
+    entry = cache.get_dir("keyframes", "key1")
+    assert sorted(os.listdir(entry)) == ["frame_00000.jpg", "payload.json"]
+    assert cache.get_json("keyframes", "key1") == [{"file": "frame_00000.jpg"}]
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=10_000)
+    blob = "x" * 3000
+    for n, key in enumerate(("key1", "key2", "key3")):
+        path = cache.put_json("s", key, blob)
+        stamp = time.time() - 100 + n
+        os.utime(path, (stamp, stamp))
+    # A hit makes key1 the most recently used
+    assert cache.get_dir("s", "key1") is not None
+    cache.put_json("s", "key4", blob)
+    assert cache.get_dir("s", "key2") is None
+    assert all(cache.get_dir("s", key) is not None for key in ("key1", "key3", "key4"))
+    assert cache.stats()["entries"] == 3
+    assert cache.stats()["bytes"] <= 10_000
@@ -0,0 +1,50 @@
+import asyncio
+import json
+import os
+
+from core.jobs import JOURNAL_FILE, JobQueue
+
+def test_journal_keeps_the_latest_state(tmp_path):
+    async def runner(job, progress):
+        for stage in ("frames", "images", "llm", "eval"):
+            progress(stage, step=stage)
+            await asyncio.sleep(0)
+        return {"ok": True}
+
+    async def scenario():
+        jobs = JobQueue(str(tmp_path), runner, workers=1)
+        await jobs.start()
+        os.makedirs(tmp_path / "job1")
+        jobs.submit("job1")
+        await jobs._queue.join()
+        await jobs.stop()
+        return jobs
+
+    jobs = asyncio.run(scenario())
+    with open(tmp_path / "job1" / JOURNAL_FILE, "r", encoding="utf-8") as f:
+        journaled = json.load(f)
+    assert journaled["status"] == "done"
+    assert journaled["result"] == {"ok": True}
+    assert journaled["progress"]["step"] == "eval"
+    assert not jobs._writes
+
+def test_unfinished_jobs_are_requeued(tmp_path):
+    os.makedirs(tmp_path / "job1")
+    with open(tmp_path / "job1" / JOURNAL_FILE, "w", encoding="utf-8") as f:
+        json.dump({"id": "job1", "status": "running", "stage": "llm", "progress": {}, "created": 1, "updated": 1, "error": None}, f)
+    ran = []
+
+    async def runner(job, progress):
+        ran.append(job["id"])
+        return {}
+
+    async def scenario():
+        jobs = JobQueue(str(tmp_path), runner, workers=1)
+        await jobs.start()
+        await jobs._queue.join()
+        await jobs.stop()
+        return jobs.get("job1")
+
+    job = asyncio.run(scenario())
+    assert ran == ["job1"]
+    assert job["status"] == "done" and job["restarts"] == 1
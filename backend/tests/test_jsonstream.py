@@ -0,0 +1,90 @@
+import asyncio
+import json
+
+import pytest
+
+from core.jsonstream import JsonStream
+from core.llm import _parse_locally, _read_stream
+
+RESPONSE = {
+    "bugs": [{"id": "BUG-001", "title": "Dialog text says {name}", "severity": "High", "evidence_frames": [2]}],
+    "steps": [
+        {"step_no": 1, "summary": "Open the \"Share\" sheet ]", "frames": [0, 1]},
+        {"step_no": 2, "summary": "Tap Send", "frames": [2]},
+    ],
+    "assumptions": "",
+    "metadata": {},
+}
+
+def feed_in_chunks(text: str, size: int):
+    parser = JsonStream()
+    items = []
+    for i in range(0, len(text), size):
+        items.extend(parser.feed(text[i:i + size]))
+    return parser, items
+
+@pytest.mark.parametrize("size", [1, 7, 1000])
+def test_items_close_across_chunks(size):
+    text = json.dumps(RESPONSE)
+    parser, items = feed_in_chunks(text, size)
+    assert items == [("bugs", RESPONSE["bugs"][0]), ("steps", RESPONSE["steps"][0]), ("steps", RESPONSE["steps"][1])]
+    assert parser.getvalue() == text
+    assert parser.errors == []
+
+def test_preamble_and_fence_are_skipped():
+    text = "Here is the analysis you asked for:\n```json\n" + json.dumps(RESPONSE) + "\n```"
+    _, items = feed_in_chunks(text, 5)
+    assert [key for key, _ in items] == ["bugs", "steps", "steps"]
+
+def test_malformed_elements_are_left_out():
+    text = '{"bugs": [{"title": "a",}, "oops", 3], "steps": [{"step_no": 1, "summary": "no frames"}, {"step_no": 2, "summary": "ok", "frames": []}]}'
+    parser, items = feed_in_chunks(text, 4)
+    assert items == [("bugs", {"title": "a"}), ("steps", {"step_no": 2, "summary": "ok", "frames": []})]
+    assert parser.errors == ["Step 0 missing required fields: step_no, summary, frames"]
+
+def test_mismatched_closer_raises():
+    parser = JsonStream()
+    with pytest.raises(ValueError):
+        parser.feed('{"bugs": [}')
+
+class FakeStream:
+    """Server-sent events of a streamed chat completion, `size` characters a chunk."""
+    def __init__(self, text: str, size: int = 9, usage: int = None):
+        self.lines = ['data: {"choices": [], "prompt_filter_results": []}']
+        for i in range(0, len(text), size):
+            self.lines.append("data: " + json.dumps({"choices": [{"delta": {"content": text[i:i + size]}}]}))
+        if usage:
+            self.lines.append("data: " + json.dumps({"choices": [], "usage": {"total_tokens": usage}}))
+        self.lines.append("data: [DONE]")
+
+    async def aiter_lines(self):
+        for line in self.lines:
+            yield line
+
+def read(text: str, **kwargs):
+    items = []
+    text, used = asyncio.run(_read_stream(FakeStream(text, **kwargs), lambda key, item: items.append((key, item))))
+    return text, used, items
+
+def test_read_stream_returns_text_and_usage():
+    text, used, items = read(json.dumps(RESPONSE), usage=321)
+    assert json.loads(text) == RESPONSE
+    assert used == 321
+    assert len(items) == 3
+
+def test_malformed_stream_is_kept_for_repair():
+    # Prose first, a step without frames and a stray closer, then truncated
+    broken = 'Sure! {"bugs": [{"id": "BUG-001", "title": "t", "evidence_frames": [1]}], "steps": [{"step_no": 1, "summary": "s"}], "x": ]] "assumptions": "'
+    text, used, items = read(broken)
+    assert text == broken
+    assert used is None
+    assert items == [("bugs", {"id": "BUG-001", "title": "t", "evidence_frames": [1]})]
+
+def test_stream_with_preamble_and_missing_frames_is_repaired_locally():
+    response = 'Here you go:\n{"bugs": [], "steps": [{"step_no": 1, "summary": "Open mail"}], "assumptions": "", "metadata": {}}'
+    text, _, items = read(response)
+    assert items == []
+    parsed, error = _parse_locally(text)
+    assert error is None
+    assert parsed["steps"] == [{"step_no": 1, "summary": "Open mail", "frames": []}]
+    assert parsed["metadata"]["repaired"] == "local"
@@ -0,0 +1,53 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from core import llm
+from core.cache import ArtifactCache
+
+VALID = {"bugs": [], "steps": [{"step_no": 1, "summary": "Open", "frames": [0]}], "assumptions": "", "metadata": {}}
+
+@pytest.fixture
+def endpoint(monkeypatch, tmp_path):
+    """A fake chat-completions endpoint answering with each of `answers` in turn; returns the request count."""
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("OPENAI_BASE_URL", "http://llm.test/v1")
+    for name in ("AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_DEPLOYMENT", "AZURE_OPENAI_DEPLOYMENTS"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(llm, "response_cache", ArtifactCache(str(tmp_path)))
+    answers, requests = [], []
+
+    async def request(method, url, **kwargs):
+        requests.append(url)
+        content = answers.pop(0)
+        return httpx.Response(200, json={"choices": [{"message": {"content": content}}]}, request=httpx.Request(method, url))
+
+    monkeypatch.setattr(llm.http_client, "request", request)
+    return answers, requests
+
+def call():
+    return asyncio.run(llm.call_llm({"system": "s", "user": "u"}))
+
+def test_valid_response_is_cached(endpoint):
+    answers, requests = endpoint
+    answers.append(json.dumps(VALID))
+    assert call()["metadata"]["cache"] == "miss"
+    assert call()["metadata"]["cache"] == "hit"
+    assert len(requests) == 1
+
+def test_repaired_response_is_not_cached(endpoint):
+    answers, requests = endpoint
+    answers.extend(["```json\n" + json.dumps(VALID) + "\n```", json.dumps(VALID)])
+    first = call()
+    assert first["metadata"]["repaired"] == "local"
+    second = call()
+    assert second["metadata"]["cache"] == "miss" and "repaired" not in second["metadata"]
+    assert len(requests) == 2
+
+def test_repaired_batch_result_is_not_cached(endpoint):
+    assert llm.cache_response("k" * 64, json.dumps(VALID) + ",") is None
+    assert llm.cached_response("k" * 64) is None
+    assert llm.cache_response("k" * 64, json.dumps(VALID)) == VALID
+    assert llm.cached_response("k" * 64) == VALID
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from core.llm import _close_json, _parse_locally, _strip_fences, _validate_json_response, repair_json_response
+
+VALID = {"bugs": [], "steps": [{"step_no": 1, "summary": "Open", "frames": [0]}], "assumptions": "", "metadata": {}}
+
+def test_strip_fences_and_prose():
+    assert _strip_fences('```json\n{"a": 1}\n```') == '{"a": 1}'
+    assert _strip_fences('Here is the result:\n{"a": 1}') == '{"a": 1}'
+
+def test_close_json_truncated():
+    def closed(text):
+        text, truncated = _close_json(text)
+        assert truncated
+        return json.loads(text)
+    assert closed('{"bugs": [{"title": "Crash", "sev') == {"bugs": [{"title": "Crash"}]}
+    assert closed('{"steps": [1, 2,') == {"steps": [1, 2]}
+    assert closed('{"note": "unterminated') == {"note": "unterminated"}
+
+def test_close_json_trailing_commas_and_stray_closer():
+    assert _close_json('{"a": [1, 2,], "b": {"c": 3,},}') == ('{"a": [1, 2], "b": {"c": 3}}', False)
+    assert _close_json('{"a": 1}} trailing') == ('{"a": 1}', False)
+
+def test_validate_errors():
+    with pytest.raises(ValueError, match="Invalid JSON"):
+        _validate_json_response("{")
+    with pytest.raises(ValueError, match="Missing required keys"):
+        _validate_json_response('{"bugs": []}')
+    with pytest.raises(ValueError, match="missing required fields"):
+        _validate_json_response(json.dumps({**VALID, "steps": [{"step_no": 1}]}))
+
+def test_repair_fenced_output_with_trailing_commas():
+    text = "Sure!\n```json\n" + json.dumps(VALID)[:-1] + ",}\n```\nLet me know if you need more."
+    repaired = repair_json_response(text)
+    assert repaired["steps"][0]["summary"] == "Open"
+    assert repaired["metadata"] == {}
+
+def test_cut_off_response_is_not_repaired_locally():
+    text = '{"bugs": [{"id": "BUG-001", "title": "Preview shows a blank screen before'
+    assert repair_json_response(text) is None
+    assert repair_json_response(json.dumps(VALID)[:-30]) is None
+    parsed, error = _parse_locally(text)
+    assert parsed is None and "Invalid JSON" in error
+
+def test_repair_coerces_missing_keys():
+    repaired = repair_json_response('{"bugs": {"title": "Crash"}, "steps": [{"summary": "Open"}, "junk"]}')
+    assert repaired == {
+        "bugs": [{"title": "Crash"}],
+        "steps": [{"summary": "Open", "step_no": 1, "frames": []}],
+        "assumptions": "",
+        "metadata": {},
+    }
+
+def test_repair_gives_up_on_prose():
+    assert repair_json_response("I could not analyze this video.") is None
+    assert repair_json_response("") is None
+    assert repair_json_response("[1, 2]") is None
+
+def test_parse_locally():
+    parsed, error = _parse_locally(json.dumps(VALID))
+    assert error is None and "repaired" not in parsed["metadata"]
+    parsed, error = _parse_locally(json.dumps(VALID) + ",")
+    assert error is None and parsed["metadata"]["repaired"] == "local"
+    parsed, error = _parse_locally("no json here")
+    assert parsed is None and "Invalid JSON" in error
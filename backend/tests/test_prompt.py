@@ -0,0 +1,177 @@
+import json
+import os
+
+import numpy as np
+
+from core import prompt
+from core.prompt import (
+    DELTA_MARGIN, IMAGE_LEVELS, TEXT_TOKEN_RESERVE, DeltaRegions, PromptAsset, RuleIndex, changed_region, plan_images,
+    scenario_facts, vision_tokens
+)
+from core.schemas import Config
+
+RULEBOOK = {
+    "R25_password_prompt_presence": {"violation": "No password prompt", "if": {"conditions.file.protection.password": True}},
+    "R26_redundant_desktop_cta_under_100mb": {"violation": "Redundant CTA", "if": {"conditions.file.size_tier": {"in": ["S", "M", "L"]}}},
+    "R27_loader_duplication": {"violation": "Two loaders"},
+    "R29_error_over_spinner": {"violation": "Error over spinner"},
+    "R34_password_label_flow": {"violation": "Label flow", "if": {
+        "conditions.file.protection.password": True,
+        "conditions.file.protection.label": {"in": ["Confidential", "Highly Confidential"]},
+    }},
+    "R35_account_mismatch_primary_secondary": {"violation": "Account mismatch", "if": {
+        "conditions.accounts.hub_account": "Primary", "conditions.accounts.app_account": "Secondary",
+    }},
+    "R38_no_app_installed_requires_store_cta": {"violation": "No store CTA", "if": {
+        "conditions.apps_installed.excel": False, "conditions.apps_installed.m365": False,
+    }},
+    "R39_xl_threshold_desktop_redirect": {"violation": "No desktop redirect", "if": {"conditions.file.size_tier": "XL"}},
+}
+
+def facts(**overrides):
+    cfg = dict(scenario_id="s", source_apps=["Outlook"], file_size_bucket="small", protection_level="none")
+    return scenario_facts(Config(**{**cfg, **overrides}))
+
+def test_select_splits_applies_and_possible():
+    index = RuleIndex(RULEBOOK)
+    applies, possible = index.select(facts())
+    assert applies == ["R29_error_over_spinner", "R26_redundant_desktop_cta_under_100mb", "R27_loader_duplication"]
+    assert possible == ["R35_account_mismatch_primary_secondary", "R38_no_app_installed_requires_store_cta"]
+    applies, _ = index.select(facts(protection_level="password"))
+    assert applies[0] == "R25_password_prompt_presence"
+    # A known fact that fails one condition drops the rule
+    assert "R34_password_label_flow" not in applies + _
+
+def test_section_sends_only_the_rules_that_apply():
+    index = RuleIndex(RULEBOOK)
+    text, chosen = index.section(facts())
+    assert chosen == ["R29_error_over_spinner", "R26_redundant_desktop_cta_under_100mb", "R27_loader_duplication"]
+    assert "R35" not in text and "R38" not in text and "R39" not in text
+    assert index.section(facts()) is index.section(facts())
+
+def test_section_limits():
+    index = RuleIndex(RULEBOOK)
+    assert index.section(facts(), max_rules=2)[1] == ["R29_error_over_spinner", "R26_redundant_desktop_cta_under_100mb"]
+    text, chosen = index.section(facts(), max_chars=120)
+    assert len(text) <= 120 and chosen
+    # Without a scenario every rule is offered in priority order
+    assert len(index.section(None)[1]) == len(RULEBOOK)
+
+def test_vision_tokens():
+    assert vision_tokens(4000, 4000, "low") == 85
+    assert vision_tokens(512, 512) == 85 + 170
+    # Scaled to 768x768: 2x2 tiles
+    assert vision_tokens(1024, 1024) == 85 + 170 * 4
+    # Fit in 2048x2048 to 1024x2048, then 768x1536: 2x3 tiles
+    assert vision_tokens(2048, 4096) == 85 + 170 * 6
+
+def phone_frames(scores):
+    return [{"index": i, "size": (1170, 2532), "score": score} for i, score in enumerate(scores)]
+
+def test_plan_without_budget_uses_the_top_level():
+    plan = plan_images(phone_frames([None, 40, 10]))
+    assert [e["level"] for e in plan["frames"]] == [len(IMAGE_LEVELS) - 1] * 3
+    assert plan["frames"][0]["width"] == 1024 and not plan["over_budget"]
+
+def test_plan_fits_the_token_budget_biggest_changes_first():
+    frames = phone_frames([None, 40, 10, 4])
+    budget = TEXT_TOKEN_RESERVE + 3000
+    plan = plan_images(frames, token_budget=budget)
+    levels = [e["level"] for e in plan["frames"]]
+    assert plan["estimated_tokens"] <= budget and not plan["over_budget"]
+    assert plan["estimated_tokens"] == TEXT_TOKEN_RESERVE + sum(
+        vision_tokens(e["width"], e["height"], e["detail"]) for e in plan["frames"]
+    )
+    assert levels == sorted(levels, reverse=True) and levels[0] > levels[-1]
+    assert plan_images(frames, token_budget=budget + 2000)["estimated_tokens"] > plan["estimated_tokens"]
+
+def test_plan_byte_budget_and_over_budget():
+    frames = phone_frames([None, 40, 10])
+    plan = plan_images(frames, byte_budget=400_000)
+    assert plan["estimated_image_bytes"] <= 400_000 and not plan["over_budget"]
+    assert plan["frames"][0]["level"] > 0
+    tight = plan_images(frames, token_budget=TEXT_TOKEN_RESERVE + 100)
+    assert tight["over_budget"]
+    assert [e["level"] for e in tight["frames"]] == [0, 0, 0]
+
+def test_plan_costs_duplicates_nothing_and_crops_at_their_size():
+    frames = phone_frames([None, 40, 10])
+    frames[1]["duplicate_of"] = 0
+    frames[2]["crop"] = [0, 0, 300, 200]
+    plan = plan_images(frames)
+    assert plan["frames"][1] == {"index": 1, "duplicate_of": 0, "tokens": 0, "bytes": 0}
+    assert (plan["frames"][2]["width"], plan["frames"][2]["height"]) == (300, 200)
+    assert plan["frames"][2]["tokens"] == vision_tokens(300, 200)
+
+def screen(*boxes):
+    """A dark 400x800 screen with light (x, y, w, h) boxes drawn on it."""
+    image = np.full((800, 400, 3), 60, np.uint8)
+    for x, y, w, h in boxes:
+        image[y:y + h, x:x + w] = 200
+    return image
+
+def test_changed_region_bounds():
+    assert changed_region(screen(), screen()) is None
+    assert changed_region(screen(), np.zeros((10, 10, 3), np.uint8)) is None
+    x, y, w, h = changed_region(screen(), screen((100, 200, 200, 60)))
+    # The box plus the margin, on the 4px block grid
+    assert (x, y, x + w, y + h) == (100 - DELTA_MARGIN, 200 - DELTA_MARGIN, 300 + DELTA_MARGIN, 260 + DELTA_MARGIN)
+    # Clamped to the screen
+    assert changed_region(screen(), screen((0, 780, 48, 20))) == (0, 780 - DELTA_MARGIN, 48 + DELTA_MARGIN, 20 + DELTA_MARGIN)
+
+def test_delta_regions_crop_against_the_last_full_frame():
+    frames = [
+        {"index": 0, "image": screen()},
+        {"index": 1, "image": screen((100, 200, 200, 60))},
+        {"index": 2, "duplicate_of": 0, "image": screen()},
+        # Most of the screen changed: sent in full, and the new reference
+        {"index": 3, "image": screen((0, 0, 400, 600))},
+        {"index": 4, "image": screen((0, 0, 400, 600), (20, 700, 100, 40))},
+    ]
+    regions = DeltaRegions()
+    for f in frames:
+        regions.assign(f)
+    assert "crop" not in frames[0] and "crop" not in frames[2] and "crop" not in frames[3]
+    assert frames[1]["ref_frame"] == 0
+    x, y, w, h = frames[1]["crop"]
+    assert x <= 100 and y <= 200 and x + w >= 300 and y + h >= 260
+    assert frames[4]["ref_frame"] == 3
+    x, y, w, h = frames[4]["crop"]
+    assert y + h <= 800 and w * h < 0.4 * 400 * 800
+
+def test_prompt_asset_reparses_only_changed_content(tmp_path, monkeypatch):
+    monkeypatch.setattr(prompt, "DATA_DIR", str(tmp_path))
+    parsed = []
+    asset = PromptAsset("notes.md", lambda data: parsed.append(data) or data.decode(), "default")
+    assert asset.load() == ("default", "missing")
+    path = tmp_path / "notes.md"
+    path.write_text("one")
+    value, version = asset.load()
+    assert value == "one" and version != "missing"
+    assert asset.load() == (value, version) and len(parsed) == 1
+    # Touched but unchanged: re-read, not re-parsed
+    os.utime(path, ns=(0, 0))
+    assert asset.load() == (value, version) and len(parsed) == 1
+    path.write_text("two")
+    assert asset.load()[0] == "two" and asset.load()[1] != version
+    path.unlink()
+    assert asset.load() == ("default", "missing")
+
+def test_system_prompt_follows_the_rulebook(tmp_path, monkeypatch):
+    monkeypatch.setattr(prompt, "DATA_DIR", str(tmp_path))
+    (tmp_path / "mobile_prompt_blueprint.md").write_text("Blueprint text")
+    (tmp_path / "rulebook.json").write_text(json.dumps(RULEBOOK))
+    monkeypatch.setattr(prompt, "ASSETS", {
+        "blueprint": PromptAsset("mobile_prompt_blueprint.md", lambda data: data.decode("utf-8"), ""),
+        "rulebook": PromptAsset("rulebook.json", lambda data: RuleIndex(json.loads(data)), RuleIndex({})),
+    })
+    monkeypatch.setattr(prompt, "_system_prompts", {})
+    system, versions, rule_ids = prompt.system_prompt(facts=facts(protection_level="password"))
+    assert "Blueprint text" in system and "R25_password_prompt_presence" in system
+    assert rule_ids[0] == "R25_password_prompt_presence"
+    assert prompt.system_prompt(facts=facts(protection_level="password"))[0] is system
+
+    (tmp_path / "rulebook.json").write_text(json.dumps({"R27_loader_duplication": RULEBOOK["R27_loader_duplication"]}))
+    system2, versions2, rule_ids2 = prompt.system_prompt(facts=facts(protection_level="password"))
+    assert rule_ids2 == ["R27_loader_duplication"] and "R25" not in system2
+    assert versions2["rulebook"] != versions["rulebook"] and versions2["blueprint"] == versions["blueprint"]
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import pytest
+
+from core.ratelimit import RateLimiter, TokenBucket, backoff, parse_duration, retry_after
+
+def test_parse_duration():
+    assert parse_duration("7") == 7
+    assert parse_duration("1.5") == 1.5
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("1h2m3s") == 3723
+    assert parse_duration("") is None
+    assert parse_duration("soon") is None
+
+def test_retry_after_prefers_milliseconds():
+    assert retry_after({"retry-after-ms": "250", "retry-after": "9"}) == 0.25
+    assert retry_after({"retry-after": "9"}) == 9
+    assert retry_after({}) is None
+
+def test_backoff_is_capped():
+    assert all(0 <= backoff(attempt) <= 30 for attempt in range(20))
+
+def test_take_larger_than_bucket_is_charged_as_debt():
+    bucket = TokenBucket(30000, burst_seconds=1)
+    assert bucket.capacity == 500
+    assert bucket.wait_for(4000) == 0
+    bucket.take(4000)
+    assert bucket.level == pytest.approx(-3500, abs=5)
+    # The next request waits out the debt plus its own tokens: 3600 tokens at 500/s
+    assert bucket.wait_for(100) == pytest.approx(7.2, abs=0.05)
+
+def test_cap_follows_server_count():
+    bucket = TokenBucket(600)
+    bucket.cap(2)
+    assert bucket.level == pytest.approx(2, abs=0.1)
+    bucket.cap(1000)
+    assert bucket.level == pytest.approx(2, abs=0.1)
+
+def test_settle_corrects_the_estimate():
+    limiter = RateLimiter(tpm=60000)
+    limiter.tokens.take(800)
+    limiter.settle(800, 300)
+    assert limiter.tokens.level == pytest.approx(limiter.tokens.capacity - 300, abs=5)
+    limiter.settle(300, 0)
+    assert limiter.tokens.level == pytest.approx(limiter.tokens.capacity - 300, abs=5)
+
+def test_large_request_holds_back_the_next():
+    async def scenario():
+        limiter = RateLimiter(tpm=60000)
+        await limiter.acquire(1500)
+        started = time.monotonic()
+        await limiter.acquire(10)
+        return time.monotonic() - started
+    # 1000-token bucket refilling at 1000/s: 1500 tokens put it 500 in debt
+    assert asyncio.run(scenario()) >= 0.45
+
+def test_interactive_overtakes_batch():
+    async def scenario():
+        limiter = RateLimiter(rpm=600)
+        limiter.requests.level = 0
+        order = []
+
+        async def call(name, lane):
+            await limiter.acquire(0, lane)
+            order.append(name)
+
+        batch = [asyncio.create_task(call(f"batch{n}", "batch")) for n in range(2)]
+        await asyncio.sleep(0.01)
+        interactive = asyncio.create_task(call("interactive", "interactive"))
+        await asyncio.gather(*batch, interactive)
+        return order
+    assert asyncio.run(scenario()) == ["interactive", "batch0", "batch1"]
+
+def test_observe_pauses_when_exhausted():
+    limiter = RateLimiter(rpm=60, tpm=60000)
+    limiter.observe({"x-ratelimit-remaining-tokens": "120", "x-ratelimit-remaining-requests": "abc"})
+    assert limiter.tokens.level <= 120
+    limiter.observe({"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "2s"})
+    assert limiter.stats()["paused_s"] > 1.5
+
+def test_unknown_lane():
+    with pytest.raises(ValueError):
+        asyncio.run(RateLimiter().acquire(1, "urgent"))
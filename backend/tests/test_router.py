@@ -0,0 +1,74 @@
+import asyncio
+
+import httpx
+
+from core import router
+from core.router import Deployment, Router, get_router
+
+def test_cross_resource_deployments_need_their_own_key(monkeypatch):
+    monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "https://main.openai.azure.com")
+    monkeypatch.setenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o")
+    monkeypatch.setenv("OTHER_KEY", "secret")
+    monkeypatch.setenv(
+        "AZURE_OPENAI_DEPLOYMENTS",
+        "gpt-4o-2,gpt-4o@https://other.openai.azure.com/#OTHER_KEY,gpt-4o@https://nokey.openai.azure.com,gpt-4o@https://unset.openai.azure.com#MISSING_KEY"
+    )
+    monkeypatch.setattr(router, "_router", None)
+    pool = get_router(router._azure_url("https://main.openai.azure.com", "gpt-4o"))
+    assert [(d.name, d.headers) for d in pool.deployments] == [
+        ("gpt-4o", {}),
+        ("gpt-4o-2", {}),
+        ("gpt-4o@https://other.openai.azure.com/", {"api-key": "secret"}),
+    ]
+    assert pool.deployments[2].url.startswith("https://other.openai.azure.com/openai/deployments/gpt-4o/chat/completions")
+
+def slow_pool(delays):
+    deployments = [Deployment(name, f"https://{name}") for name in delays]
+    for d in deployments:
+        d.latencies[False].extend([0.05] * 20)
+    return Router(deployments)
+
+def test_hedge_waits_for_admission(monkeypatch):
+    monkeypatch.setattr(router, "HEDGE_PERCENTILE", 95)
+    delays = {"a": 1.0, "b": 0.05}
+    pool = slow_pool(delays)
+    admitted = []
+
+    async def request(deployment):
+        await asyncio.sleep(delays[deployment.name])
+        return httpx.Response(200)
+
+    async def admit():
+        await asyncio.sleep(0.1)
+        admitted.append(asyncio.get_running_loop().time())
+
+    async def scenario():
+        started = asyncio.get_running_loop().time()
+        response, deployment = await pool.send(request, admit=admit)
+        return deployment.name, admitted, asyncio.get_running_loop().time() - started
+
+    name, charged, elapsed = asyncio.run(scenario())
+    assert name == "b"
+    assert len(charged) == 1
+    # 0.05s to the hedge, 0.1s admission, 0.05s for the hedge itself
+    assert 0.18 < elapsed < 0.6
+    assert pool.deployments[0].hedged == 1 and pool.deployments[1].hedge_wins == 1
+
+def test_no_hedge_when_the_first_answers_during_admission(monkeypatch):
+    monkeypatch.setattr(router, "HEDGE_PERCENTILE", 95)
+    delays = {"a": 0.1, "b": 0.05}
+    pool = slow_pool(delays)
+    sent = []
+
+    async def request(deployment):
+        sent.append(deployment.name)
+        await asyncio.sleep(delays[deployment.name])
+        return httpx.Response(200)
+
+    async def admit():
+        await asyncio.sleep(1.0)
+
+    response, deployment = asyncio.run(pool.send(request, admit=admit))
+    assert deployment.name == "a"
+    assert sent == ["a"]
+    assert all(d.outstanding == 0 for d in pool.deployments)
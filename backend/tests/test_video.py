@@ -0,0 +1,88 @@
+import asyncio
+
+import cv2
+import numpy as np
+
+from core import video
+from core.scene import get_detector
+from core.video import _emit_keyframes
+
+def screen(dialog=None, noise=0):
+    """A 1170x2532 phone screen with a header, optionally a dialog showing `dialog`."""
+    img = np.full((2532, 1170, 3), 245, np.uint8)
+    cv2.rectangle(img, (0, 0), (1170, 180), (180, 120, 40), -1)
+    cv2.putText(img, "Outlook", (40, 120), cv2.FONT_HERSHEY_SIMPLEX, 3, (255, 255, 255), 6)
+    if dialog is not None:
+        cv2.rectangle(img, (120, 1000), (1050, 1500), (255, 255, 255), -1)
+        cv2.rectangle(img, (120, 1000), (1050, 1500), (200, 200, 200), 3)
+        cv2.putText(img, dialog, (180, 1250), cv2.FONT_HERSHEY_SIMPLEX, 2.2, (30, 30, 30), 5)
+    if noise:
+        rng = np.random.default_rng(0)
+        img = np.clip(img + rng.normal(0, noise, img.shape), 0, 255).astype(np.uint8)
+        img = cv2.imdecode(cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 60])[1], cv2.IMREAD_COLOR)
+    return img
+
+def emit(tmp_path, frames, detector="hist", min_scene_delta=None):
+    detector = get_detector(detector)
+    candidates = [(n * 1000, None if n == 0 else 50.0, frame) for n, frame in enumerate(frames)]
+    threshold = detector.default_threshold if min_scene_delta is None else min_scene_delta
+    return list(_emit_keyframes(candidates, str(tmp_path), "jpg", None, True, None, detector, threshold))
+
+def test_screens_differing_in_text_are_not_duplicates(tmp_path):
+    frames = [screen(), screen("Uploading 1 of 3"), screen(), screen("Uploading 2 of 3"), screen("Saving..."), screen("Saved")]
+    metas = emit(tmp_path, frames)
+    assert [m.get("duplicate_of") for m in metas] == [None, None, 0, None, None, None]
+
+def test_repeated_screen_is_a_duplicate_despite_noise(tmp_path):
+    frames = [screen(), screen("Password required"), screen(noise=4), screen("Password required", noise=4)]
+    metas = emit(tmp_path, frames)
+    assert [m.get("duplicate_of") for m in metas] == [None, None, 0, 1]
+    assert metas[3]["path"] == metas[1]["path"]
+    assert "image" not in metas[3]
+
+def test_duplicate_must_also_pass_the_scene_detector(tmp_path):
+    # The noisy copy is about 8 apart on the histogram
+    frames = [screen(), screen(noise=4)]
+    assert [m.get("duplicate_of") for m in emit(tmp_path, frames, min_scene_delta=25)] == [None, 0]
+    assert [m.get("duplicate_of") for m in emit(tmp_path, frames, min_scene_delta=5)] == [None, None]
+
+def test_aiter_keyframes_stays_a_bounded_distance_ahead(monkeypatch):
+    produced = []
+
+    def fake_iter_keyframes(video_path, out_dir, **kwargs):
+        for n in range(40):
+            produced.append(n)
+            yield {"index": n}
+
+    monkeypatch.setattr(video, "iter_keyframes", fake_iter_keyframes)
+
+    async def consume():
+        ahead = []
+        async for meta in video.aiter_keyframes("v.mp4", "out"):
+            await asyncio.sleep(0.005)
+            ahead.append(len(produced) - meta["index"] - 1)
+        return ahead
+
+    ahead = asyncio.run(consume())
+    assert len(ahead) == 40
+    assert max(ahead) <= video.KEYFRAME_QUEUE_SIZE + 1
+
+def test_aiter_keyframes_stops_the_decoder_when_abandoned(monkeypatch):
+    produced = []
+
+    def fake_iter_keyframes(video_path, out_dir, **kwargs):
+        for n in range(1000):
+            produced.append(n)
+            yield {"index": n}
+
+    monkeypatch.setattr(video, "iter_keyframes", fake_iter_keyframes)
+
+    async def consume():
+        frames = video.aiter_keyframes("v.mp4", "out")
+        async for meta in frames:
+            if meta["index"] == 2:
+                break
+        await frames.aclose()
+
+    asyncio.run(consume())
+    assert len(produced) <= 3 + video.KEYFRAME_QUEUE_SIZE + 1
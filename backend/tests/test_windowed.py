@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+import pytest
+
+from core.llm import _request_body
+from core.prompt import Prompt
+from core.windowed import WindowedAnalysis, merge_bugs, merge_steps, to_global
+
+SCENARIO = {"id": "s1", "source_apps": ["Outlook"], "file_size_bucket": "small", "protection_level": "none", "file_type": "docx"}
+
+def frame(index: int) -> dict:
+    return {"index": index, "ts_ms": index * 500, "image_base64": f"data:image/jpeg;base64,{index}".encode()}
+
+def analyze(frames, local: bool, size=5, overlap=1) -> dict:
+    """Run a WindowedAnalysis whose model reports one step per image and a bug on the first, by position if `local`."""
+    async def call(prompt: Prompt):
+        shown = [f for f in prompt.frames if "image_base64" in f]
+        ref = (lambda n: n) if local else (lambda n: shown[n]["index"])
+        return {
+            "bugs": [{"title": f"Toolbar clipped at {shown[0]['ts_ms']}ms", "severity": "low", "evidence_frames": [ref(0)]}],
+            "steps": [{"step_no": n + 1, "summary": f"Screen at {f['ts_ms']}ms", "frames": [ref(n)]} for n, f in enumerate(shown)],
+            "assumptions": "",
+            "metadata": {},
+        }
+
+    async def run():
+        windows = WindowedAnalysis(Prompt("system", SCENARIO, []), size, overlap, call)
+        for f in frames:
+            windows.add(f)
+        return await windows.finish(), windows.windows
+    return asyncio.run(run())
+
+@pytest.mark.parametrize("local", [False, True])
+def test_merged_output_spans_the_whole_video(local):
+    merged, windows = analyze([frame(i) for i in range(12)], local)
+    assert windows == 3
+    step_frames = [f for step in merged["steps"] for f in step["frames"]]
+    assert sorted(set(step_frames)) == list(range(12))
+    assert [step["step_no"] for step in merged["steps"]] == list(range(1, 13))
+    # One bug per window, at the window's first frame, none folded into another
+    assert [bug["evidence_frames"] for bug in merged["bugs"]] == [[0], [4], [8]]
+    assert [bug["id"] for bug in merged["bugs"]] == ["BUG-001", "BUG-002", "BUG-003"]
+
+def test_to_global_leaves_window_frames_alone():
+    frames = [frame(i) for i in range(20, 25)]
+    result = {"steps": [{"frames": [21, 22]}, {"frames": [0, 4]}, {"frames": [7]}], "bugs": [{"evidence_frames": [1]}]}
+    to_global(result, frames)
+    assert [s["frames"] for s in result["steps"]] == [[21, 22], [20, 24], [7]]
+    assert result["bugs"][0]["evidence_frames"] == [21]
+
+def test_to_global_counts_images_only():
+    frames = [frame(10), {"index": 11, "ts_ms": 5500, "duplicate_of": 10}, frame(12)]
+    result = {"steps": [{"frames": [1]}]}
+    assert to_global(result, frames)["steps"][0]["frames"] == [12]
+
+def test_images_are_labelled_with_their_frame_number():
+    body = _request_body(Prompt("system", SCENARIO, [frame(37), frame(38)]), {})
+    payload = json.loads(b"".join(chunk if isinstance(chunk, bytes) else chunk.encode() for chunk in body.chunks))
+    content = payload["messages"][1]["content"]
+    labels = [part["text"] for part in content if part["type"] == "text" and part["text"].startswith("Frame")]
+    assert labels == ["Frame 37 (t=18500ms):", "Frame 38 (t=19000ms):"]
+    kinds = [part["type"] for part in content[-4:]]
+    assert kinds == ["text", "image_url", "text", "image_url"]
+
+def test_merge_bugs_folds_overlap_repeats():
+    bugs = [
+        {"title": "Save button overlaps the title", "severity": "low", "evidence_frames": [4, 5]},
+        {"title": "Save button overlaps title", "severity": "High", "evidence_frames": [5], "description": "longer description"},
+        {"title": "Crash on open", "severity": "critical", "evidence_frames": [5]},
+    ]
+    merged = merge_bugs(bugs)
+    assert len(merged) == 2
+    assert merged[0]["evidence_frames"] == [4, 5]
+    assert merged[0]["severity"] == "High"
+    assert merged[0]["description"] == "longer description"
+
+def test_merge_steps_orders_and_renumbers():
+    steps = [
+        {"step_no": 1, "summary": "Open share sheet", "frames": [6, 7]},
+        {"step_no": 1, "summary": "Launch Outlook", "frames": [0, 1]},
+        {"step_no": 2, "summary": "Open the share sheet", "frames": [7]},
+    ]
+    merged = merge_steps(steps)
+    assert [(s["step_no"], s["summary"], s["frames"]) for s in merged] == [(1, "Launch Outlook", [0, 1]), (2, "Open share sheet", [6, 7])]
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Nightly regression: analyze every reference video in a corpus through the Batch API.
+
+Finds each directory under CORPUS that holds a video and a run config
+(e.g. Video 1/ with video1_system_config.json and video1_golden_bugs.csv),
+builds all their prompts, submits them as Batch API JSONL, polls until
+the batches are done and writes every run's llm_output.json, eval.json
+and report.html to static/runs. Prints precision/recall/F1 per video
+against its golden list. Batch requests run on the Batch API's own quota
+at a discount, leaving the interactive rate limits alone.
+
+Usage:
+    python tools/batch_regression.py CORPUS [--batch-dir DIR] [--poll-seconds 60]
+    python tools/batch_regression.py CORPUS --batch-dir DIR   # again to resume an interrupted run
+    python tools/batch_regression.py CORPUS --mock            # against tools/mock_llm.py's batch stand-in
+
+Uses the app's OPENAI_API_KEY / AZURE_OPENAI_* settings; on Azure set
+AZURE_OPENAI_BATCH_DEPLOYMENT to a Global Batch deployment.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+import uvicorn
+
+# Add parent directory to path to import core modules
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from core import executors, http_client
+from core.batch import POLL_SECONDS, discover_corpus, run_batch
+from tools.mock_llm import MockSettings, create_app
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS_DIR = os.path.join(BASE_DIR, "static", "runs")
+BATCHES_DIR = os.path.join(BASE_DIR, "static", "batches")
+
+async def regression(entries, batch_dir: str, poll_seconds: float):
+    try:
+        results = await run_batch(entries, RUNS_DIR, batch_dir, poll_seconds=poll_seconds, report=print)
+    finally:
+        await http_client.close()
+
+    print(f"{'video':<40}{'precision':>10}{'recall':>10}{'f1':>8}  llm   run")
+    for result in results:
+        with open(os.path.join(result["run_dir"], "eval.json"), "r", encoding="utf-8") as f:
+            scores = json.load(f)
+        print(f"{result['name'][:39]:<40}{scores['precision']:>10}{scores['recall']:>10}{scores['f1']:>8}  {result['run']['cache']['llm']:<5} /report/{result['run_id']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", help="Directory of reference videos, one per subdirectory")
+    parser.add_argument("--batch-dir", help="Where batch files and progress are kept (default static/batches/<time>)")
+    parser.add_argument("--poll-seconds", type=float, help=f"Default {POLL_SECONDS:g}, 1 with --mock")
+    parser.add_argument("--mock", action="store_true", help="Submit to an in-process tools/mock_llm.py instead of the configured endpoint")
+    parser.add_argument("--mock-port", type=int, default=8799)
+    args = parser.parse_args()
+
+    entries = discover_corpus(args.corpus)
+    for entry in entries:
+        if entry["video"] is None:
+            print(f"Skipping {entry['name']}: no video")
+    entries = [entry for entry in entries if entry["video"] is not None]
+    if not entries and not args.batch_dir:
+        parser.error(f"No videos with a run config under {args.corpus}")
+
+    server = None
+    if args.mock:
+        os.environ.update(OPENAI_API_KEY="mock", OPENAI_BASE_URL=f"http://127.0.0.1:{args.mock_port}/v1")
+        for name in ("AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_DEPLOYMENT", "AZURE_OPENAI_DEPLOYMENTS"):
+            os.environ.pop(name, None)
+        server = uvicorn.Server(uvicorn.Config(create_app(MockSettings(latency="fixed:0.2")), port=args.mock_port, log_level="warning"))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+
+    batch_dir = args.batch_dir or os.path.join(BATCHES_DIR, time.strftime("%Y%m%d-%H%M%S"))
+    try:
+        poll_seconds = args.poll_seconds or (1 if args.mock else POLL_SECONDS)
+        asyncio.run(regression(entries, batch_dir, poll_seconds))
+    finally:
+        executors.shutdown()
+        if server is not None:
+            server.should_exit = True
+
+if __name__ == "__main__":
+    main()
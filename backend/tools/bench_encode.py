@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark prompt image encoding in core.prompt.
+
+Encodes 20, 50 and 100 phone-resolution keyframes serially (the original
+encode_frame loop) and with encode_frames() on a thread pool, both from
+keyframe files on disk and from decoded frames held in memory, and checks
+that both paths produce identical entries in the same order.
+
+Usage:
+    python tools/bench_encode.py [--counts 20 50 100] [--workers 4] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# Add parent directory to path to import core modules
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from core.prompt import encode_frame, encode_frames
+
+PHONE_SIZE = (1170, 2532)
+
+def make_frames(out_dir: str, count: int, size=PHONE_SIZE):
+    """Screenshot-like frames: flat background, a few blocks and some text."""
+    w, h = size
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(count):
+        img = np.full((h, w, 3), rng.integers(180, 255, 3), dtype=np.uint8)
+        for _ in range(6):
+            x, y = int(rng.integers(0, w - 300)), int(rng.integers(0, h - 200))
+            cv2.rectangle(img, (x, y), (x + 300, y + 200), tuple(int(c) for c in rng.integers(0, 255, 3)), -1)
+        for row in range(20):
+            cv2.putText(img, f"frame {i} row {row}", (40, 120 + row * 110), cv2.FONT_HERSHEY_SIMPLEX, 2, (20, 20, 20), 3)
+        path = os.path.join(out_dir, f"kf_{i:05d}.jpg")
+        cv2.imwrite(path, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        frames.append({"index": i, "ts_ms": i * 1000, "path": path, "image": img})
+    return frames
+
+def timed(fn, repeat: int):
+    best, result = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--counts", type=int, nargs="+", default=[20, 50, 100])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'frames':>6}  {'source':<7}{'serial s':>10}{'threads s':>11}{'speedup':>9}")
+    with tempfile.TemporaryDirectory() as tmp, ThreadPoolExecutor(max_workers=args.workers) as pool:
+        all_frames = make_frames(tmp, max(args.counts))
+        for count in args.counts:
+            for source in ("file", "memory"):
+                frames = [
+                    f if source == "memory" else {k: v for k, v in f.items() if k != "image"}
+                    for f in all_frames[:count]
+                ]
+                serial, expected = timed(lambda: [encode_frame(f) for f in frames], args.repeat)
+                threaded, result = timed(lambda: encode_frames(frames, pool), args.repeat)
+                assert result == expected, "parallel encoding changed the output"
+                print(f"{count:>6}  {source:<7}{serial:>10.2f}{threaded:>11.2f}{serial / threaded:>8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Measure how well the server stays responsive while analyses run.
+
+Starts the app with uvicorn, probes GET / at a fixed interval while idle,
+then again while N concurrent POST /analyze uploads are in flight, and
+prints the probe latency for both phases. With the pipeline offloaded to
+worker threads the loaded latencies should stay close to idle ones.
+
+Usage:
+    python tools/bench_event_loop.py [video.mp4] [--uploads 4] [--port 8765]
+
+Without a video path a synthetic phone-sized recording is generated. With
+no OPENAI_API_KEY set the LLM stage returns its stub, so this measures the
+local pipeline only. Artifact and LLM caches go to a temporary directory,
+so the uploads are not served from an earlier run's cache.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+
+# Add parent directory to path to import the app
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from tools.bench_keyframes import make_synthetic_video
+
+CONFIG = b"scenario_id: bench\nsource_apps: [Outlook]\nfile_size_bucket: small\nprotection_level: none\n"
+
+async def probe(client: httpx.AsyncClient, stop: asyncio.Event, interval: float = 0.05):
+    latencies = []
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        r = await client.get("/")
+        r.raise_for_status()
+        latencies.append((time.perf_counter() - t0) * 1000)
+        await asyncio.sleep(interval)
+    return latencies
+
+async def upload(client: httpx.AsyncClient, video_path: str, n: int):
+    with open(video_path, "rb") as f:
+        files = {"video": (f"bench_{n}.mp4", f, "video/mp4"), "config_text": ("config.yaml", CONFIG)}
+        r = await client.post("/analyze", files=files, timeout=600)
+    r.raise_for_status()
+
+def summary(label: str, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else max(latencies)
+    print(f"{label:<8}{len(latencies):>8}{statistics.median(latencies):>10.1f}{p95:>10.1f}{max(latencies):>10.1f}")
+
+async def bench(base_url: str, video_path: str, uploads: int, idle_seconds: float):
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe(client, stop))
+        await asyncio.sleep(idle_seconds)
+        stop.set()
+        idle = await task
+
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe(client, stop))
+        t0 = time.perf_counter()
+        await asyncio.gather(*(upload(client, video_path, n) for n in range(uploads)))
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        loaded = await task
+
+    print(f"{uploads} concurrent uploads finished in {elapsed:.1f}s")
+    print(f"{'GET /':<8}{'probes':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    summary("idle", idle)
+    summary("loaded", loaded)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video", nargs="?", help="Video to upload (synthetic if omitted)")
+    parser.add_argument("--uploads", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--idle-seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Set before the app is imported: the pipeline and LLM modules read them at import
+        os.environ.update(CACHE_DIR=os.path.join(tmp, "cache"), LLM_CACHE_DIR=os.path.join(tmp, "llm_cache"))
+        from app import app
+        server = uvicorn.Server(uvicorn.Config(app, port=args.port, log_level="warning"))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.05)
+
+        try:
+            video_path = args.video or make_synthetic_video(os.path.join(tmp, "synthetic.mp4"), seconds=20, size=(1170, 2532))
+            asyncio.run(bench(f"http://127.0.0.1:{args.port}", video_path, args.uploads, args.idle_seconds))
+        finally:
+            server.should_exit = True
+            thread.join()
+
+if __name__ == "__main__":
+    main()
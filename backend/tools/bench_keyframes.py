@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark the keyframe sampling modes of core.video.extract_keyframes.
+
+Compares wall time and CPU time of the original read-every-frame loop
+against grab()-based fast skipping and timestamp seeking.
+
+Usage:
+    python tools/bench_keyframes.py [video.mp4] [--fps-cap 1.0] [--repeat 3]
+
+Without a video path a synthetic 60 fps phone-sized recording is generated.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+# Add parent directory to path to import core modules
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from core.video import extract_keyframes, SAMPLING_MODES
+
+def make_synthetic_video(path: str, seconds: int = 30, fps: int = 60, size=(585, 1266), seed: int = 0) -> str:
+    """Write a screen-recording-like video: flat screens that change every few seconds."""
+    w, h = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (w, h))
+    rng = np.random.default_rng(seed)
+    screen = None
+    for i in range(seconds * fps):
+        if i % (fps * 3) == 0:
+            screen = np.full((h, w, 3), rng.integers(0, 255, 3), dtype=np.uint8)
+            cv2.rectangle(screen, (40, h // 3), (w - 40, h // 2), tuple(int(c) for c in rng.integers(0, 255, 3)), -1)
+        frame = screen.copy()
+        cv2.putText(frame, f"{i:05d}", (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+        writer.write(frame)
+    writer.release()
+    return path
+
+def bench(video_path: str, fps_cap: float, repeat: int):
+    results = {}
+    for mode in SAMPLING_MODES:
+        walls, cpus = [], []
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as out_dir:
+                w0, c0 = time.perf_counter(), time.process_time()
+                frames = extract_keyframes(video_path, out_dir, fps_cap=fps_cap, sampling=mode)
+                walls.append(time.perf_counter() - w0)
+                cpus.append(time.process_time() - c0)
+        results[mode] = (min(walls), min(cpus), [(f["index"], f["ts_ms"]) for f in frames])
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video", nargs="?", help="Video to benchmark (synthetic if omitted)")
+    parser.add_argument("--fps-cap", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video_path = args.video or make_synthetic_video(os.path.join(tmp, "synthetic.mp4"))
+        results = bench(video_path, args.fps_cap, args.repeat)
+
+    base_wall, base_cpu, base_frames = results["read"]
+    print(f"{'mode':<8}{'wall (s)':>10}{'cpu (s)':>10}{'speedup':>10}  frames")
+    for mode, (wall, cpu, frames) in results.items():
+        same = "same" if frames == base_frames else "DIFFERENT"
+        print(f"{mode:<8}{wall:>10.2f}{cpu:>10.2f}{base_wall / wall:>9.1f}x  {len(frames)} ({same})")
+
+if __name__ == "__main__":
+    main()
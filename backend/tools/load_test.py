@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Push concurrent /analyze uploads through the full pipeline against a mock LLM.
+
+Starts tools/mock_llm.py and the app in this process, sends --uploads
+uploads with at most --concurrency in flight, and prints end-to-end
+latency and throughput with the mock's and the app's LLM counters, so
+capacity can be planned without credentials or quota. Each upload is a
+different synthetic recording (unless --same-video) and asks for
+llm_cache: bypass, so every one runs keyframes, encoding and an LLM call.
+
+Usage:
+    python tools/load_test.py [video.mp4] [--uploads 20] [--concurrency 4] [--latency lognormal:1.5,0.4] [--rate-429 0.05]
+    python tools/load_test.py --replay recordings/      # recorded answers from tools/mock_llm.py --record
+    python tools/load_test.py --llm-url http://127.0.0.1:8799/v1   # a mock started separately
+
+Artifact and LLM caches go to a temporary directory; run outputs land in
+static/runs as for any other upload.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+
+# Add parent directory to path to import the app
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from tools.bench_keyframes import make_synthetic_video
+from tools.mock_llm import add_arguments, create_app, settings_from_args
+
+CONFIG = "scenario_id: load_{n}\nsource_apps: [Outlook]\nfile_size_bucket: small\nprotection_level: none\nllm_cache: bypass\nstream: {stream}\n"
+
+async def upload(client: httpx.AsyncClient, video_path: str, n: int, stream: bool, limit: asyncio.Semaphore):
+    async with limit:
+        config = CONFIG.format(n=n, stream=str(stream).lower()).encode()
+        t0 = time.perf_counter()
+        try:
+            with open(video_path, "rb") as f:
+                files = {"video": (f"load_{n}.mp4", f, "video/mp4"), "config_text": ("config.yaml", config)}
+                r = await client.post("/analyze", files=files, timeout=1800)
+            ok = r.status_code == 200
+        except httpx.HTTPError as e:
+            print(f"upload {n} failed: {e}")
+            ok = False
+        return time.perf_counter() - t0, ok
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, int(len(ordered) * pct / 100 + 0.5) - 1)]
+
+async def run(base_url: str, llm_url: str, videos, uploads: int, concurrency: int, stream: bool):
+    limit = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(
+            upload(client, videos[n % len(videos)], n, stream, limit) for n in range(uploads)
+        ))
+        elapsed = time.perf_counter() - t0
+        app_stats = (await client.get("/stats")).json()
+    mock_stats = None
+    if llm_url.startswith("http://127.0.0.1"):
+        async with httpx.AsyncClient() as client:
+            r = await client.get(llm_url.rsplit("/v1", 1)[0] + "/mock/stats")
+            mock_stats = r.json() if r.status_code == 200 else None
+
+    latencies = [t for t, ok in results if ok]
+    failed = sum(1 for _, ok in results if not ok)
+    print(f"{uploads} uploads, {concurrency} concurrent, {elapsed:.1f}s: {len(latencies) / elapsed * 60:.1f} analyses/min, {failed} failed")
+    if latencies:
+        print(f"{'upload':<8}{'p50 s':>10}{'p95 s':>10}{'max s':>10}")
+        print(f"{'':<8}{statistics.median(latencies):>10.2f}{percentile(latencies, 95):>10.2f}{max(latencies):>10.2f}")
+    if mock_stats:
+        print("mock:", ", ".join(f"{k}={v}" for k, v in mock_stats.items()))
+    rate = app_stats.get("llm_rate", {})
+    http = app_stats.get("llm_http", {})
+    print("app llm_rate:", ", ".join(f"{k}={v}" for k, v in rate.items() if not isinstance(v, dict)))
+    print("app llm_http:", ", ".join(f"{k}={v}" for k, v in http.items() if not isinstance(v, dict)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video", nargs="?", help="Video to upload (synthetic if omitted)")
+    parser.add_argument("--uploads", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--same-video", action="store_true", help="Upload one synthetic recording every time (keyframes then come from the artifact cache)")
+    parser.add_argument("--seconds", type=int, default=15, help="Length of the synthetic recordings")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="Ask for unstreamed completions")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mock-port", type=int, default=8799)
+    parser.add_argument("--llm-url", help="OpenAI-compatible base URL to use instead of starting the mock")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Set before the app is imported: the pipeline and LLM modules read them at import
+        llm_url = args.llm_url or f"http://127.0.0.1:{args.mock_port}/v1"
+        os.environ.update(
+            OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "mock") if args.llm_url else "mock",
+            OPENAI_BASE_URL=llm_url,
+            CACHE_DIR=os.path.join(tmp, "cache"),
+            LLM_CACHE_DIR=os.path.join(tmp, "llm_cache"),
+        )
+        for name in ("AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_DEPLOYMENT", "AZURE_OPENAI_DEPLOYMENTS"):
+            os.environ.pop(name, None)
+
+        servers = []
+        if not args.llm_url:
+            try:
+                settings = settings_from_args(args)
+            except ValueError as e:
+                parser.error(str(e))
+            servers.append(uvicorn.Server(uvicorn.Config(create_app(settings), port=args.mock_port, log_level="warning")))
+        from app import app
+        servers.append(uvicorn.Server(uvicorn.Config(app, port=args.port, log_level="warning")))
+        threads = [threading.Thread(target=server.run, daemon=True) for server in servers]
+        for server, thread in zip(servers, threads):
+            thread.start()
+            while not server.started:
+                time.sleep(0.05)
+
+        try:
+            if args.video:
+                videos = [args.video]
+            else:
+                count = 1 if args.same_video else args.uploads
+                videos = [
+                    make_synthetic_video(os.path.join(tmp, f"synthetic_{n}.mp4"), seconds=args.seconds, seed=n)
+                    for n in range(count)
+                ]
+            asyncio.run(run(f"http://127.0.0.1:{args.port}", llm_url, videos, args.uploads, args.concurrency, args.stream))
+        finally:
+            for server, thread in zip(servers, threads):
+                server.should_exit = True
+                thread.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Local OpenAI/Azure-compatible chat-completions server for offline runs.
+
+Serves POST /v1/chat/completions (OpenAI) and
+POST /openai/deployments/{deployment}/chat/completions (Azure), streamed
+or not, plus the Batch API's files and batches routes (under /v1 and
+/openai), so the pipeline can be driven without credentials or quota:
+
+- synthetic mode (default) answers every request with a small valid
+  analysis of the frames it was sent, after a latency drawn from
+  --latency, and injects 429s (--rate-429, or a real --rpm limit) and
+  malformed JSON (--malformed) at the given rates
+- --record DIR --upstream ORIGIN forwards each request to a real endpoint
+  and saves the request/response pair under DIR, keyed by the request
+- --replay DIR answers from those recordings
+- batches are answered line by line the same way, all at once after
+  --batch-latency seconds
+
+Every random choice is seeded by --seed, the request and how many times
+that request has been seen, so a run is reproducible whatever order
+concurrent requests arrive in.
+
+Usage:
+    python tools/mock_llm.py [--port 8799] [--latency lognormal:2,0.4] [--rate-429 0.05] [--malformed 0.02]
+    python tools/mock_llm.py --record recordings/ --upstream https://your-resource.openai.azure.com
+    python tools/mock_llm.py --replay recordings/ [--latency fixed:0.5]
+
+Point the app at it with OPENAI_API_KEY=mock and
+OPENAI_BASE_URL=http://127.0.0.1:8799/v1, or for the Azure path
+AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8799/ and any
+AZURE_OPENAI_DEPLOYMENT. Counters are at GET /mock/stats.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal")
+MALFORMED_KINDS = ("truncated", "prose", "trailing_comma", "fenced")
+# Request fields that do not change the answer: the same request is
+# recorded and replayed whether streamed, and on either endpoint style
+UNKEYED_FIELDS = ("stream", "stream_options", "model")
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    A latency sampler from "fixed:S", "uniform:LOW,HIGH", "normal:MEAN,SD"
+    or "lognormal:MEDIAN,SIGMA" (seconds; a bare number is fixed).
+    """
+    kind, _, args = spec.partition(":")
+    if not args:
+        kind, args = "fixed", kind
+    try:
+        values = [float(v) for v in args.split(",")]
+    except ValueError:
+        raise ValueError(f"Invalid latency {spec!r}")
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(*values)
+    if kind == "normal" and len(values) == 2:
+        return lambda rng: max(0.0, rng.gauss(*values))
+    if kind == "lognormal" and len(values) == 2:
+        median, sigma = values
+        return lambda rng: median * rng.lognormvariate(0, sigma)
+    raise ValueError(f"Invalid latency {spec!r}: expected one of {LATENCY_DISTRIBUTIONS} with its parameters")
+
+def request_key(body: Dict) -> str:
+    """Hash of the request as far as the answer depends on it."""
+    keyed = {k: v for k, v in body.items() if k not in UNKEYED_FIELDS}
+    return hashlib.sha256(json.dumps(keyed, sort_keys=True).encode("utf-8")).hexdigest()
+
+def synthesize(body: Dict) -> str:
+    """A small, valid analysis citing the frames in the request."""
+    content = body["messages"][-1]["content"]
+    parts = content if isinstance(content, list) else [{"type": "text", "text": content}]
+    text = " ".join(p.get("text", "") for p in parts if p.get("type") == "text")
+    images = sum(1 for p in parts if p.get("type") == "image_url")
+    frames = sorted({int(i) for pair in re.findall(r'[Ff]rame (\d+)|"index": (\d+)', text) for i in pair if i})
+    frames = frames or list(range(max(images, 1)))
+    steps = [
+        {"step_no": n + 1, "summary": f"Screen at frame {frame}", "frames": [frame]}
+        for n, frame in enumerate(frames[:8])
+    ]
+    bugs = [{
+        "id": "BUG-001",
+        "title": "Preview shows a blank screen before the file loads",
+        "severity": "medium",
+        "description": "Mock finding for load testing.",
+        "evidence_frames": frames[-2:],
+    }]
+    return json.dumps({
+        "bugs": bugs,
+        "steps": steps,
+        "assumptions": "Generated by tools/mock_llm.py",
+        "metadata": {"model_hint": "mock", "version": "v0"},
+    }, indent=2)
+
+def malform(content: str, rng: random.Random) -> str:
+    """The content broken in one of the ways models break JSON."""
+    kind = rng.choice(MALFORMED_KINDS)
+    if kind == "truncated":
+        return content[:rng.randint(1, max(1, len(content) - 1))]
+    if kind == "prose":
+        return "Here is the analysis you asked for:\n" + content
+    if kind == "trailing_comma":
+        return content.rstrip()[:-1].rstrip() + ",\n}"
+    return f"```json\n{content}\n```"
+
+class MockSettings:
+    """What the mock server does; see the module docstring."""
+    def __init__(
+        self,
+        latency: str = "lognormal:1.5,0.4",
+        first_token: float = 0.3,
+        rate_429: float = 0.0,
+        retry_after: float = 1.0,
+        rpm: int = 0,
+        malformed: float = 0.0,
+        stream_chunk: int = 24,
+        seed: int = 0,
+        record: Optional[str] = None,
+        upstream: Optional[str] = None,
+        replay: Optional[str] = None,
+        replay_miss: str = "error",
+        batch_latency: float = 2.0,
+    ):
+        if record and not upstream:
+            raise ValueError("--record needs --upstream")
+        if record and replay:
+            raise ValueError("--record and --replay are exclusive")
+        self.latency = parse_latency(latency)
+        self.first_token = first_token
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.rpm = rpm
+        self.malformed = malformed
+        self.stream_chunk = stream_chunk
+        self.seed = seed
+        self.record = record
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.replay = replay
+        self.replay_miss = replay_miss
+        self.batch_latency = batch_latency
+
+def create_app(settings: MockSettings) -> FastAPI:
+    app = FastAPI(title="Mock LLM")
+    seen: Dict[str, int] = {}
+    files: Dict[str, bytes] = {}
+    batches: Dict[str, Dict] = {}
+    running = set()
+    window: List[float] = []
+    latencies: List[float] = []
+    counters = {
+        "requests": 0,
+        "ok": 0,
+        "streamed": 0,
+        "throttled": 0,
+        "malformed": 0,
+        "recorded": 0,
+        "replayed": 0,
+        "replay_misses": 0,
+        "upstream_errors": 0,
+        "batches": 0,
+        "batch_requests": 0,
+    }
+    if settings.record:
+        os.makedirs(settings.record, exist_ok=True)
+
+    def rpm_headers() -> Dict[str, str]:
+        if not settings.rpm:
+            return {}
+        now = time.monotonic()
+        window[:] = [t for t in window if now - t < 60]
+        reset = 60 - (now - window[0]) if window else 0
+        return {
+            "x-ratelimit-limit-requests": str(settings.rpm),
+            "x-ratelimit-remaining-requests": str(max(0, settings.rpm - len(window))),
+            "x-ratelimit-reset-requests": f"{reset:.1f}s",
+        }
+
+    def throttled(seconds: float) -> JSONResponse:
+        counters["throttled"] += 1
+        return JSONResponse(
+            {"error": {"code": "429", "message": "Rate limit exceeded (mock)"}},
+            status_code=429,
+            headers={**rpm_headers(), "retry-after": str(max(1, round(seconds))), "retry-after-ms": str(int(seconds * 1000))},
+        )
+
+    async def forward(request: Request, body: Dict, key: str) -> Optional[Dict]:
+        """Send the request upstream unstreamed and record a successful answer."""
+        headers = {k: v for k, v in request.headers.items() if k.lower() in ("api-key", "authorization")}
+        url = settings.upstream + request.url.path + (f"?{request.url.query}" if request.url.query else "")
+        upstream_body = {k: v for k, v in body.items() if k not in ("stream", "stream_options")}
+        started = time.perf_counter()
+        async with httpx.AsyncClient(timeout=300) as client:
+            response = await client.post(url, json=upstream_body, headers=headers)
+        if response.status_code >= 400:
+            counters["upstream_errors"] += 1
+            return {"status": response.status_code, "body": response.json(), "headers": dict(response.headers)}
+        data = response.json()
+        record = {
+            "key": key,
+            "path": request.url.path,
+            "latency_s": round(time.perf_counter() - started, 3),
+            "recorded_at": time.time(),
+            "request": body,
+            "response": data,
+        }
+        path = os.path.join(settings.record, f"{key}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(record, f)
+        os.replace(path + ".tmp", path)
+        counters["recorded"] += 1
+        return {"status": 200, "body": data}
+
+    def replayed(key: str) -> Optional[Dict]:
+        path = os.path.join(settings.replay, f"{key}.json")
+        if not os.path.exists(path):
+            counters["replay_misses"] += 1
+            return None
+        with open(path) as f:
+            counters["replayed"] += 1
+            return json.load(f)["response"]
+
+    def answer(body: Dict, key: str) -> Optional[str]:
+        """Synthetic or replayed content for a request; None for a replay miss that is an error."""
+        data = replayed(key) if settings.replay else None
+        if settings.replay and data is None and settings.replay_miss == "error":
+            return None
+        return data["choices"][0]["message"]["content"] if data else synthesize(body)
+
+    def maybe_malform(content: str, rng: random.Random) -> str:
+        if rng.random() < settings.malformed:
+            counters["malformed"] += 1
+            return malform(content, rng)
+        return content
+
+    def request_rng(key: str) -> random.Random:
+        n = seen[key] = seen.get(key, 0) + 1
+        return random.Random(f"{settings.seed}:{key}:{n}")
+
+    def completion(content: str, body: Dict) -> Dict:
+        prompt_tokens = len(json.dumps(body)) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    async def stream(content: str, body: Dict, latency: float, azure: bool):
+        # Azure opens with an event carrying only prompt filter results
+        if azure:
+            yield f"data: {json.dumps({'choices': [], 'prompt_filter_results': []})}\n\n"
+        pieces = [content[i:i + settings.stream_chunk] for i in range(0, len(content), settings.stream_chunk)] or [""]
+        gap = latency * (1 - settings.first_token) / len(pieces)
+        for piece in pieces:
+            chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": piece}}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(gap)
+        yield f"data: {json.dumps({'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n"
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield f"data: {json.dumps({'choices': [], 'usage': completion(content, body)['usage']})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    async def chat_completions(request: Request, azure: bool):
+        body = await request.json()
+        counters["requests"] += 1
+        key = request_key(body)
+        rng = request_rng(key)
+
+        if settings.rpm:
+            rpm_headers()
+            if len(window) >= settings.rpm:
+                return throttled(60 - (time.monotonic() - window[0]))
+            window.append(time.monotonic())
+        if rng.random() < settings.rate_429:
+            return throttled(settings.retry_after)
+
+        started = time.perf_counter()
+        if settings.record:
+            forwarded = await forward(request, body, key)
+            if forwarded["status"] != 200:
+                return JSONResponse(forwarded["body"], status_code=forwarded["status"])
+            content = forwarded["body"]["choices"][0]["message"]["content"]
+            latency = 0.0
+        else:
+            content = answer(body, key)
+            if content is None:
+                return JSONResponse({"error": {"code": "404", "message": f"No recording for request {key}"}}, status_code=404)
+            latency = settings.latency(rng)
+        content = maybe_malform(content, rng)
+
+        counters["ok"] += 1
+        if body.get("stream"):
+            counters["streamed"] += 1
+            await asyncio.sleep(latency * settings.first_token)
+            latencies.append(latency)
+            return StreamingResponse(stream(content, body, latency, azure), media_type="text/event-stream", headers=rpm_headers())
+        await asyncio.sleep(max(0.0, latency - (time.perf_counter() - started)))
+        latencies.append(time.perf_counter() - started)
+        return JSONResponse(completion(content, body), headers=rpm_headers())
+
+    @app.post("/v1/chat/completions")
+    async def openai_chat(request: Request):
+        return await chat_completions(request, azure=False)
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def azure_chat(request: Request, deployment: str):
+        return await chat_completions(request, azure=True)
+
+    async def upload_file(request: Request):
+        form = await request.form()
+        upload = form["file"]
+        data = await upload.read()
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        files[file_id] = data
+        return {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(data),
+            "created_at": int(time.time()),
+            "filename": upload.filename,
+            "purpose": form.get("purpose", "batch"),
+            "status": "processed",
+        }
+
+    async def file_content(file_id: str):
+        if file_id not in files:
+            return JSONResponse({"error": {"code": "404", "message": f"No file {file_id}"}}, status_code=404)
+        return Response(files[file_id], media_type="application/octet-stream")
+
+    async def process(batch: Dict):
+        batch.update(status="in_progress", in_progress_at=int(time.time()))
+        results, failed = [], 0
+        for line in files[batch["input_file_id"]].splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            body = item["body"]
+            key = request_key(body)
+            rng = request_rng(key)
+            content = answer(body, key)
+            if content is None:
+                failed += 1
+                response = {"status_code": 404, "body": {"error": {"code": "404", "message": f"No recording for request {key}"}}}
+            else:
+                response = {"status_code": 200, "request_id": uuid.uuid4().hex, "body": completion(maybe_malform(content, rng), body)}
+            results.append({"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": item["custom_id"], "response": response, "error": None})
+        # The whole batch turns around at once, as a real one does
+        await asyncio.sleep(settings.batch_latency)
+        output_file_id = f"file-{uuid.uuid4().hex[:24]}"
+        files[output_file_id] = "".join(json.dumps(r) + "\n" for r in results).encode("utf-8")
+        counters["batch_requests"] += len(results)
+        batch.update(
+            status="completed",
+            output_file_id=output_file_id,
+            completed_at=int(time.time()),
+            request_counts={"total": len(results), "completed": len(results) - failed, "failed": failed},
+        )
+
+    async def create_batch(request: Request):
+        body = await request.json()
+        if settings.record:
+            return JSONResponse({"error": {"code": "400", "message": "Record mode does not take batches"}}, status_code=400)
+        if body.get("input_file_id") not in files:
+            return JSONResponse({"error": {"code": "404", "message": f"No file {body.get('input_file_id')}"}}, status_code=404)
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}",
+            "object": "batch",
+            "endpoint": body.get("endpoint"),
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        batches[batch["id"]] = batch
+        counters["batches"] += 1
+        task = asyncio.create_task(process(batch))
+        running.add(task)
+        task.add_done_callback(running.discard)
+        return batch
+
+    async def get_batch(batch_id: str):
+        if batch_id not in batches:
+            return JSONResponse({"error": {"code": "404", "message": f"No batch {batch_id}"}}, status_code=404)
+        return batches[batch_id]
+
+    for prefix in ("/v1", "/openai"):
+        app.add_api_route(f"{prefix}/files", upload_file, methods=["POST"])
+        app.add_api_route(f"{prefix}/files/{{file_id}}/content", file_content, methods=["GET"])
+        app.add_api_route(f"{prefix}/batches", create_batch, methods=["POST"])
+        app.add_api_route(f"{prefix}/batches/{{batch_id}}", get_batch, methods=["GET"])
+
+    @app.get("/mock/stats")
+    async def stats():
+        ordered = sorted(latencies)
+        return {
+            **counters,
+            "latency_p50_s": round(statistics.median(ordered), 3) if ordered else None,
+            "latency_p95_s": round(ordered[max(0, int(len(ordered) * 0.95) - 1)], 3) if ordered else None,
+        }
+
+    return app
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """The mock's options, shared with tools/load_test.py."""
+    parser.add_argument("--latency", default="lognormal:1.5,0.4", help=f"Latency distribution, one of {LATENCY_DISTRIBUTIONS} (e.g. fixed:1, uniform:0.5,3)")
+    parser.add_argument("--first-token", type=float, default=0.3, help="Share of a streamed call's latency spent before the first chunk")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After sent with injected 429s (seconds)")
+    parser.add_argument("--rpm", type=int, default=0, help="Enforce a requests-per-minute limit with 429s and x-ratelimit headers")
+    parser.add_argument("--malformed", type=float, default=0.0, help=f"Share of answers broken in one of {MALFORMED_KINDS}")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--record", metavar="DIR", help="Forward to --upstream and save request/response pairs here")
+    parser.add_argument("--upstream", metavar="ORIGIN", help="Real endpoint origin to record from, e.g. https://your-resource.openai.azure.com")
+    parser.add_argument("--replay", metavar="DIR", help="Answer from recordings saved with --record")
+    parser.add_argument("--replay-miss", choices=("error", "synthetic"), default="error", help="Answer to a request with no recording")
+    parser.add_argument("--batch-latency", type=float, default=2.0, help="Seconds a batch takes to complete")
+
+def settings_from_args(args: argparse.Namespace) -> MockSettings:
+    return MockSettings(
+        latency=args.latency,
+        first_token=args.first_token,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after,
+        rpm=args.rpm,
+        malformed=args.malformed,
+        seed=args.seed,
+        record=args.record,
+        upstream=args.upstream,
+        replay=args.replay,
+        replay_miss=args.replay_miss,
+        batch_latency=args.batch_latency,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8799)
+    add_arguments(parser)
+    args = parser.parse_args()
+    try:
+        settings = settings_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Mock LLM on http://127.0.0.1:{args.port} (OPENAI_BASE_URL=http://127.0.0.1:{args.port}/v1)", file=sys.stderr)
+    uvicorn.run(create_app(settings), port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()